@@ -0,0 +1,116 @@
+import json
+import time
+import argparse
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Generador de carga para el servidor local (python -m src.server)
+# Ejemplo: python extra/load_generator.py --requests 500 --concurrency 16 --method hybrid
+
+QUESTIONS_PATH = "./data/questions.json"
+READY_TIMEOUT = 600  # segundos esperando a que el servidor termine de calentar el motor
+
+
+def send(url, payload, timeout):
+    """Envía una petición y devuelve (latencia en s, ok)."""
+    data = json.dumps(payload).encode("utf-8")
+    request = urllib.request.Request(url, data, {"Content-Type": "application/json"})
+    start_ts = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        return time.perf_counter() - start_ts, True
+    except Exception:
+        return time.perf_counter() - start_ts, False
+
+
+def wait_until_ready(base_url, timeout=READY_TIMEOUT, interval=1.0):
+    """Espera a que GET /health responda 200 (el servidor abre el puerto antes de calentar el motor)."""
+    url = base_url.rstrip("/") + "/health"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=interval) as response:
+                if response.status == 200:
+                    return
+        except urllib.error.HTTPError as e:
+            body = json.loads(e.read() or b"{}")
+            if body.get("status") == "error":
+                raise RuntimeError(f"El servidor no pudo calentar el motor: {body.get('error')}")
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"El servidor no está listo tras {timeout}s ({url})")
+        time.sleep(interval)
+
+
+def run_load(base_url, n_requests, concurrency, method, with_llm=False, timeout=60):
+    """
+    Lanza n_requests preguntas del dataset con 'concurrency' clientes simultáneos.
+
+    Returns:
+        dict: throughput (peticiones/s), percentiles de latencia (ms) y errores
+    """
+    with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    payloads = []
+    for i in range(n_requests):
+        q = questions[i % len(questions)]
+        payload = {"question": q["question"], "method": method, "retrieval_only": not with_llm}
+        if with_llm:
+            payload["options"] = q["answers"]
+        payloads.append(payload)
+
+    wait_until_ready(base_url)
+    url = base_url.rstrip("/") + "/query"
+    print(f"\n🚦 {n_requests} peticiones a {url} con {concurrency} clientes (método {method}, "
+          f"{'con' if with_llm else 'sin'} LLM)")
+
+    start_ts = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda p: send(url, p, timeout), payloads))
+    elapsed = time.perf_counter() - start_ts
+
+    latencies = np.array([latency for latency, ok in results if ok]) * 1000
+    report = {
+        "requests": n_requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+    if len(latencies):
+        report.update({f"p{q}_ms": round(float(np.percentile(latencies, q)), 2) for q in (50, 90, 95, 99)})
+        report["max_ms"] = round(float(latencies.max()), 2)
+
+    print(f"   -> {report['throughput_rps']} peticiones/s | errores: {report['errors']}")
+    if len(latencies):
+        print(f"   -> Latencia p50 {report['p50_ms']} ms | p95 {report['p95_ms']} ms | p99 {report['p99_ms']} ms")
+
+    # Métricas del lado del servidor (tamaño medio de lote, latencia de recuperación)
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + "/metrics", timeout=timeout) as response:
+            server_metrics = json.load(response)
+        print(f"   -> Servidor: {server_metrics['batches']} lotes, tamaño medio {server_metrics['mean_batch_size']}")
+        report["server"] = server_metrics
+    except Exception as e:
+        print(f"   ⚠️ No se pudieron leer las métricas del servidor: {e}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generador de carga para el servidor RAG")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--method", default="hybrid")
+    parser.add_argument("--llm", action="store_true", help="Pide también la respuesta del LLM (consume cuota)")
+    parser.add_argument("--output", default=None, help="Guarda el informe en JSON")
+    args = parser.parse_args()
+
+    report = run_load(args.url, args.requests, args.concurrency, args.method, args.llm)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
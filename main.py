@@ -1,13 +1,27 @@
 import os
-import sys
+import json
+import argparse
 from dotenv import load_dotenv
 import pandas as pd
 from src.evaluation import generate_dashboard, evaluate_results
 from src.launcher import setup_enviroment
 from src.queries import run_questions
+from src.results_store import save_results, ResultLog, RESULTS_FILE, PARTIAL_FILE
+from src.parallel import run_parallel_repetitions, ParallelRunner, QUESTIONS_PATH, DEFAULT_METHODS
+from src.early_stopping import run_adaptive_repetitions, TARGET_CI_WIDTH
+from src.sweep import current_config, save_run_config
+from src.live_dashboard import LiveDashboard
+from src.profiling import StageProfiler, profile_stage, PROFILE_DIR, PROFILE_MODES
+from src.rag_pipeline import ANSWER_MODE_ENV, ANSWER_MODES
+from src.context import CONTEXT_TOKEN_BUDGET_ENV
 
 #Ejecutar python main.py
 #En caso de querer guardar los resultados de la ejecucion de antemano: pyhton main.py nombre_carpeta o bien "Nombre carpeta"
+#Para repartir las repeticiones entre varios procesos: python main.py nombre_carpeta --workers 4
+#Para perfilar por etapas (results/.../profile): python main.py nombre_carpeta --profile [sample|cprofile]
+#Para parar las repeticiones cuando la accuracy ya es estable: python main.py nombre_carpeta --adaptive
+#Para respuestas en streaming cortadas en la primera letra válida: python main.py nombre_carpeta --answer-mode stream
+#Para limitar el contexto enviado al LLM (por defecto sin límite): python main.py nombre_carpeta --token-budget 3000
 
 # Cargar clave API
 load_dotenv()
@@ -15,19 +29,48 @@ API_KEY = os.getenv("GOOGLE_API_KEY")
 
 def build_paths(base_dir):
     """Genera las rutas de salida según carpeta seleccionada."""
-    final_file = os.path.join(base_dir, "resultados_finales.csv")
-    return final_file, "./results/resultados_parciales.csv"
-
-def multiple_runs(n = 10):
+    final_file = os.path.join(base_dir, RESULTS_FILE)
+    return final_file, os.path.join(base_dir, PARTIAL_FILE)
+
+def parse_args():
+    """Argumentos de línea de comandos: carpeta de resultados (opcional) y paralelismo."""
+    parser = argparse.ArgumentParser(description="Evaluación RAG UCM")
+    parser.add_argument("test_name", nargs="?", default=None,
+                        help="Carpeta en results/persistent_results (si no se indica, modo local)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos en paralelo para las repeticiones (1 = secuencial)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Trozos de preguntas por repetición en modo paralelo")
+    parser.add_argument("--profile", nargs="?", const="sample", default=None, choices=PROFILE_MODES,
+                        help="Perfil por etapas: muestreo de pila (sample, por defecto) o cProfile")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Repeticiones con parada temprana (pares convergidos y objetivo de intervalo)")
+    parser.add_argument("--target-ci", type=float, default=TARGET_CI_WIDTH,
+                        help="Anchura objetivo del intervalo de accuracy por método (con --adaptive)")
+    parser.add_argument("--answer-mode", default=None, choices=ANSWER_MODES,
+                        help="Respuesta del LLM y del juez: completa (full) o en streaming con parada temprana (stream)")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="Máximo de tokens del contexto (por defecto sin límite; queda en config.json)")
+    return parser.parse_args()
+
+def multiple_runs(n = 10, workers = 1, shards = 1):
     print("\n🧪 INICIANDO MUESTREO RAG UCM...")
+    args = parse_args()
+    if args.answer_mode:
+        # Por entorno: lo heredan también los workers de las ejecuciones en paralelo
+        os.environ[ANSWER_MODE_ENV] = args.answer_mode
+    if args.token_budget:
+        # Por entorno, como el modo de respuesta: lo heredan los workers
+        os.environ[CONTEXT_TOKEN_BUDGET_ENV] = str(args.token_budget)
     
     #miramos si queremos resultados persistentes o no
-    if len(sys.argv) > 1:
-        test_name = sys.argv[1]
+    if args.test_name:
+        test_name = args.test_name
         results_dir = f"./results/persistent_results/{test_name}"
         clear_results = False
-        print(f"📁 Modo PERSISTENTE: {results_dir}")
+        print(f"📁 Modo PERSISTENTE: {results_dir} (se retoma si hay resultados parciales)")
     else:
+        test_name = "local"
         results_dir = "./results/local_results"
         clear_results = True
         print(f"📁 Modo LOCAL: {results_dir}")
@@ -41,29 +84,102 @@ def multiple_runs(n = 10):
     setup_enviroment(False, clear_results, results_dir)
 
     # --- Preguntas - cambiar el primero a None para ejecutarlo entero y lista no vacia para pruebas
-    all_results = []
-
+    workers = max(workers, args.workers)
+    shards = max(shards, args.shards)
+
+    # Configuración de la ejecución en config.json (antes se apuntaba a mano en info.txt)
+    save_run_config(results_dir, dict(current_config(), test_name=test_name, repetitions=n,
+                                      workers=workers, shards=shards, adaptive=args.adaptive,
+                                      target_ci_width=args.target_ci if args.adaptive else None))
+
+    # Dashboard en vivo (plots/live) desde agregados que se actualizan con cada fila
+    live_dashboard = LiveDashboard(results_dir, run_id=test_name)
+
+    profiler = None
+    if args.profile:
+        if workers > 1:
+            print("⚠️ --profile solo perfila este proceso: las consultas de los workers no aparecerán en el perfil.")
+        profiler = StageProfiler(os.path.join(results_dir, PROFILE_DIR), args.profile).start()
+
+    if args.adaptive:
+        # Hasta n repeticiones: los pares pregunta-método convergidos dejan de repetirse y
+        # la ejecución termina cuando el intervalo de cada método es suficientemente estrecho
+        with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+            question_ids = list(range(1, len(json.load(f)) + 1))
+
+        # Un solo log abierto en modo secuencial; en paralelo escriben los workers
+        result_log = ResultLog(PARTIAL_FILE, on_append=live_dashboard.update if workers == 1 else None)
+        previous_rows = result_log.rows(test_name)
+        if workers > 1:
+            result_log.close()
+            live_dashboard.watch(PARTIAL_FILE)
+
+        # En paralelo, un solo pool (y limitador) para todas las rondas: los motores se calientan una vez
+        runner = ParallelRunner(API_KEY, PARTIAL_FILE, test_name, workers=workers, shards=shards) if workers > 1 else None
+
+        def run_round(repetition, skip):
+            if runner is not None:
+                df = runner.run([repetition], skip=skip)
+            else:
+                df = run_questions(None, None, API_KEY, run_id=test_name, repetition=repetition,
+                                   result_log=result_log, skip=skip)
+            return df.to_dict("records")
+
+        try:
+            rows, _ = run_adaptive_repetitions(run_round, DEFAULT_METHODS, question_ids, previous_rows,
+                                               results_dir, max_repetitions=n, target_ci_width=args.target_ci)
+        finally:
+            result_log.close()
+            if runner is not None:
+                runner.close()
+            live_dashboard.stop(PARTIAL_FILE if workers > 1 else None)
+
+        df_all = pd.DataFrame(rows)
+
+    elif workers > 1:
+        # Repeticiones repartidas entre procesos, con límite global de llamadas a la API;
+        # el dashboard en vivo sigue el log que escriben los workers
+        live_dashboard.watch(PARTIAL_FILE)
+        try:
+            df_all = run_parallel_repetitions(n, API_KEY, PARTIAL_FILE, test_name, workers=workers, shards=shards)
+        finally:
+            live_dashboard.stop(PARTIAL_FILE)
+    else:
+        all_results = []
 
-    for i in range(n):
-        df = run_questions(None, None, API_KEY, PARTIAL_FILE)
-        all_results.append(df)
+        # Un único log para todas las repeticiones: lo ya hecho no se repite al relanzar
+        with ResultLog(PARTIAL_FILE, on_append=live_dashboard.update) as result_log:
+            for i in range(n):
+                df = run_questions(None, None, API_KEY, run_id=test_name, repetition=i, result_log=result_log)
+                all_results.append(df)
+        live_dashboard.stop()
 
-    df_all = pd.concat(all_results, ignore_index=True)
+        df_all = pd.concat(all_results, ignore_index=True)
 
-    # Guardar resultados finales acumulados
-    os.makedirs(os.path.dirname(FINAL_FILE), exist_ok=True)
-    df_all.to_csv(FINAL_FILE, index=False)
+    # Guardar resultados finales acumulados (Parquet + tabla de chunks)
+    with profile_stage("result_write"):
+        save_results(df_all, results_dir)
 
     # --- Evaluación y dashboard
-    evaluate_results(df_all, FINAL_FILE)
-    generate_dashboard(dir_input= FINAL_FILE, dir_output=os.path.join(results_dir, "plots"))
+    with profile_stage("dashboard"):
+        evaluate_results(df_all, FINAL_FILE)
+        generate_dashboard(dir_input= FINAL_FILE, dir_output=os.path.join(results_dir, "plots"))
+
+    if profiler is not None:
+        profiler.stop()
 
 def main():
     print("\n🧪 INICIANDO QUERY UCM...")
+    args = parse_args()
+    if args.answer_mode:
+        os.environ[ANSWER_MODE_ENV] = args.answer_mode
+    if args.token_budget:
+        # Por entorno, como el modo de respuesta: lo heredan los workers
+        os.environ[CONTEXT_TOKEN_BUDGET_ENV] = str(args.token_budget)
 
     #miramos si queremos resultados persistentes o no
-    if len(sys.argv) > 1:
-        test_name = sys.argv[1]
+    if args.test_name:
+        test_name = args.test_name
         results_dir = f"./results/persistent_results/{test_name}"
         clear_results = False
         print(f"📁 Modo PERSISTENTE: {results_dir}")
@@ -79,16 +195,23 @@ def main():
 
     # --- Cargado de datos - no se vuelve a crear la bd y borra resultados anteriores
     setup_enviroment(None, clear_results, results_dir)
+    save_run_config(results_dir, dict(current_config(), test_name=args.test_name or "local", repetitions=1))
 
     # --- Preguntas - cambiar el primero a None para ejecutarlo entero y lista no vacia para pruebas
     #df = run_questions(range(0,3), None, API_KEY, PARTIAL_FILE)
-    df = run_questions(None, None, API_KEY, PARTIAL_FILE)
+    profiler = StageProfiler(os.path.join(results_dir, PROFILE_DIR), args.profile).start() if args.profile else None
+    df = run_questions(None, None, API_KEY, PARTIAL_FILE, run_id=args.test_name or "local")
 
     # --- Exportar Resultados y Resumen
-    df.to_csv(FINAL_FILE, index=False)
+    with profile_stage("result_write"):
+        save_results(df, results_dir)
+
+    with profile_stage("dashboard"):
+        evaluate_results(df, FINAL_FILE)
+        generate_dashboard(dir_input= FINAL_FILE, dir_output=os.path.join(results_dir, "plots"))
 
-    evaluate_results(df, FINAL_FILE)
-    generate_dashboard(dir_input= FINAL_FILE, dir_output=os.path.join(results_dir, "plots"))
+    if profiler is not None:
+        profiler.stop()
 
 if __name__ == "__main__":
     multiple_runs()
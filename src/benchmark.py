@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import platform
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+
+# --- CONFIGURACIÓN ---
+BENCHMARK_DIR = "./results/benchmarks"
+BASELINE_FILE = "baseline.json"
+LATEST_FILE = "latest.json"
+QUESTIONS_PATH = "./data/questions.json"
+
+# Repeticiones por etapa (se compara la mediana)
+BENCHMARK_REPEATS = 3
+# Una etapa falla si su mediana supera la de la línea base en más de este porcentaje
+REGRESSION_THRESHOLD = 0.25
+# Filas sintéticas para medir la escritura de resultados
+BENCHMARK_RESULT_ROWS = 2000
+
+# Modo de respuesta (full frente a stream): LLM local con latencia simulada y una explicación
+# tras la letra, como la que a veces añade el modelo real pese a las instrucciones
+BENCHMARK_LLM_QUESTIONS = 20
+BENCHMARK_LLM_FIRST_TOKEN_MS = 30
+BENCHMARK_LLM_TOKEN_MS = 2
+BENCHMARK_LLM_EXTRA_TOKENS = 20
+
+# Etapas que necesitan el motor de búsqueda (y por tanto una BD de Chroma)
+ENGINE_STAGES = ["bm25_build", "query_dense", "query_bm25", "query_hybrid", "rerank", "verify_v1",
+                 "query_rag_local", "answer_full", "answer_stream"]
+
+
+def _timed(fn, repeats):
+    """Ejecuta fn 'repeats' veces. Devuelve (tiempos en s, último resultado)."""
+    times, result = [], None
+    for _ in range(repeats):
+        start_ts = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start_ts)
+    return times, result
+
+
+def _stage(times, **extra):
+    return dict(median_s=float(np.median(times)), min_s=float(np.min(times)), repeats=len(times), **extra)
+
+
+def _per_query(fn, queries):
+    """Latencia por consulta (ms): p50 y p95."""
+    latencies = []
+    for query in queries:
+        start_ts = time.perf_counter()
+        fn(query)
+        latencies.append((time.perf_counter() - start_ts) * 1000)
+    return {"p50_ms": round(float(np.percentile(latencies, 50)), 3),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 3)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run_benchmarks(repeats=BENCHMARK_REPEATS, stages=None):
+    """
+    Mide las rutas calientes del pipeline sin red: el LLM es el sustituto local.
+
+    Args:
+        repeats (int): Repeticiones por etapa.
+        stages (list[str]): Subconjunto de etapas (por defecto, todas).
+
+    Returns:
+        dict: {"meta": {...}, "stages": {etapa: {"median_s", "min_s", ...}}}
+    """
+    # Todo el pipeline (query_rag y juez) usa el LLM local: sin red ni cuota
+    os.environ["RAG_LLM_BACKEND"] = "local"
+
+    from src import ingestion, retrieval
+
+    # Lo que escribe el benchmark (caché de texto del PDF y BD de Chroma) va a un directorio temporal:
+    # la BD y el índice de evidencias de data/ no se tocan
+    tmp_dir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    saved_paths = (ingestion.PAGE_CACHE_DIR, ingestion.CHROMA_PATH, retrieval.CHROMA_PATH)
+    ingestion.PAGE_CACHE_DIR = os.path.join(tmp_dir, "page_cache")
+    ingestion.CHROMA_PATH = retrieval.CHROMA_PATH = os.path.join(tmp_dir, "chroma_db")
+    try:
+        results = _run_stages(repeats, stages)
+    finally:
+        ingestion.PAGE_CACHE_DIR, ingestion.CHROMA_PATH, retrieval.CHROMA_PATH = saved_paths
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {
+        "meta": {"date": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": _git_commit(),
+                 "python": platform.python_version(), "machine": platform.machine(),
+                 "cpus": os.cpu_count(), "repeats": repeats},
+        "stages": results,
+    }
+
+
+def _run_stages(repeats, stages):
+    """Etapas de run_benchmarks. El PDF, los chunks y la BD solo se preparan si alguna etapa elegida los usa."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from src import ingestion
+    from src.retrieval import RetrievalEngine
+    from src.rag_pipeline import query_rag, verify_ground_truth_v1, TOP_K, RERANK_CANDIDATES
+    from src.matching import clear_clean_cache
+    from src.results_store import ResultLog, save_results
+    import pandas as pd
+
+    def wanted(name):
+        return stages is None or name in stages
+
+    need_engine = any(wanted(name) for name in ENGINE_STAGES)
+    need_chunks = need_engine or any(wanted(name) for name in ("chunking", "embedding", "result_write"))
+
+    with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    texts = [q["question"] for q in questions]
+
+    results = {}
+    print(f"\n⏱️  Benchmark ({repeats} repeticiones por etapa)")
+
+    # 1. Ingesta: carga del PDF (parseo en frío y desde la caché de texto) y troceado
+    pages = None
+    if wanted("pdf_load"):
+        times, pages = _timed(lambda: ingestion.load_pdf(use_cache=False), repeats)
+        results["pdf_load"] = _stage(times, pages=len(pages))
+    if wanted("pdf_load_cached"):
+        # La primera carga llena la caché de texto (temporal)
+        pages = ingestion.load_pdf()
+        times, _ = _timed(ingestion.load_pdf, repeats)
+        results["pdf_load_cached"] = _stage(times, pages=len(pages))
+
+    if need_chunks:
+        pages = pages if pages is not None else ingestion.load_pdf()
+        embeddings = HuggingFaceEmbeddings(model_name=ingestion.EMBEDDING_MODEL_NAME)
+        split = lambda: ingestion.split_pages(pages, ingestion.CHUNKING_METHOD, embeddings)
+        if wanted("chunking"):
+            times, chunks = _timed(split, repeats)
+            results["chunking"] = _stage(times, method=ingestion.CHUNKING_METHOD, chunks=len(chunks))
+        else:
+            chunks = split()
+
+    # 2. Embeddings de los chunks
+    if wanted("embedding"):
+        chunk_texts = [c.page_content for c in chunks]
+        times, _ = _timed(lambda: embeddings.embed_documents(chunk_texts), repeats)
+        results["embedding"] = _stage(times, chunks_per_s=round(len(chunk_texts) / float(np.median(times)), 1))
+
+    # 3. Construcción del almacén de chunks y de BM25 desde Chroma (motor nuevo en cada repetición)
+    #    La BD se crea con estos chunks en el directorio temporal (CHROMA_PATH redirigido)
+    engine = None
+    if need_engine:
+        ingestion.create_vector_db(chunks)
+        engine = RetrievalEngine.get_instance()
+    if wanted("bm25_build"):
+        def build_bm25():
+            fresh = RetrievalEngine()
+            fresh._db = engine.db
+            return fresh._get_bm25_index()
+        times, _ = _timed(build_bm25, repeats)
+        results["bm25_build"] = _stage(times)
+
+    # 4. Latencia de consulta por método (motor caliente)
+    if need_engine:
+        engine.warm_up(["hybrid"])
+    for method in ["dense", "bm25", "hybrid"]:
+        if wanted(f"query_{method}"):
+            search = lambda q, m=method: engine.search(q, m, k=TOP_K)
+            times, _ = _timed(lambda: [search(q) for q in texts], repeats)
+            results[f"query_{method}"] = _stage(times, **_per_query(search, texts))
+
+    # 5. Reranking de RERANK_CANDIDATES candidatos por pregunta
+    if wanted("rerank"):
+        candidates = [engine.search(q, "hybrid", k=RERANK_CANDIDATES)[0] for q in texts]
+        _ = engine.reranker
+        times, _ = _timed(lambda: [engine.rerank_positions(q, c, top_k=TOP_K) for q, c in zip(texts, candidates)], repeats)
+        results["rerank"] = _stage(times, pairs=sum(len(c) for c in candidates))
+
+    # 6. Juez de texto v1 (en frío, sin la caché de texto limpio)
+    if wanted("verify_v1"):
+        retrieved = [[doc for doc, _ in engine.retrieve_with_scores(q, "hybrid", k=TOP_K)] for q in texts]
+        references = [q.get("paper_reference", "") for q in questions]
+        def verify_all():
+            clear_clean_cache()
+            engine.chunk_store.clear_clean_cache()
+            return [verify_ground_truth_v1(docs, ref) for docs, ref in zip(retrieved, references)]
+        times, _ = _timed(verify_all, repeats)
+        results["verify_v1"] = _stage(times)
+
+    # 7. Pipeline completo con el LLM local (recuperación + contexto + prompt)
+    if wanted("query_rag_local"):
+        times, _ = _timed(lambda: [query_rag(q["question"], q["answers"], "hybrid", None) for q in questions], repeats)
+        results["query_rag_local"] = _stage(times)
+
+    # 8. Modo de respuesta: respuesta completa frente a streaming con salida limitada y parada temprana
+    #    (preguntas tipo test y juez YES/NO con el mismo contexto)
+    if wanted("answer_full") or wanted("answer_stream"):
+        from src.local_llm import LocalLLM
+        from src.rag_pipeline import prompt, generate, JUDGE_PROMPT, ANSWER_STOP, VERDICT_STOP, ANSWER_MAX_OUTPUT_TOKENS
+        prompts = []
+        for q in questions[:BENCHMARK_LLM_QUESTIONS]:
+            context_text = "\n\n".join(engine.chunk_store.texts(engine.search(q["question"], "hybrid", k=TOP_K)[0]))
+            prompts.append((prompt.format(context=context_text, question=q["question"], option_a=q["answers"]["A"],
+                                          option_b=q["answers"]["B"], option_c=q["answers"]["C"],
+                                          option_d=q["answers"]["D"]), ANSWER_STOP))
+            prompts.append((JUDGE_PROMPT.format(reference=q.get("paper_reference", ""), context=context_text), VERDICT_STOP))
+
+        answers = {}
+        for mode in ("full", "stream"):
+            if not wanted(f"answer_{mode}"):
+                continue
+            llm = LocalLLM(BENCHMARK_LLM_FIRST_TOKEN_MS, BENCHMARK_LLM_TOKEN_MS, BENCHMARK_LLM_EXTRA_TOKENS,
+                           max_output_tokens=ANSWER_MAX_OUTPUT_TOKENS if mode == "stream" else None)
+            times, outputs = _timed(lambda: [generate(llm, text, stop, mode) for text, stop in prompts], repeats)
+            answers[mode] = [stop.search(response.content + " ") for (response, _), (_, stop) in zip(outputs, prompts)]
+            first_tokens = [stats["first_token_time"] for _, stats in outputs if stats["first_token_time"] is not None]
+            results[f"answer_{mode}"] = _stage(
+                times, calls=len(prompts),
+                llm_p50_ms=round(1000 * float(np.median([stats["llm_time"] for _, stats in outputs])), 3),
+                first_token_p50_ms=round(1000 * float(np.median(first_tokens)), 3) if first_tokens else None)
+        if len(answers) == 2:
+            # El modo stream debe dar exactamente las mismas letras y veredictos
+            results["answer_stream"]["same_answers"] = all(
+                (a and a.group(1).upper()) == (b and b.group(1).upper()) for a, b in zip(answers["full"], answers["stream"]))
+
+    # 9. Escritura de resultados: log parcial y Parquet final
+    if wanted("result_write"):
+        chunk_ids = [c.metadata["chunk_id"] for c in chunks[:TOP_K]]
+        rows = [{"run_id": "bench", "repetition": 0, "question_id": i, "method": "hybrid", "correct": True,
+                 "predicted": "A", "ground_truth": "A", "response_time": 0.5, "raw_output": "A",
+                 "status": "bench", "retrieval_score": 1.0, "found_evidence": True, "evidence_recall": 1.0,
+                 "compression_ratio": 1.0, "n_chunks": TOP_K, "context_tokens": 1000, "prompt_tokens": 1200,
+                 "chunk_ids": chunk_ids, "chunk_scores": [0.5] * TOP_K}
+                for i in range(BENCHMARK_RESULT_ROWS)]
+
+        def write_results():
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                with ResultLog(os.path.join(tmp_dir, "log.jsonl")) as log:
+                    for row in rows:
+                        log.append(row)
+                save_results(pd.DataFrame(rows), tmp_dir, chunks=chunks)
+        times, _ = _timed(write_results, repeats)
+        results["result_write"] = _stage(times, rows=BENCHMARK_RESULT_ROWS)
+
+    for name, stage in results.items():
+        print(f"   {name:<18} {stage['median_s']*1000:10.1f} ms")
+    return results
+
+
+def compare_to_baseline(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compara cada etapa con la línea base.
+
+    Returns:
+        list[str]: Etapas que superan el umbral de regresión.
+    """
+    regressions = []
+    print(f"\n📐 Comparación con la línea base ({baseline['meta'].get('commit')}, umbral +{threshold*100:.0f}%)")
+    for name, stage in report["stages"].items():
+        reference = baseline["stages"].get(name)
+        if reference is None:
+            print(f"   {name:<18} (nueva etapa, sin línea base)")
+            continue
+        change = stage["median_s"] / reference["median_s"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"   {'❌' if regressed else '✅'} {name:<18} {reference['median_s']*1000:10.1f} -> "
+              f"{stage['median_s']*1000:10.1f} ms ({change*100:+.1f}%)")
+    return regressions
+
+
+def _save(report, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    # python -m src.benchmark                  -> compara con results/benchmarks/baseline.json
+    # python -m src.benchmark --save-baseline  -> fija la línea base
+    parser = argparse.ArgumentParser(description="Benchmark offline de las rutas calientes del pipeline")
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS)
+    parser.add_argument("--stages", nargs="*", default=None, help="Subconjunto de etapas")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, BASELINE_FILE))
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.repeats, args.stages)
+    _save(report, os.path.join(BENCHMARK_DIR, LATEST_FILE))
+
+    if args.save_baseline:
+        _save(report, args.baseline)
+        print(f"💾 Línea base guardada en {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_to_baseline(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n❌ Regresión en: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones")
+    else:
+        print(f"⚠️  No hay línea base en {args.baseline}. Usa --save-baseline para crearla.")
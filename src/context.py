@@ -0,0 +1,315 @@
+import os
+import math
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+from src.retrieval import get_chunk_id
+
+
+# --- CONFIGURACIÓN ---
+# Presupuesto máximo de tokens del contexto que se envía al LLM (None = sin límite, como antes).
+# Es opcional: RAG_CONTEXT_TOKEN_BUDGET o main.py --token-budget, y el valor usado queda en config.json
+CONTEXT_TOKEN_BUDGET = None
+CONTEXT_TOKEN_BUDGET_ENV = "RAG_CONTEXT_TOKEN_BUDGET"
+
+# Aproximación de tokens para texto en inglés (~4 caracteres por token en Gemini)
+CHARS_PER_TOKEN = 4
+
+# Solapamiento mínimo (en caracteres) para considerar que dos chunks se pisan.
+# Evita fusionar chunks que solo comparten una palabra suelta.
+MIN_OVERLAP_CHARS = 30
+
+CHUNK_SEPARATOR = "\n\n"
+
+# Compresión extractiva: fracción de tokens que se conserva (None = sin compresión)
+COMPRESSION_RATIO = None
+# Modelo para puntuar frases: "minilm" (embeddings) o "cross_encoder"
+COMPRESSION_SCORER = "minilm"
+# Fragmentos más cortos que esto se pegan a la frase anterior (números sueltos, ejes de figuras...)
+MIN_SENTENCE_CHARS = 25
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+
+
+def count_tokens(text):
+    """Estimación rápida del número de tokens de un texto."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def context_token_budget():
+    """Presupuesto activo (se lee en cada llamada): RAG_CONTEXT_TOKEN_BUDGET o, si no está, CONTEXT_TOKEN_BUDGET."""
+    value = os.getenv(CONTEXT_TOKEN_BUDGET_ENV)
+    return int(value) if value else CONTEXT_TOKEN_BUDGET
+
+
+def _overlap(left, right, min_len=MIN_OVERLAP_CHARS):
+    """
+    Longitud del mayor sufijo de 'left' que es prefijo de 'right'.
+    Devuelve 0 si el solapamiento es menor que min_len.
+    """
+    if len(left) < min_len or len(right) < min_len:
+        return 0
+
+    head = right[:min_len]
+    # La primera aparición de la cabecera en 'left' da el solapamiento más largo
+    start = left.find(head)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    return 0
+
+
+def _same_page(block, doc):
+    return (block["source"], block["page"]) == (doc.metadata.get("source"), doc.metadata.get("page"))
+
+
+def _join(left, right):
+    """
+    Intenta unir dos textos del mismo bloque. Devuelve el texto fusionado
+    o None si no se solapan ni se contienen.
+    """
+    if right in left:
+        return left
+    if left in right:
+        return right
+
+    size = _overlap(left, right)
+    if size:
+        return left + right[size:]
+    size = _overlap(right, left)
+    if size:
+        return right + left[size:]
+    return None
+
+
+def _join_by_offsets(block, other):
+    """
+    Une bloques contiguos o solapados usando 'start_index' (si el splitter lo guardó).
+    Devuelve el texto fusionado o None.
+    """
+    if block["start"] is None or other["start"] is None:
+        return None
+
+    first, second = sorted([block, other], key=lambda b: b["start"])
+    first_end = first["start"] + len(first["text"])
+    if second["start"] > first_end + 1:
+        return None
+
+    # Cortamos lo que ya está en el primero (solapamiento) y unimos si son adyacentes
+    cut = max(0, first_end - second["start"])
+    tail = second["text"][cut:]
+    if not tail:
+        return first["text"]
+    return first["text"] + ("" if cut else " ") + tail
+
+
+def merge_chunks(docs, scores=None):
+    """
+    Agrupa los chunks recuperados en bloques sin texto duplicado.
+    Dos chunks de la misma página se fusionan si uno contiene al otro,
+    si se solapan (CHUNK_OVERLAP) o si son adyacentes según 'start_index'.
+
+    Args:
+        docs (list[Document]): Chunks en orden de relevancia.
+        scores (list[float]): Puntuación de cada chunk (mayor = mejor). Si None, se usa el orden.
+
+    Returns:
+        list[dict]: Bloques con 'text', 'score' (máximo de sus chunks) y 'docs'.
+    """
+    if scores is None:
+        scores = [-rank for rank in range(len(docs))]
+
+    blocks = []
+    for doc, score in zip(docs, scores):
+        blocks.append({
+            "text": doc.page_content,
+            "score": score,
+            "docs": [doc],
+            "source": doc.metadata.get("source"),
+            "page": doc.metadata.get("page"),
+            "start": doc.metadata.get("start_index"),
+        })
+
+        # Fusionamos hasta que no quede ningún par de bloques que se pise
+        merged = True
+        while merged:
+            merged = False
+            current = blocks[-1]
+            for block in blocks[:-1]:
+                if not _same_page(block, current["docs"][0]):
+                    continue
+
+                text = _join_by_offsets(block, current) or _join(block["text"], current["text"])
+                if text is None:
+                    continue
+
+                starts = [s for s in (block["start"], current["start"]) if s is not None]
+                block["text"] = text
+                block["score"] = max(block["score"], current["score"])
+                block["docs"].extend(current["docs"])
+                block["start"] = min(starts) if len(starts) == 2 else None
+
+                # El bloque ampliado pasa al final para volver a compararlo con el resto
+                blocks = [b for b in blocks if b is not block and b is not current]
+                blocks.append(block)
+                merged = True
+                break
+
+    return blocks
+
+
+def _truncate(text, max_chars):
+    """Recorta el texto al límite de caracteres, preferiblemente en un final de frase."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    last_stop = max(cut.rfind(". "), cut.rfind(".\n"))
+    if last_stop > max_chars // 2:
+        return cut[:last_stop + 1]
+    return cut
+
+
+def fit_to_budget(blocks, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Selecciona bloques por score (de mayor a menor) hasta llenar el presupuesto.
+    Si ni siquiera cabe el mejor bloque, se recorta para no enviar contexto vacío.
+    """
+    ranked = sorted(blocks, key=lambda b: b["score"], reverse=True)
+    if token_budget is None:
+        return ranked
+
+    separator_tokens = count_tokens(CHUNK_SEPARATOR)
+    selected = []
+    used = 0
+    for block in ranked:
+        cost = count_tokens(block["text"]) + (separator_tokens if selected else 0)
+        if used + cost <= token_budget:
+            selected.append(block)
+            used += cost
+        elif not selected:
+            block = dict(block, text=_truncate(block["text"], token_budget * CHARS_PER_TOKEN))
+            selected.append(block)
+            used += count_tokens(block["text"])
+
+    return selected
+
+
+def build_context(docs, scores=None, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Construye el texto de contexto para el prompt a partir de los chunks recuperados.
+
+    Args:
+        docs (list[Document]): Chunks en orden de relevancia.
+        scores (list[float]): Puntuación de recuperación de cada chunk.
+        token_budget (int): Máximo de tokens del contexto (None = sin límite).
+
+    Returns:
+        tuple: (str: contexto, list[Document]: chunks que han entrado, dict: estadísticas)
+    """
+    merged = merge_chunks(docs, scores)
+    blocks = fit_to_budget(merged, token_budget)
+
+    context_text = CHUNK_SEPARATOR.join(block["text"] for block in blocks)
+    used_docs = [doc for block in blocks for doc in block["docs"]]
+
+    raw_chars = sum(len(doc.page_content) for doc in docs)
+    stats = {
+        "n_chunks": len(used_docs),
+        "n_blocks": len(blocks),
+        "context_tokens": count_tokens(context_text),
+        "raw_context_tokens": count_tokens(CHUNK_SEPARATOR.join(doc.page_content for doc in docs)),
+        "dedup_chars": max(0, raw_chars - sum(len(block["text"]) for block in merged)),
+    }
+    return context_text, used_docs, stats
+
+
+def split_sentences(text):
+    """Divide un chunk en frases, uniendo los fragmentos demasiado cortos."""
+    sentences = []
+    for piece in SENTENCE_SPLIT.split(text):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if sentences and len(piece) < MIN_SENTENCE_CHARS:
+            sentences[-1] = sentences[-1] + " " + piece
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def score_sentences(question, sentences, engine, scorer=COMPRESSION_SCORER):
+    """
+    Puntúa cada frase contra la pregunta con los modelos ya cargados en el motor.
+    - "minilm": similitud coseno de embeddings.
+    - "cross_encoder": puntuación del reranker.
+    """
+    if scorer == "cross_encoder":
+        return np.asarray(engine.reranker.predict([[question, s] for s in sentences]), dtype=float)
+
+    query_vec = np.asarray(engine.embeddings.embed_query(question), dtype=float)
+    sent_vecs = np.asarray(engine.embeddings.embed_documents(sentences), dtype=float)
+    norms = np.linalg.norm(sent_vecs, axis=1) * np.linalg.norm(query_vec)
+    return sent_vecs @ query_vec / np.maximum(norms, 1e-12)
+
+
+def compress_documents(question, docs, engine, ratio=COMPRESSION_RATIO, scorer=COMPRESSION_SCORER):
+    """
+    Compresión extractiva del contexto: se queda con las frases más relevantes
+    para la pregunta hasta conservar 'ratio' de los tokens originales.
+    Las frases elegidas mantienen su orden original dentro de cada chunk.
+
+    Args:
+        question (str): Pregunta del usuario.
+        docs (list[Document]): Chunks recuperados (ya reordenados si hay reranking).
+        engine (RetrievalEngine): Motor con los modelos cargados.
+        ratio (float): Fracción de tokens a conservar, entre 0 y 1. None o 1 = sin compresión.
+        scorer (str): "minilm" o "cross_encoder".
+
+    Returns:
+        tuple: (list[Document]: chunks comprimidos, dict: tokens antes/después)
+    """
+    tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+    stats = {"compression_ratio": 1.0 if ratio is None else ratio,
+             "tokens_before_compression": tokens_before,
+             "tokens_after_compression": tokens_before}
+    if not docs or ratio is None or ratio >= 1:
+        return docs, stats
+
+    # Frases únicas (los solapes entre chunks repiten frases enteras)
+    sentences, owners, seen = [], [], set()
+    for doc_idx, doc in enumerate(docs):
+        for sentence in split_sentences(doc.page_content):
+            if sentence not in seen:
+                seen.add(sentence)
+                sentences.append(sentence)
+                owners.append(doc_idx)
+    if not sentences:
+        return docs, stats
+
+    scores = score_sentences(question, sentences, engine, scorer)
+
+    # Elegimos las mejores frases hasta llenar el cupo de tokens
+    target = max(1, math.ceil(tokens_before * ratio))
+    keep, kept_tokens = set(), 0
+    for idx in np.argsort(scores)[::-1]:
+        if kept_tokens >= target:
+            break
+        keep.add(int(idx))
+        kept_tokens += count_tokens(sentences[idx])
+
+    compressed = []
+    for doc_idx, doc in enumerate(docs):
+        kept = [sentences[i] for i in range(len(sentences)) if owners[i] == doc_idx and i in keep]
+        if kept:
+            # Sin 'start_index': el texto comprimido ya no ocupa ese tramo de la página
+            # (merge_chunks calcularía mal el solape por offsets y cortaría frases)
+            metadata = {key: value for key, value in doc.metadata.items() if key != "start_index"}
+            metadata.update(chunk_id=get_chunk_id(doc), compressed=True)
+            compressed.append(Document(page_content=" ".join(kept), metadata=metadata))
+
+    stats["tokens_after_compression"] = sum(count_tokens(doc.page_content) for doc in compressed)
+    return compressed, stats
@@ -0,0 +1,168 @@
+import os
+import json
+import math
+from collections import defaultdict
+
+
+# --- CONFIGURACIÓN ---
+MIN_REPETITIONS = 3     # repeticiones completas antes de dejar de repetir nada
+MAX_REPETITIONS = 10    # tope (lo que hacía multiple_runs siempre)
+STABLE_RUNS = 3         # un par converge si sus últimas STABLE_RUNS respuestas son la misma letra
+TARGET_CI_WIDTH = 0.05  # anchura del intervalo de la accuracy de cada método (0.05 = ±2.5 puntos)
+CI_Z = 1.96             # 95%
+REPORT_FILE = "repetitions.json"
+
+
+class RepetitionScheduler:
+    """
+    Repeticiones secuenciales con parada temprana.
+
+    - Por par (pregunta, método): si las últimas STABLE_RUNS respuestas coinciden, el par ha convergido
+      y no se vuelve a preguntar (con temperature=0 la respuesta casi nunca cambia).
+    - Por método: intervalo de confianza de su accuracy debido a la variación entre repeticiones.
+      Cada pregunta aporta p(1-p)/n (p = tasa de acierto observada en sus n respuestas); los pares
+      convergidos se consideran deterministas y no aportan. Un método termina cuando la anchura
+      del intervalo baja de TARGET_CI_WIDTH.
+    - La ejecución termina cuando todos los métodos han terminado o se llega a MAX_REPETITIONS.
+    """
+
+    def __init__(self, methods, question_ids, min_repetitions=MIN_REPETITIONS, max_repetitions=MAX_REPETITIONS,
+                 stable_runs=STABLE_RUNS, target_ci_width=TARGET_CI_WIDTH, z=CI_Z):
+        self.methods = list(methods)
+        self.question_ids = sorted(question_ids)
+        self.min_repetitions = min_repetitions
+        self.max_repetitions = max_repetitions
+        self.stable_runs = stable_runs
+        self.target_ci_width = target_ci_width
+        self.z = z
+        # (question_id, método) -> {repetición: (letra, acierto)}
+        self.answers = defaultdict(dict)
+        self.finished_methods = {}
+        self.rounds = 0
+
+    def record(self, rows):
+        """Añade filas de resultados (las de métodos o preguntas que no se evalúan se ignoran)."""
+        for row in rows:
+            key = (int(row["question_id"]), row["method"])
+            if key[1] in self.methods:
+                self.answers[key][int(row["repetition"])] = (row["predicted"], bool(row["correct"]))
+
+    def _history(self, key):
+        return [self.answers[key][rep] for rep in sorted(self.answers[key])]
+
+    def converged(self, key):
+        history = self._history(key)
+        if len(history) < max(self.stable_runs, self.min_repetitions):
+            return False
+        return len({letter for letter, _ in history[-self.stable_runs:]}) == 1
+
+    def method_estimate(self, method):
+        """(accuracy media por pregunta, semianchura del intervalo, pares convergidos)."""
+        accuracies, variance, n_converged = [], 0.0, 0
+        for question_id in self.question_ids:
+            history = self._history((question_id, method))
+            if not history:
+                continue
+            p = sum(correct for _, correct in history) / len(history)
+            accuracies.append(p)
+            if self.converged((question_id, method)):
+                n_converged += 1
+            else:
+                variance += p * (1 - p) / len(history)
+        if not accuracies:
+            return None, math.inf, 0
+        return sum(accuracies) / len(accuracies), self.z * math.sqrt(variance) / len(accuracies), n_converged
+
+    def update(self, repetition):
+        """Tras completar una repetición: marca los métodos cuyo intervalo ya es suficientemente estrecho."""
+        self.rounds = max(self.rounds, repetition + 1)
+        for method in self.methods:
+            if method in self.finished_methods or self.rounds < self.min_repetitions:
+                continue
+            _, half_width, _ = self.method_estimate(method)
+            if 2 * half_width <= self.target_ci_width:
+                self.finished_methods[method] = self.rounds
+
+    def skip_set(self, repetition):
+        """Pares que no hace falta ejecutar en esta repetición."""
+        if repetition < self.min_repetitions:
+            return set()
+        return {(question_id, method) for question_id in self.question_ids for method in self.methods
+                if method in self.finished_methods or self.converged((question_id, method))}
+
+    def done(self, repetition):
+        """True si no hay que lanzar la repetición indicada."""
+        if repetition >= self.max_repetitions:
+            return True
+        return repetition >= self.min_repetitions and len(self.skip_set(repetition)) == len(self.question_ids) * len(self.methods)
+
+    def report(self):
+        """Estimación por método y llamadas ahorradas frente a max_repetitions pasadas completas."""
+        executed = sum(len(answers) for answers in self.answers.values())
+        planned = self.max_repetitions * len(self.question_ids) * len(self.methods)
+        methods = {}
+        for method in self.methods:
+            accuracy, half_width, n_converged = self.method_estimate(method)
+            methods[method] = {
+                "accuracy": accuracy,
+                "ci_width": 2 * half_width if math.isfinite(half_width) else None,
+                "converged_pairs": n_converged,
+                "calls": sum(len(self.answers[(q, method)]) for q in self.question_ids),
+                "stopped_at": self.finished_methods.get(method),
+            }
+        return {"repetitions": self.rounds, "calls": executed, "planned_calls": planned,
+                "saved_calls": planned - executed, "saved_pct": 100 * (planned - executed) / planned if planned else 0.0,
+                "target_ci_width": self.target_ci_width, "methods": methods}
+
+
+def print_report(report):
+    print(f"\n🎯 Repeticiones adaptativas: {report['repetitions']} rondas | {report['calls']} llamadas de "
+          f"{report['planned_calls']} ({report['saved_calls']} ahorradas, {report['saved_pct']:.1f}%)")
+    for method, m in report["methods"].items():
+        ci = f"±{50 * m['ci_width']:.1f}" if m["ci_width"] is not None else "?"
+        accuracy = f"{100 * m['accuracy']:.1f}%" if m["accuracy"] is not None else "?"
+        stopped = f"parado en la ronda {m['stopped_at']}" if m["stopped_at"] else "sin alcanzar el objetivo"
+        print(f"   {method:<15} {accuracy:>7} {ci:>6} pts | {m['converged_pairs']} pares convergidos | "
+              f"{m['calls']} llamadas | {stopped}")
+
+
+def run_adaptive_repetitions(run_round, methods, question_ids, previous_rows=(), results_dir=None, **settings):
+    """
+    Lanza repeticiones hasta que el scheduler decide parar.
+
+    Args:
+        run_round (callable): run_round(repetition, skip) -> filas (dicts) de esa repetición.
+        methods (list): Métodos evaluados.
+        question_ids (list[int]): Preguntas evaluadas (question_id, empezando en 1).
+        previous_rows (list[dict]): Filas ya en el log (ejecución retomada).
+        results_dir (str): Si se indica, guarda el informe en repetitions.json.
+        **settings: Parámetros de RepetitionScheduler (min_repetitions, target_ci_width, ...).
+
+    Returns:
+        tuple: (lista de filas de todas las repeticiones, informe)
+    """
+    scheduler = RepetitionScheduler(methods, question_ids, **settings)
+    scheduler.record(previous_rows)
+    all_rows = []
+
+    repetition = 0
+    while not scheduler.done(repetition):
+        skip = scheduler.skip_set(repetition)
+        print(f"\n🔁 Repetición {repetition + 1} (máx. {scheduler.max_repetitions}): "
+              f"{len(question_ids) * len(methods) - len(skip)} pares pendientes")
+        rows = run_round(repetition, skip)
+        scheduler.record(rows)
+        all_rows.extend(rows)
+        scheduler.update(repetition)
+        for method in methods:
+            accuracy, half_width, n_converged = scheduler.method_estimate(method)
+            if accuracy is not None:
+                print(f"   {method:<15} acc {100 * accuracy:5.1f}% ±{100 * half_width:4.1f} | convergidos {n_converged}")
+        repetition += 1
+
+    report = scheduler.report()
+    print_report(report)
+    if results_dir:
+        with open(os.path.join(results_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return all_rows, report
@@ -1,24 +1,77 @@
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+from src.results_store import read_results
+
+# Columnas que necesitan las gráficas (el resto no se carga)
+DASHBOARD_COLUMNS = ["method", "question_id", "correct", "status", "response_time", "retrieval_score",
+                     "found_evidence", "prompt_tokens", "compression_ratio"]
+
+# Colores del diagnóstico RAG (status sin emojis)
+STATUS_PALETTE = {
+    "ACIERTO PERFECTO (RAG)": "#2ecc71",           # Verde
+    "ACIERTO SUERTE (Sin Evidencia)": "#f1c40f",  # Amarillo
+    "FALLO RAZONAMIENTO (Contexto OK)": "#e67e22",# Naranja
+    "FALLO TOTAL": "#e74c3c"                       # Rojo
+}
+
+def question_mean(df : pd.DataFrame, columns, by="method"):
+    """
+    Media por grupo en la que cada pregunta pesa lo mismo: media de las medias de cada pregunta.
+    Con el mismo número de repeticiones por pregunta es la media de todas las filas; con
+    repeticiones adaptativas (pares convergidos que dejan de repetirse) no pesa más lo inestable.
+    """
+    if "question_id" not in df.columns:
+        return df.groupby(by)[columns].mean()
+    return df.groupby([by, "question_id"])[columns].mean().groupby(level=by).mean()
+
+def method_accuracy(df : pd.DataFrame):
+    """Accuracy por método como media de la tasa de acierto de cada pregunta (ver question_mean)."""
+    return question_mean(df, "correct")
 
 def evaluate_results(df : pd.DataFrame, ff  : str):
     print("\n" + "="*30)
     print("📊 RESUMEN DE PRECISIÓN (ACCURACY)")
     print("="*30)
     # Calcula el porcentaje de aciertos por método
-    print(df.groupby("method")["correct"].mean() * 100)
+    print(method_accuracy(df) * 100)
+
+    # Tamaño del prompt frente a latencia (coste por método, cada pregunta pesa lo mismo)
+    if "prompt_tokens" in df.columns:
+        print("\n📏 TOKENS DE ENTRADA Y LATENCIA MEDIA")
+        print(question_mean(df, ["prompt_tokens", "context_tokens", "response_time"]).round(2))
+
+    # Modo de respuesta "stream": tiempo hasta el primer token frente al total del LLM
+    if "first_token_time" in df.columns and df["first_token_time"].notna().any():
+        print("\n⚡ TIEMPO HASTA EL PRIMER TOKEN Y DEL LLM (s, mediana)")
+        print(df.groupby("method")[["first_token_time", "llm_time"]].median().round(3))
+
+    # Cascada adaptativa del Cross-Encoder: decisiones, pares puntuados y calidad por decisión
+    if "cascade" in df.columns and df["cascade"].notna().any():
+        print("\n🪜 CASCADA DEL CROSS-ENCODER")
+        print(df.dropna(subset=["cascade"]).groupby("cascade").agg(
+            n=("correct", "size"), accuracy=("correct", "mean"),
+            evidence=("found_evidence", "mean"), rerank_pairs=("rerank_pairs", "mean"),
+        ).round(3))
     print(f"📁 Resultados finales (clean): {ff}")
 
-def load_data(dir_input : str):
-    """Carga los datos y asegura que las columnas tengan el tipo correcto."""
+def load_data(dir_input : str, columns=None):
+    """
+    Carga los datos (Parquet o CSV antiguo) y asegura que las columnas tengan el tipo correcto.
+    Con 'columns' solo se leen esas columnas del disco.
+    """
     if not os.path.exists(dir_input):
         print(f"❌ Error: No se encuentra el archivo {dir_input}")
         print("   Ejecuta primero 'launcher.py' para generar datos.")
         return None
     
-    df = pd.read_csv(dir_input)
+    df = read_results(dir_input, columns)
+
+    # Las columnas categóricas de Parquet se pasan a texto para los groupby de seaborn
+    for col in df.select_dtypes("category").columns:
+        df[col] = df[col].astype(str)
     
     # Aseguramos que 'correct' sea numérico (1/0) para calcular porcentajes
     # En tu main lo guardas como booleano o int, esto lo estandariza
@@ -51,8 +104,8 @@ def plot_accuracy(df, dir_output : str):
 
     plt.figure(figsize=(10, 6))
     
-    # Agrupar por método y calcular la media de aciertos
-    acc_df = df.groupby("method")["correct"].mean() * 100
+    # Agrupar por método y calcular la media de aciertos (por pregunta, ver method_accuracy)
+    acc_df = method_accuracy(df) * 100
     acc_df = acc_df.reset_index()
     
     # Crear gráfico de barras
@@ -97,23 +150,17 @@ def plot_rag_quality(df, dir_output : str):
     plt.figure(figsize=(12, 7))
     
     # 2. Calcular porcentajes
-    # Agrupamos por método y status, contamos, y dividimos por el total de cada método
-    counts = df.groupby(['method', 'status_clean']).size().reset_index(name='count')
-    totals = df.groupby('method').size().reset_index(name='total')
-    data_pct = pd.merge(counts, totals, on='method')
-    data_pct['percentage'] = (data_pct['count'] / data_pct['total']) * 100
-
-    # 3. Mapeo de colores (usando los nombres SIN emojis)
-    status_palette = {
-        "ACIERTO PERFECTO (RAG)": "#2ecc71",           # Verde
-        "ACIERTO SUERTE (Sin Evidencia)": "#f1c40f",  # Amarillo
-        "FALLO RAZONAMIENTO (Contexto OK)": "#e67e22",# Naranja
-        "FALLO TOTAL": "#e74c3c"                       # Rojo
-    }
-    
-    # Asegurar que la paleta cubra todo lo que hay en los datos
+    # Proporción de cada status por pregunta y media por método (cada pregunta pesa lo mismo, como la accuracy)
+    keys = [c for c in ("method", "question_id") if c in df.columns]
+    statuses = pd.get_dummies(df["status_clean"], dtype=float)
+    shares = pd.concat([df[keys], statuses], axis=1)
+    data_pct = question_mean(shares, list(statuses.columns)).reset_index().melt(
+        id_vars="method", var_name="status_clean", value_name="percentage")
+    data_pct['percentage'] *= 100
+
+    # 3. Asegurar que la paleta (nombres SIN emojis) cubra todo lo que hay en los datos
     unique = data_pct["status_clean"].unique()
-    palette_final = {k: status_palette.get(k, "#95a5a6") for k in unique}
+    palette_final = {k: STATUS_PALETTE.get(k, "#95a5a6") for k in unique}
 
     # 4. Graficar con porcentajes
     barplot = sns.barplot(
@@ -148,7 +195,8 @@ def plot_rag_quality(df, dir_output : str):
 def plot_latency(df, dir_output : str):
     """
     3. GRÁFICO DE LATENCIA (Boxplot)
-    Usa la columna 'response_time'.
+    Usa la columna 'response_time'. Es la distribución de todas las ejecuciones: con repeticiones
+    adaptativas las preguntas que se repiten más aportan más muestras (a diferencia de la accuracy).
     """
     if "response_time" not in df.columns:
         print("⚠️ Columna 'response_time' no encontrada. Saltando gráfico de latencia.")
@@ -166,7 +214,7 @@ def plot_latency(df, dir_output : str):
         legend=False
     )
     
-    plt.title("Latencia del Sistema (Tiempo de Respuesta)", fontsize=14)
+    plt.title("Latencia del Sistema (Tiempo de Respuesta, una muestra por ejecución)", fontsize=14)
     plt.ylabel("Segundos")
     plt.xlabel("Método")
     plt.grid(True, axis='y', linestyle='--', alpha=0.5)
@@ -179,7 +227,7 @@ def plot_latency(df, dir_output : str):
 def plot_retrieval_score(df, dir_output : str):
     """
     4. GRÁFICO DE FIDELIDAD DE RECUPERACIÓN (Violin Plot)
-    Usa la columna 'retrieval_score'.
+    Usa la columna 'retrieval_score'. Como la latencia, una muestra por ejecución.
     """
     if "retrieval_score" not in df.columns:
         print("⚠️ Columna 'retrieval_score' no encontrada. Saltando gráfico de fidelidad.")
@@ -198,7 +246,7 @@ def plot_retrieval_score(df, dir_output : str):
         legend=False
     )
     
-    plt.title("Fidelidad de Recuperación (Similitud con Ground Truth)", fontsize=14)
+    plt.title("Fidelidad de Recuperación (Similitud con Ground Truth, una muestra por ejecución)", fontsize=14)
     plt.ylabel("Puntuación de Similitud (0-1)")
     plt.xlabel("Método")
     plt.ylim(-0.1, 1.1) # Márgenes para ver bien los extremos
@@ -208,6 +256,144 @@ def plot_retrieval_score(df, dir_output : str):
     print("📊 Gráfico 4 guardado: Retrieval Fidelity")
     plt.close()
 
+def compression_report(df : pd.DataFrame):
+    """
+    Resumen por ratio de compresión: accuracy, tasa de evidencia encontrada,
+    tokens de entrada y latencia, junto a su reducción respecto al contexto completo.
+    Cada pregunta pesa lo mismo dentro de un ratio (ver question_mean).
+    """
+    if "compression_ratio" not in df.columns:
+        print("⚠️ Columna 'compression_ratio' no encontrada. Saltando informe de compresión.")
+        return None
+
+    df = df[df["method"] != "baseline"]
+    report = question_mean(df, ["correct", "found_evidence", "prompt_tokens", "response_time"],
+                           by="compression_ratio").sort_index(ascending=False)
+    report = report.rename(columns={"correct": "accuracy", "found_evidence": "evidence_rate"})
+    report[["accuracy", "evidence_rate"]] *= 100
+
+    # Reducción relativa frente al ratio más alto (normalmente 1.0 = sin compresión)
+    reference = report.iloc[0]
+    report["token_reduction_pct"] = (1 - report["prompt_tokens"] / reference["prompt_tokens"]) * 100
+    report["latency_reduction_pct"] = (1 - report["response_time"] / reference["response_time"]) * 100
+
+    print("\n" + "="*30)
+    print("🗜️  COMPRESIÓN DE CONTEXTO")
+    print("="*30)
+    print(report.round(2))
+    return report
+
+def plot_compression(df, dir_output : str):
+    """
+    5. GRÁFICO DE COMPRESIÓN (Calidad vs Tokens)
+    Accuracy y evidencia por ratio, con los tokens de entrada en el eje secundario.
+    """
+    report = compression_report(df)
+    if report is None or len(report) < 2:
+        return
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    ratios = report.index.astype(str)
+    ax.plot(ratios, report["accuracy"], marker="o", label="Accuracy (%)")
+    ax.plot(ratios, report["evidence_rate"], marker="s", label="Evidencia encontrada (%)")
+    ax.set_ylim(0, 105)
+    ax.set_xlabel("Ratio de compresión (fracción de tokens conservada)")
+    ax.set_ylabel("%")
+
+    ax_tokens = ax.twinx()
+    ax_tokens.bar(ratios, report["prompt_tokens"], alpha=0.25, color="gray", label="Tokens de entrada")
+    ax_tokens.set_ylabel("Tokens de entrada (media)")
+
+    lines, labels = ax.get_legend_handles_labels()
+    bars, bar_labels = ax_tokens.get_legend_handles_labels()
+    ax.legend(lines + bars, labels + bar_labels, loc="lower left")
+    plt.title("Compresión de Contexto: Calidad vs Tamaño del Prompt", fontsize=14)
+
+    save_path = os.path.join(dir_output, "5_compression.png")
+    plt.savefig(save_path, dpi=300)
+    print("📊 Gráfico 5 guardado: Compression")
+    plt.close()
+
+def compute_retrieval_metrics(gains, ideal_gains, n_relevant, ks):
+    """
+    Métricas de recuperación para todas las preguntas y todos los k a la vez.
+
+    Args:
+        gains (np.ndarray): (n_preguntas, K) cobertura del chunk en cada posición (0 = no es evidencia).
+        ideal_gains (np.ndarray): (n_preguntas, K) coberturas de los chunks de soporte ordenadas de mayor a menor.
+        n_relevant (np.ndarray): (n_preguntas,) número de chunks de soporte de cada pregunta.
+        ks (list[int]): Cortes a evaluar (todos <= K).
+
+    Returns:
+        pd.DataFrame: Una fila por k con recall, hit_rate, mrr y ndcg medios.
+    """
+    relevant = gains > 0
+    ks = np.asarray(ks)
+
+    # Recall@k y Hit@k a partir del acumulado de aciertos
+    cum_hits = np.cumsum(relevant, axis=1)[:, ks - 1]
+    recall = cum_hits / n_relevant[:, None]
+    hit_rate = cum_hits > 0
+
+    # MRR@k: posición del primer chunk relevante
+    first = np.where(relevant.any(axis=1), relevant.argmax(axis=1) + 1, np.inf)
+    rr = np.where(first[:, None] <= ks[None, :], 1.0 / first[:, None], 0.0)
+
+    # nDCG@k con ganancia graduada (cobertura de la referencia)
+    discounts = 1.0 / np.log2(np.arange(2, gains.shape[1] + 2))
+    dcg = np.cumsum(gains * discounts, axis=1)[:, ks - 1]
+    idcg = np.cumsum(ideal_gains * discounts, axis=1)[:, ks - 1]
+    ndcg = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+
+    return pd.DataFrame({
+        "k": ks,
+        "recall": recall.mean(axis=0),
+        "hit_rate": hit_rate.mean(axis=0),
+        "mrr": rr.mean(axis=0),
+        "ndcg": ndcg.mean(axis=0),
+    })
+
+def cascade_report(metrics, full="cross_encoder", adaptive="cross_encoder_adaptive"):
+    """
+    Cascada adaptativa frente al reranking completo (modo solo-recuperación):
+    pares del Cross-Encoder ahorrados frente a la calidad perdida en cada k.
+    """
+    full_m = metrics[metrics["method"] == full].set_index("k")
+    adaptive_m = metrics[metrics["method"] == adaptive].set_index("k")
+
+    report = pd.DataFrame({
+        "recall_delta": adaptive_m["recall"] - full_m["recall"],
+        "mrr_delta": adaptive_m["mrr"] - full_m["mrr"],
+        "ndcg_delta": adaptive_m["ndcg"] - full_m["ndcg"],
+    })
+    pairs_full = full_m["rerank_pairs"].iloc[0]
+    pairs_adaptive = adaptive_m["rerank_pairs"].iloc[0]
+    saved = (1 - pairs_adaptive / pairs_full) * 100 if pairs_full else 0.0
+
+    print("\n🪜 CASCADA ADAPTATIVA vs CROSS-ENCODER COMPLETO")
+    print(f"   Pares por pregunta: {pairs_adaptive:.1f} vs {pairs_full:.1f} ({saved:.1f}% ahorrado)")
+    print(report.round(3))
+    return report
+
+def plot_retrieval_metrics(metrics, dir_output : str):
+    """
+    6. GRÁFICO DE MÉTRICAS DE RECUPERACIÓN (sin LLM)
+    Recall@k, MRR@k y nDCG@k por método.
+    """
+    fig, axes = plt.subplots(1, 3, figsize=(16, 5), sharex=True)
+    for ax, metric, title in zip(axes, ["recall", "mrr", "ndcg"], ["Recall@k", "MRR@k", "nDCG@k"]):
+        sns.lineplot(data=metrics, x="k", y=metric, hue="method", marker="o", ax=ax)
+        ax.set_title(title, fontsize=13, fontweight='bold')
+        ax.set_ylim(0, 1.05)
+        ax.set_xlabel("k (chunks recuperados)")
+        ax.set_ylabel(title)
+
+    plt.suptitle("Calidad de Recuperación frente a la Evidencia del Paper", fontsize=14)
+    save_path = os.path.join(dir_output, "6_retrieval_metrics.png")
+    plt.savefig(save_path, dpi=300)
+    print("📊 Gráfico 6 guardado: Retrieval Metrics")
+    plt.close()
+
 def generate_dashboard(dir_input, dir_output : str):
     print(f"\n📈 Iniciando generación de gráficos desde: {dir_input}")
     
@@ -216,8 +402,8 @@ def generate_dashboard(dir_input, dir_output : str):
         print(f"📁 Creando directorio de salida: {dir_output}")
         os.makedirs(dir_output)
         
-    # 2. Cargar datos
-    df = load_data(dir_input)
+    # 2. Cargar datos (solo las columnas de las gráficas)
+    df = load_data(dir_input, DASHBOARD_COLUMNS)
     
     if df is not None:
         setup_plot_style()
@@ -228,6 +414,8 @@ def generate_dashboard(dir_input, dir_output : str):
             plot_rag_quality(df, dir_output)
             plot_latency(df, dir_output)
             plot_retrieval_score(df, dir_output)
+            if "compression_ratio" in df.columns and df["compression_ratio"].nunique() > 1:
+                plot_compression(df, dir_output)
             print(f"\n✅ ¡Éxito! Gráficos generados en: {os.path.abspath(dir_output)}")
         except Exception as e:
             print(f"❌ Error generando gráficos: {e}")
@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from src.matching import super_clean, longest_match
+from src.retrieval import get_chunk_id
+
+
+# --- CONFIGURACIÓN ---
+QUESTIONS_PATH = "./data/questions.json"
+EVIDENCE_INDEX_PATH = "./data/evidence_index.json"
+
+# Cobertura mínima (fracción de la referencia contenida en el chunk) para considerarlo evidencia
+EVIDENCE_MIN_COVERAGE = 0.15
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _fingerprint(chunk_ids):
+    """
+    Huella del conjunto de chunks: cambia si se reconstruye la BD con otro chunking.
+    Los ids son hashes del contenido: chunks de texto idéntico comparten id y cuentan una vez.
+    """
+    return _hash("|".join(sorted(set(chunk_ids))))
+
+
+def build_evidence_index(chunks, questions_path=QUESTIONS_PATH, index_path=EVIDENCE_INDEX_PATH,
+                         min_coverage=EVIDENCE_MIN_COVERAGE):
+    """
+    Localiza cada 'paper_reference' en los chunks una sola vez y guarda
+    pregunta -> {chunk_id: cobertura}. Primero búsqueda exacta, luego fuzzy
+    (subcadena común más larga sobre el texto limpio).
+
+    Args:
+        chunks (list[Document]): Chunks de la base de datos.
+        questions_path (str): Dataset de preguntas.
+        index_path (str): Dónde guardar el índice (None = no se guarda).
+        min_coverage (float): Cobertura mínima para que un chunk cuente como evidencia.
+
+    Returns:
+        dict: Índice de evidencias.
+    """
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    print(f"🔎 Indexando evidencias de {len(questions)} preguntas en {len(chunks)} chunks...")
+    cleaned = {get_chunk_id(chunk): super_clean(chunk.page_content) for chunk in chunks}
+
+    index = {
+        "chunks_fingerprint": _fingerprint(cleaned.keys()),
+        "min_coverage": min_coverage,
+        "questions": {},
+    }
+    for idx, q in enumerate(questions):
+        reference = q.get("paper_reference", "")
+        ref_clean = super_clean(reference)
+        if not ref_clean:
+            continue
+
+        support = {}
+        for chunk_id, chunk_clean in cleaned.items():
+            # 1. Exacta: la referencia entera cabe en el chunk
+            if ref_clean in chunk_clean:
+                support[chunk_id] = 1.0
+                continue
+            # 2. Fuzzy: parte de la referencia (p.ej. referencias que cruzan dos chunks)
+            _, _, size = longest_match(ref_clean, chunk_clean, autojunk=False)
+            coverage = size / len(ref_clean)
+            if coverage >= min_coverage:
+                support[chunk_id] = round(coverage, 4)
+
+        index["questions"][str(idx)] = {"reference_hash": _hash(reference), "chunks": support}
+
+    missing = sum(1 for entry in index["questions"].values() if not entry["chunks"])
+    print(f"   -> {len(index['questions']) - missing} referencias localizadas, {missing} sin chunk de soporte.")
+
+    if index_path:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        print(f"💾 Índice de evidencias guardado en {index_path}")
+    return index
+
+
+def build_evidence_index_from_db(engine, questions_path=QUESTIONS_PATH, index_path=EVIDENCE_INDEX_PATH):
+    """Construye el índice a partir de los chunks ya guardados en Chroma."""
+    chunks = engine.get_all_chunks()
+    if not chunks:
+        return None
+    return build_evidence_index(chunks, questions_path, index_path)
+
+
+def load_evidence_index(index_path=EVIDENCE_INDEX_PATH, questions_path=QUESTIONS_PATH):
+    """
+    Carga el índice de evidencias. Las preguntas cuya referencia haya cambiado
+    desde la ingesta se descartan (se evaluarán con el juez de texto).
+    """
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    with open(questions_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    for key in list(index["questions"]):
+        idx = int(key)
+        if idx >= len(questions) or _hash(questions[idx].get("paper_reference", "")) != index["questions"][key]["reference_hash"]:
+            del index["questions"][key]
+    return index
+
+
+def is_index_current(index, chunks):
+    """True si el índice se construyó sobre este mismo conjunto de chunks."""
+    return index is not None and index["chunks_fingerprint"] == _fingerprint(get_chunk_id(c) for c in chunks)
+
+
+def supporting_chunks(index, question_idx):
+    """Diccionario {chunk_id: cobertura} de la pregunta, o None si no está indexada."""
+    if index is None:
+        return None
+    entry = index["questions"].get(str(question_idx))
+    return None if entry is None else entry["chunks"]
+
+
+def verify_ground_truth_index(index, question_idx, retrieved_docs, threshold=0.5):
+    """
+    Juez por ids: intersección entre los chunks recuperados y los que contienen la referencia.
+
+    Returns:
+        tuple: (bool: evidencia encontrada, float: mayor cobertura recuperada, float: recall de chunks de soporte)
+               o None si la pregunta no está en el índice.
+    """
+    support = supporting_chunks(index, question_idx)
+    if support is None:
+        return None
+    if not support or not retrieved_docs:
+        return False, 0.0, 0.0
+
+    hits = {get_chunk_id(doc) for doc in retrieved_docs} & support.keys()
+    score = max((support[chunk_id] for chunk_id in hits), default=0.0)
+    recall = len(hits) / len(support)
+    return score >= threshold, score, recall
@@ -2,12 +2,13 @@ import os
 import shutil
 import gc
 import time
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_experimental.text_splitter import SemanticChunker
-from src.retrieval import RetrievalEngine
+from src.retrieval import RetrievalEngine, get_chunk_id
+from src.evidence_index import build_evidence_index, build_evidence_index_from_db, load_evidence_index, is_index_current, EVIDENCE_INDEX_PATH
+from src.page_cache import load_pages, PAGE_CACHE_DIR
 
 
 # --- CONFIGURACIÓN ---
@@ -25,14 +26,16 @@ CHUNKING_METHOD = "semantic"
 CHUNK_SIZE = 1200  
 CHUNK_OVERLAP = 350
 
-def get_text_splitter(method, embedding_model=None):
+def get_text_splitter(method, embedding_model=None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     """
     Fábrica de Splitters: Devuelve la herramienta de corte según la configuración.
+    chunk_size y chunk_overlap solo aplican a la estrategia "recursive".
     """
     if method == "semantic":
         # Corta cuando la diferencia semántica entre frases es muy alta
         return SemanticChunker(
             embedding_model,
+            add_start_index=True,
             breakpoint_threshold_type="percentile",
             breakpoint_threshold_amount=95
         )
@@ -40,29 +43,49 @@ def get_text_splitter(method, embedding_model=None):
     else:
         # Corte recursivo clásico por tamaño fijo
         return RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
             length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+            separators=["\n\n", "\n", ". ", " ", ""],
+            # Guardamos la posición en la página para poder fusionar chunks solapados
+            add_start_index=True
         )
 
-def ingest_data(chunking_method=CHUNKING_METHOD):
-    """Carga el PDF y lo trocea en chunks usando la estrategia seleccionada"""
-    if not os.path.exists(FILE_PATH):
-        print(f"\n❌ ERROR: No encuentro el archivo '{FILE_PATH}'")
+def load_pdf(file_path=FILE_PATH, use_cache=True):
+    """
+    Carga las páginas del PDF (lista vacía si no existe).
+    El texto extraído se guarda en data/page_cache por hash del contenido y versión del extractor:
+    reconstruir la BD con otro troceado no vuelve a parsear el PDF.
+    """
+    if not os.path.exists(file_path):
+        print(f"\n❌ ERROR: No encuentro el archivo '{file_path}'")
         return []
 
     print("📄 Cargando PDF...")
-    loader = PyPDFLoader(FILE_PATH)
-    docs = loader.load()
-    print(f"   -> PDF cargado: {len(docs)} páginas.")
+    docs, cached = load_pages(file_path, PAGE_CACHE_DIR if use_cache else None)
+    print(f"   -> PDF cargado: {len(docs)} páginas{' (caché de texto)' if cached else ''}.")
+    return docs
 
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+def split_pages(docs, chunking_method, embeddings, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Trocea las páginas y asigna a cada chunk su id estable."""
+    splitter = get_text_splitter(chunking_method, embeddings, chunk_size, chunk_overlap)
+    chunks = splitter.split_documents(docs)
+
+    # Id estable por chunk (lo usan el índice de evidencias y las cachés del juez)
+    for chunk in chunks:
+        chunk.metadata["chunk_id"] = get_chunk_id(chunk)
+    return chunks
 
-    splitter = get_text_splitter(chunking_method, embeddings)
+def ingest_data(chunking_method=CHUNKING_METHOD):
+    """Carga el PDF y lo trocea en chunks usando la estrategia seleccionada"""
+    docs = load_pdf()
+    if not docs:
+        return []
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
 
     print(f"✂️ Procesando fragmentos")
-    chunks = splitter.split_documents(docs)
+    chunks = split_pages(docs, chunking_method, embeddings)
 
     print(f"   -> Generados {len(chunks)} fragmentos.")
 
@@ -92,6 +115,9 @@ def clear_existing_db():
         gc.collect()
         if os.path.exists(CHROMA_PATH):
             shutil.rmtree(CHROMA_PATH)
+        # El índice de evidencias depende de los chunks: se regenera con la nueva BD
+        if os.path.exists(EVIDENCE_INDEX_PATH):
+            os.remove(EVIDENCE_INDEX_PATH)
     except Exception as e:
         print(f"\n❌ Error inesperado borrando DB: {e}")
         return False
@@ -104,6 +130,20 @@ def db_setup(rebuild_db: bool = False, chunking_method=CHUNKING_METHOD):
 
     if not rebuild_db and db_exists:
         print("\n⏩ Base de datos encontrada. Saltando ingesta.")
+        # El índice de evidencias es opcional: sin el juez "index" no se carga el motor aquí
+        # (run_questions también lo regenera si está desfasado)
+        from src.queries import EVIDENCE_JUDGE
+        if EVIDENCE_JUDGE != "index":
+            return
+        if not os.path.exists(EVIDENCE_INDEX_PATH):
+            print("⚠️  Índice de evidencias no encontrado. Generándolo desde la BD...")
+            build_evidence_index_from_db(RetrievalEngine.get_instance())
+        else:
+            engine = RetrievalEngine.get_instance()
+            if not is_index_current(load_evidence_index(), engine.get_all_chunks()):
+                # Otro chunking: sus chunk ids no son los de la BD actual
+                print("⚠️  Índice de evidencias de otro chunking. Regenerándolo desde la BD...")
+                build_evidence_index_from_db(engine)
         return
 
     if not db_exists:
@@ -114,6 +154,8 @@ def db_setup(rebuild_db: bool = False, chunking_method=CHUNKING_METHOD):
 
     chunks = ingest_data(chunking_method)
     create_vector_db(chunks)
+    if chunks:
+        build_evidence_index(chunks)
     print("✅ Setup completado.")
 
 if __name__ == "__main__":
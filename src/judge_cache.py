@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+from src.retrieval import get_chunk_id
+
+
+# --- CONFIGURACIÓN ---
+JUDGE_CACHE_PATH = "./data/judge_cache.json"
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def judge_key(reference, retrieved_docs, llm="gemini"):
+    """
+    Clave del veredicto: LLM que juzga + hash de la referencia + conjunto ordenado de chunk ids.
+    Los chunks comprimidos añaden el hash de su texto (mismo id, contenido distinto).
+    El LLM (backend y modelo, ver rag_pipeline.llm_id) evita mezclar veredictos del sustituto local con los reales.
+    """
+    chunk_keys = []
+    for doc in retrieved_docs:
+        key = get_chunk_id(doc)
+        if doc.metadata.get("compressed"):
+            key += "~" + _hash(doc.page_content)
+        chunk_keys.append(key)
+    return llm + ":" + _hash(reference) + ":" + _hash("|".join(sorted(chunk_keys)))
+
+
+class JudgeCache:
+    """Veredictos del juez LLM persistidos en disco (compartidos entre métodos y repeticiones)."""
+
+    def __init__(self, path=JUDGE_CACHE_PATH):
+        self.path = path
+        self.verdicts = {}
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.verdicts = json.load(f)
+
+    def get(self, key):
+        verdict = self.verdicts.get(key)
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def put(self, key, verdict):
+        self.verdicts[key] = bool(verdict)
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Otros procesos pueden haber guardado veredictos nuevos: los mezclamos
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.verdicts = {**json.load(f), **self.verdicts}
+            except (json.JSONDecodeError, OSError):
+                pass
+        # Escritura atómica: otro proceso puede estar leyendo la caché
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.verdicts, f)
+        os.replace(tmp_path, self.path)
+
+
+_cache = None
+
+def get_judge_cache():
+    """Caché global del proceso (se carga de disco la primera vez)."""
+    global _cache
+    if _cache is None:
+        _cache = JudgeCache()
+    return _cache
@@ -1,6 +1,7 @@
 import os
 import shutil
 from src.ingestion import db_setup
+from src.results_store import RESULTS_FILE, CHUNKS_FILE, PARTIAL_FILE
  
 def setup_enviroment(rebuild_db=False, clear_results=True, results_dirt="./results"):
     """
@@ -22,13 +23,17 @@ def setup_enviroment(rebuild_db=False, clear_results=True, results_dirt="./resul
         os.makedirs(results_dirt + "/plots")
 
     # --- 1. LIMPIEZA INICIAL ---
-    # Borramos el final anterior
-    if clear_results and os.path.exists(results_dirt+ "/resultados_finales.csv"):
-        os.remove(results_dirt+"/resultados_finales.csv")
+    # Borramos el final anterior (Parquet y CSV de versiones anteriores)
+    for final_name in (RESULTS_FILE, CHUNKS_FILE, "resultados_finales.csv"):
+        final_path = os.path.join(results_dirt, final_name)
+        if clear_results and os.path.exists(final_path):
+            os.remove(final_path)
         
     # Borramos el parcial anterior para empezar el log de cero
-    if clear_results and os.path.exists("./results/resultados_parciales.csv"):
-        os.remove("./results/resultados_parciales.csv")
+    # (en modo persistente se conserva para poder retomar la ejecución)
+    for partial_path in (os.path.join(results_dirt, PARTIAL_FILE), "./results/resultados_parciales.csv"):
+        if clear_results and os.path.exists(partial_path):
+            os.remove(partial_path)
 
     #Borramos las tablas anteriores
     plots_dir = os.path.join(results_dirt, "plots")
@@ -0,0 +1,440 @@
+import os
+import json
+import math
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from src.evaluation import clean_emojis, STATUS_PALETTE
+from src.results_store import PARTIAL_FILE
+
+
+# --- CONFIGURACIÓN ---
+SKETCH_RELATIVE_ACCURACY = 0.01  # error relativo máximo de los cuantiles de latencia
+SCORE_BINS = 20                  # histograma de retrieval_score en [0, 1]
+LIVE_RENDER_EVERY = 50           # filas nuevas entre renders del dashboard en vivo
+LIVE_WATCH_SECONDS = 30.0        # intervalo al seguir el log de otros procesos
+LIVE_DPI = 120
+LIVE_DIR = "live"                # subcarpeta de plots
+LIVE_STATS_FILE = "live_stats.json"
+
+
+class QuantileSketch:
+    """
+    Cuantiles en streaming con error relativo acotado (estilo DDSketch): cada valor cuenta
+    en el cubo logarítmico ceil(log_gamma(x)), con gamma = (1 + a) / (1 - a).
+    La memoria depende del rango de valores, no del número de filas, y dos sketches se suman.
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Valor del cuantil q (0-1) con error relativo <= relative_accuracy. None si está vacío."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # Centro (relativo) del cubo (gamma^(key-1), gamma^key]
+                return min(max(2 * self.gamma ** key / (self.gamma + 1), self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "zeros": self.zeros, "count": self.count,
+                "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "buckets": {str(key): n for key, n in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets = Counter({int(key): n for key, n in data["buckets"].items()})
+        sketch.zeros, sketch.count = data["zeros"], data["count"]
+        if sketch.count:
+            sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
+
+
+class LiveStats:
+    """
+    Agregados por método que se actualizan fila a fila: aciertos, evidencia, mezcla de status,
+    sketch de latencia, histograma de retrieval_score y tokens de entrada.
+    No guarda las filas: el dashboard se dibuja desde aquí en cualquier momento.
+    Aciertos, evidencia, status y tokens se cuentan por pregunta y cada pregunta pesa lo mismo
+    (como evaluation.method_accuracy); latencia y retrieval_score son una muestra por ejecución.
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        self.methods = {}
+        self.rows = 0
+        # Posición leída del log (follow) para no volver a leerlo entero
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def _method(self, method):
+        if method not in self.methods:
+            self.methods[method] = {"n": 0, "questions": {}, "latency": QuantileSketch(),
+                                    "scores": np.zeros(SCORE_BINS, dtype=np.int64)}
+        return self.methods[method]
+
+    @staticmethod
+    def _question(agg, question_id):
+        # Claves str: son las mismas tras guardar y cargar live_stats.json
+        key = str(question_id)
+        if key not in agg["questions"]:
+            agg["questions"][key] = {"n": 0, "correct": 0, "found_evidence": 0, "prompt_tokens": 0,
+                                     "status": Counter()}
+        return agg["questions"][key]
+
+    @staticmethod
+    def _question_means(agg):
+        """Accuracy, evidencia, tokens y proporción de cada status como media de las de cada pregunta."""
+        questions = agg["questions"].values()
+        means = {field: sum(q[field] / q["n"] for q in questions) / len(questions)
+                 for field in ("correct", "found_evidence", "prompt_tokens")}
+        status = Counter()
+        for q in questions:
+            for name, count in q["status"].items():
+                status[name] += count / q["n"] / len(questions)
+        means["status"] = status
+        return means
+
+    def update(self, row):
+        """Suma una fila de resultados (las de otra ejecución se ignoran)."""
+        if self.run_id is not None and str(row.get("run_id")) != str(self.run_id):
+            return
+        with self.lock:
+            agg = self._method(row["method"])
+            agg["n"] += 1
+            question = self._question(agg, row.get("question_id"))
+            question["n"] += 1
+            question["correct"] += bool(row.get("correct"))
+            question["found_evidence"] += bool(row.get("found_evidence"))
+            question["prompt_tokens"] += row.get("prompt_tokens") or 0
+            if row.get("status") is not None:
+                question["status"][clean_emojis(row["status"])] += 1
+            if row.get("response_time") is not None:
+                agg["latency"].add(row["response_time"])
+            score = row.get("retrieval_score")
+            if score is not None and not math.isnan(score):
+                agg["scores"][min(max(int(score * SCORE_BINS), 0), SCORE_BINS - 1)] += 1
+            self.rows += 1
+
+    def follow(self, path):
+        """
+        Lee solo las líneas nuevas (completas) del log JSON Lines desde la última llamada.
+
+        Returns:
+            int: Filas añadidas
+        """
+        if not os.path.exists(path):
+            return 0
+        before = self.rows
+        with open(path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        # Una última línea a medias se deja para la siguiente lectura
+        complete = data[:data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        for line in complete.decode("utf-8").splitlines():
+            try:
+                self.update(json.loads(line))
+            except (json.JSONDecodeError, KeyError):
+                continue
+        return self.rows - before
+
+    def summary(self):
+        """Resumen por método: n, accuracy, evidencia, latencia p50/p90/p99 y tokens medios."""
+        with self.lock:
+            summary = {}
+            for method, agg in self.methods.items():
+                means = self._question_means(agg)
+                summary[method] = {
+                    "n": agg["n"],
+                    "accuracy": means["correct"],
+                    "evidence": means["found_evidence"],
+                    "latency_p50": agg["latency"].quantile(0.5),
+                    "latency_p90": agg["latency"].quantile(0.9),
+                    "latency_p99": agg["latency"].quantile(0.99),
+                    "prompt_tokens": means["prompt_tokens"],
+                }
+            return summary
+
+    def snapshot(self):
+        """Copia de los agregados para dibujar sin bloquear al que sigue añadiendo filas."""
+        with self.lock:
+            return {method: {"n": agg["n"], **self._question_means(agg),
+                             "latency": {q: agg["latency"].quantile(q) for q in (0.05, 0.25, 0.5, 0.75, 0.95, 0.99)},
+                             "scores": agg["scores"].copy()}
+                    for method, agg in sorted(self.methods.items())}
+
+    def to_dict(self):
+        with self.lock:
+            return {"run_id": self.run_id, "rows": self.rows, "offset": self.offset,
+                    "methods": {method: dict(agg, latency=agg["latency"].to_dict(), scores=agg["scores"].tolist(),
+                                             questions={key: dict(q, status=dict(q["status"]))
+                                                        for key, q in agg["questions"].items()})
+                                for method, agg in self.methods.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data["run_id"])
+        stats.rows, stats.offset = data["rows"], data["offset"]
+        for method, agg in data["methods"].items():
+            stats.methods[method] = dict(agg, latency=QuantileSketch.from_dict(agg["latency"]),
+                                         scores=np.asarray(agg["scores"], dtype=np.int64),
+                                         questions={key: dict(q, status=Counter(q["status"]))
+                                                    for key, q in agg["questions"].items()})
+        return stats
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+# --- GRÁFICAS (Figure sin pyplot: se pueden dibujar en hilos a la vez) ---
+def _bar_labels(ax, bars, fmt):
+    for bar in bars:
+        if bar.get_height() > 0:
+            ax.annotate(fmt.format(bar.get_height()), (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                        ha="center", va="bottom", xytext=(0, 3), textcoords="offset points", fontsize=9)
+
+
+def _plot_accuracy(snapshot):
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    methods = list(snapshot)
+    accuracy = [100 * snapshot[m]["correct"] for m in methods]
+    bars = ax.bar(methods, accuracy, edgecolor="black", color=[f"C{i}" for i in range(len(methods))])
+    _bar_labels(ax, bars, "{:.1f}%")
+    ax.set_title("Precisión de Respuesta (Accuracy) por Método", fontsize=14, fontweight="bold")
+    ax.set_ylabel("% de Acierto")
+    ax.set_xlabel("Método de Recuperación")
+    ax.set_ylim(0, 115)
+    return fig
+
+
+def _plot_rag_quality(snapshot):
+    fig = Figure(figsize=(12, 7))
+    ax = fig.subplots()
+    methods = list(snapshot)
+    statuses = sorted({status for agg in snapshot.values() for status in agg["status"]},
+                      key=lambda s: list(STATUS_PALETTE).index(s) if s in STATUS_PALETTE else len(STATUS_PALETTE))
+    width = 0.8 / max(len(statuses), 1)
+    x = np.arange(len(methods))
+    for i, status in enumerate(statuses):
+        pct = [100 * snapshot[m]["status"][status] for m in methods]
+        bars = ax.bar(x + (i - (len(statuses) - 1) / 2) * width, pct, width, label=status,
+                      color=STATUS_PALETTE.get(status, "#95a5a6"), edgecolor="black")
+        _bar_labels(ax, bars, "{:.1f}%")
+    ax.set_xticks(x, methods)
+    ax.set_title("Diagnóstico de Calidad RAG (Porcentajes Relativos)", fontsize=14, fontweight="bold")
+    ax.set_ylabel("Porcentaje del Total (%)")
+    ax.set_xlabel("Método")
+    ax.legend(title="Diagnóstico", bbox_to_anchor=(1.01, 1), loc="upper left")
+    ax.set_ylim(0, 110)
+    return fig
+
+
+def _plot_latency(snapshot):
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    methods = [m for m in snapshot if snapshot[m]["latency"][0.5] is not None]
+    # Caja p25-p75, mediana y bigotes p5-p95 a partir del sketch; el p99 como punto
+    boxes = [{"label": m, "q1": snapshot[m]["latency"][0.25], "med": snapshot[m]["latency"][0.5],
+              "q3": snapshot[m]["latency"][0.75], "whislo": snapshot[m]["latency"][0.05],
+              "whishi": snapshot[m]["latency"][0.95], "fliers": [snapshot[m]["latency"][0.99]]}
+             for m in methods]
+    if boxes:
+        ax.bxp(boxes, showfliers=True)
+    ax.set_title("Latencia del Sistema (p5/p25/p50/p75/p95, punto = p99; una muestra por ejecución)", fontsize=14)
+    ax.set_ylabel("Segundos")
+    ax.set_xlabel("Método")
+    ax.grid(True, axis="y", linestyle="--", alpha=0.5)
+    return fig
+
+
+def _plot_retrieval_score(snapshot):
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    edges = np.linspace(0, 1, SCORE_BINS + 1)
+    for method, agg in snapshot.items():
+        total = agg["scores"].sum()
+        if total:
+            ax.stairs(100 * agg["scores"] / total, edges, label=method, linewidth=2)
+    ax.set_title("Fidelidad de Recuperación (Similitud con Ground Truth, una muestra por ejecución)", fontsize=14)
+    ax.set_xlabel("Puntuación de Similitud (0-1)")
+    ax.set_ylabel("% de Respuestas")
+    ax.set_xlim(0, 1)
+    ax.legend()
+    return fig
+
+
+LIVE_PLOTS = [
+    ("1_accuracy.png", _plot_accuracy),
+    ("2_rag_quality_pct.png", _plot_rag_quality),
+    ("3_latency.png", _plot_latency),
+    ("4_retrieval_fidelity.png", _plot_retrieval_score),
+]
+
+
+def render_live_dashboard(stats, dir_output, dpi=LIVE_DPI, workers=len(LIVE_PLOTS)):
+    """
+    Dibuja el dashboard desde los agregados (sin leer resultados del disco), una gráfica por hilo.
+
+    Returns:
+        list[str]: Rutas de las gráficas guardadas
+    """
+    snapshot = stats.snapshot()
+    if not snapshot:
+        return []
+    os.makedirs(dir_output, exist_ok=True)
+
+    def render(plot):
+        name, plot_fn = plot
+        path = os.path.join(dir_output, name)
+        fig = plot_fn(snapshot)
+        fig.savefig(path, dpi=dpi, bbox_inches="tight")
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render, LIVE_PLOTS))
+
+
+class LiveDashboard:
+    """
+    Dashboard en vivo de una carpeta de resultados: agregados + render cada LIVE_RENDER_EVERY filas.
+    Se alimenta fila a fila (update, p. ej. como on_append de ResultLog) o siguiendo el log
+    que escriben otros procesos (watch).
+    """
+
+    def __init__(self, results_dir, run_id=None, every=LIVE_RENDER_EVERY, dpi=LIVE_DPI):
+        self.results_dir = results_dir
+        self.dir_output = os.path.join(results_dir, "plots", LIVE_DIR)
+        self.stats = LiveStats(run_id)
+        self.every = every
+        self.dpi = dpi
+        self._rendered_rows = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._render_thread = None
+
+    def update(self, row):
+        self.stats.update(row)
+        if self.stats.rows - self._rendered_rows >= self.every:
+            self.render(background=True)
+
+    def render(self, background=False):
+        """
+        Guarda los agregados (live_stats.json) y redibuja las gráficas.
+        Con background=True dibuja en otro hilo y la ejecución sigue (si ya hay uno dibujando, no hace nada).
+        """
+        if background:
+            if self._render_thread is None or not self._render_thread.is_alive():
+                self._rendered_rows = self.stats.rows
+                self._render_thread = threading.Thread(target=self.render, daemon=True)
+                self._render_thread.start()
+            return []
+
+        start_ts = time.time()
+        self._rendered_rows = self.stats.rows
+        try:
+            self.stats.save(os.path.join(self.dir_output, LIVE_STATS_FILE))
+            paths = render_live_dashboard(self.stats, self.dir_output, self.dpi)
+        except Exception as e:
+            # Un fallo al dibujar no debe parar la ejecución
+            print(f"⚠️ Dashboard en vivo: {e}")
+            return []
+        if paths:
+            print(f"📈 Dashboard en vivo: {self.stats.rows} filas ({time.time() - start_ts:.1f}s) -> {self.dir_output}")
+        return paths
+
+    def watch(self, log_path=None, interval=LIVE_WATCH_SECONDS):
+        """Sigue el log de resultados en un hilo y redibuja cuando hay filas nuevas."""
+        log_path = log_path or os.path.join(self.results_dir, PARTIAL_FILE)
+
+        def loop():
+            while not self._stop.wait(interval):
+                if self.stats.follow(log_path):
+                    self.render()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, log_path=None):
+        """Para el seguimiento (si lo hay) y deja el dashboard con las últimas filas."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.stats.follow(log_path or os.path.join(self.results_dir, PARTIAL_FILE))
+        if self._render_thread is not None:
+            self._render_thread.join()
+        if self.stats.rows != self._rendered_rows:
+            self.render()
+
+
+if __name__ == "__main__":
+    # Vigilar una ejecución larga desde otra terminal:
+    # python -m src.live_dashboard results/persistent_results/mi_prueba --interval 60
+    parser = argparse.ArgumentParser(description="Dashboard en vivo desde el log de resultados parciales")
+    parser.add_argument("results_dir")
+    parser.add_argument("--run-id", default=None)
+    parser.add_argument("--interval", type=float, default=LIVE_WATCH_SECONDS)
+    parser.add_argument("--once", action="store_true", help="Lee el log, dibuja y termina")
+    args = parser.parse_args()
+
+    dashboard = LiveDashboard(args.results_dir, args.run_id)
+    log_path = os.path.join(args.results_dir, PARTIAL_FILE)
+    dashboard.stats.follow(log_path)
+    dashboard.render()
+    if not args.once:
+        print(f"👀 Siguiendo {log_path} cada {args.interval:.0f}s (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(args.interval)
+                if dashboard.stats.follow(log_path):
+                    dashboard.render()
+        except KeyboardInterrupt:
+            pass
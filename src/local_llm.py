@@ -0,0 +1,103 @@
+import os
+import re
+import time
+from langchain_core.messages import AIMessage, AIMessageChunk
+from src.context import count_tokens
+
+
+# --- CONFIGURACIÓN ---
+# Latencias simuladas (ms): primera respuesta y cada token siguiente
+LOCAL_FIRST_TOKEN_MS = float(os.getenv("RAG_LOCAL_LLM_FIRST_TOKEN_MS", "0"))
+LOCAL_TOKEN_MS = float(os.getenv("RAG_LOCAL_LLM_TOKEN_MS", "0"))
+# Tokens de explicación tras la respuesta (los modelos reales a veces siguen escribiendo pese al prompt)
+LOCAL_EXTRA_TOKENS = int(os.getenv("RAG_LOCAL_LLM_EXTRA_TOKENS", "0"))
+LOCAL_EXPLANATION = " Explanation: the context supports this option."
+
+# Cobertura mínima (palabras de la referencia presentes en el contexto) para que el juez diga YES
+LOCAL_JUDGE_COVERAGE = 0.5
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text):
+    return set(_WORD.findall(text.lower()))
+
+
+def _section(prompt, start, end):
+    """Texto entre dos cabeceras del prompt ('' si no están)."""
+    match = re.search(re.escape(start) + r"(.*?)" + re.escape(end), prompt, re.S)
+    return match.group(1) if match else ""
+
+
+def _coverage(reference, context):
+    reference_words = _words(reference)
+    if not reference_words:
+        return 0.0
+    return len(reference_words & _words(context)) / len(reference_words)
+
+
+class LocalLLM:
+    """
+    Sustituto local y determinista del LLM (sin red ni cuota) para benchmarks y pruebas.
+    Entiende los prompts del pipeline:
+    - Pregunta tipo test: elige la opción con más palabras presentes en el contexto.
+    - Juez (simple o por lotes): YES si la referencia está cubierta por el contexto.
+    Misma interfaz que ChatGoogleGenerativeAI: invoke() y stream(), y el mismo tope de
+    salida (max_output_tokens: la respuesta se corta en ese número de tokens).
+    """
+
+    def __init__(self, first_token_ms=LOCAL_FIRST_TOKEN_MS, token_ms=LOCAL_TOKEN_MS,
+                 extra_tokens=LOCAL_EXTRA_TOKENS, max_output_tokens=None, **kwargs):
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.extra_tokens = extra_tokens
+        self.max_output_tokens = max_output_tokens
+        self.calls = 0
+
+    def _answer(self, prompt):
+        # Juez: parejas (referencia, contexto) bajo sus cabeceras
+        pairs = re.findall(r"(?ms)^GROUND TRUTH[^\n]*:\s*$(.*?)^RETRIEVED CONTEXT[^\n]*:\s*$(.*?)(?=^### ITEM|^INSTRUCTIONS:)", prompt)
+        verdicts = ["YES" if _coverage(reference, context) >= LOCAL_JUDGE_COVERAGE else "NO" for reference, context in pairs]
+        if "### ITEM" in prompt:
+            # Por lotes: una línea "n: YES/NO" por ítem
+            return "\n".join(f"{n}: {verdict}" for n, verdict in enumerate(verdicts, start=1))
+        if verdicts:
+            return verdicts[0]
+
+        # Pregunta tipo test
+        context_words = _words(_section(prompt, "CONTEXT FROM PAPER:", "QUESTION:"))
+        options = re.findall(r"(?m)^([A-D])\. (.*)$", _section(prompt, "OPTIONS:", "INSTRUCTIONS:"))
+        if not options:
+            return "A"
+
+        def support(option):
+            words = _words(option[1])
+            return len(words & context_words) / len(words) if words else 0.0
+
+        return max(options, key=support)[0]
+
+    def _usage(self, prompt, answer):
+        input_tokens, output_tokens = count_tokens(prompt), count_tokens(answer)
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _tokens(self, answer):
+        # Trozos de ~1 token (4 caracteres), como llegarían en streaming
+        tokens = [answer[i:i + 4] for i in range(0, len(answer), 4)] or [""]
+        if self.extra_tokens:
+            filler = LOCAL_EXPLANATION * (4 * self.extra_tokens // len(LOCAL_EXPLANATION) + 1)
+            tokens += [filler[i:i + 4] for i in range(0, 4 * self.extra_tokens, 4)]
+        return tokens[:self.max_output_tokens] if self.max_output_tokens else tokens
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        tokens = self._tokens(self._answer(str(prompt)))
+        time.sleep((self.first_token_ms + self.token_ms * (len(tokens) - 1)) / 1000)
+        answer = "".join(tokens)
+        return AIMessage(content=answer, usage_metadata=self._usage(str(prompt), answer))
+
+    def stream(self, prompt, **kwargs):
+        self.calls += 1
+        for n, token in enumerate(self._tokens(self._answer(str(prompt)))):
+            time.sleep((self.first_token_ms if n == 0 else self.token_ms) / 1000)
+            yield AIMessageChunk(content=token)
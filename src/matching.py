@@ -0,0 +1,167 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+
+# --- CONFIGURACIÓN ---
+# Todo lo que no sea letra o número (el "_" cuenta como palabra en regex, lo quitamos aparte)
+NON_ALNUM = re.compile(r"[\W_]+")
+
+# Caché de textos limpios por chunk id (los chunks de la BD no cambian durante una ejecución)
+_CLEAN_CACHE = {}
+
+
+# --- LIMPIADOR ---
+def super_clean(text):
+    """
+    Minúsculas y solo caracteres alfanuméricos.
+    Equivale a "".join(c for c in text.lower() if c.isalnum()), pero en C (regex).
+    """
+    return NON_ALNUM.sub("", text.lower())
+
+
+def clean_docs(docs, get_id, lookup=None):
+    """
+    Texto limpio de la concatenación de varios chunks, usando la caché por chunk id.
+
+    Args:
+        docs (list[Document]): Chunks recuperados.
+        get_id (callable): Función que devuelve el id estable de un chunk.
+        lookup (callable): chunk_id -> texto limpio de otra caché (p.ej. ChunkStore.clean_text_by_id), o None.
+    """
+    parts = []
+    for doc in docs:
+        # Un chunk comprimido conserva el id de su original, pero no su texto
+        if doc.metadata.get("compressed"):
+            parts.append(super_clean(doc.page_content))
+            continue
+
+        chunk_id = get_id(doc)
+        cleaned = _CLEAN_CACHE.get(chunk_id)
+        if cleaned is None and lookup is not None:
+            cleaned = lookup(chunk_id)
+        if cleaned is None:
+            cleaned = _CLEAN_CACHE[chunk_id] = super_clean(doc.page_content)
+        parts.append(cleaned)
+    return "".join(parts)
+
+
+def clear_clean_cache():
+    """Vacía la caché (p.ej. al reconstruir la base de datos)."""
+    _CLEAN_CACHE.clear()
+
+
+class _SuffixAutomaton:
+    """
+    Autómata de sufijos de 'text': reconoce todas sus subcadenas en O(len(text)).
+    Para cada estado guardamos 'firstpos', la posición donde termina la
+    primera aparición de las cadenas de ese estado.
+    """
+
+    def __init__(self, text):
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        self.firstpos = [-1]
+        last = 0
+
+        for pos, char in enumerate(text):
+            cur = len(self.next)
+            self.next.append({})
+            self.link.append(-1)
+            self.length.append(self.length[last] + 1)
+            self.firstpos.append(pos)
+
+            p = last
+            while p != -1 and char not in self.next[p]:
+                self.next[p][char] = cur
+                p = self.link[p]
+
+            if p == -1:
+                self.link[cur] = 0
+            else:
+                q = self.next[p][char]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = len(self.next)
+                    self.next.append(dict(self.next[q]))
+                    self.link.append(self.link[q])
+                    self.length.append(self.length[p] + 1)
+                    self.firstpos.append(self.firstpos[q])
+                    while p != -1 and self.next[p].get(char) == q:
+                        self.next[p][char] = clone
+                        p = self.link[p]
+                    self.link[q] = clone
+                    self.link[cur] = clone
+            last = cur
+
+
+@lru_cache(maxsize=256)
+def _automaton(text):
+    # La misma referencia se compara contra todos los métodos y repeticiones
+    return _SuffixAutomaton(text)
+
+
+def _popular(b):
+    """Caracteres que difflib descarta como 'populares' (autojunk) en b."""
+    n = len(b)
+    if n < 200:
+        return set()
+    ntest = n // 100 + 1
+    return {char for char, count in Counter(b).items() if count > ntest}
+
+
+def longest_match(a, b, autojunk=True):
+    """
+    Bloque común más largo entre a y b en tiempo lineal (autómata de sufijos).
+
+    Con autojunk=True devuelve exactamente lo mismo que
+    SequenceMatcher(None, a, b).find_longest_match(0, len(a), 0, len(b)):
+    el núcleo del bloque no puede contener caracteres 'populares' de b
+    (más del 1% de b cuando len(b) >= 200) y luego se extiende a ambos lados.
+    Con autojunk=False es la subcadena común más larga real.
+
+    Returns:
+        tuple: (i, j, size) con a[i:i+size] == b[j:j+size]
+    """
+    if not a or not b:
+        return 0, 0, 0
+
+    popular = _popular(b) if autojunk else set()
+    sam = _automaton(a)
+    nxt, link, length, firstpos = sam.next, sam.link, sam.length, sam.firstpos
+
+    state, size = 0, 0
+    best_size, best_i_end, best_j_end = 0, -1, -1
+    for j, char in enumerate(b):
+        if char in popular:
+            state, size = 0, 0
+            continue
+
+        while state and char not in nxt[state]:
+            state = link[state]
+            size = length[state]
+        if char in nxt[state]:
+            state = nxt[state][char]
+            size += 1
+        else:
+            state, size = 0, 0
+            continue
+
+        # difflib se queda con el primer máximo recorriendo a y luego b
+        if size > best_size or (size == best_size and firstpos[state] < best_i_end):
+            best_size, best_i_end, best_j_end = size, firstpos[state], j
+
+    if best_size == 0:
+        i, j = 0, 0
+    else:
+        i, j = best_i_end - best_size + 1, best_j_end - best_size + 1
+
+    # Extensión del bloque con caracteres iguales (también los populares)
+    while i > 0 and j > 0 and a[i - 1] == b[j - 1]:
+        i, j, best_size = i - 1, j - 1, best_size + 1
+    while i + best_size < len(a) and j + best_size < len(b) and a[i + best_size] == b[j + best_size]:
+        best_size += 1
+
+    return i, j, best_size
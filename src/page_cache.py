@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from langchain_core.documents import Document
+
+
+# --- CONFIGURACIÓN ---
+PAGE_CACHE_DIR = "./data/page_cache"
+
+# Subir si cambia la forma de extraer el texto (invalida las entradas anteriores)
+EXTRACTOR_VERSION = 1
+
+# Extracción en paralelo por rangos de páginas (solo si el PDF tiene al menos PARALLEL_MIN_PAGES)
+EXTRACT_WORKERS = os.cpu_count() or 1
+PARALLEL_MIN_PAGES = 16
+
+
+def file_hash(file_path):
+    """SHA-256 del contenido del fichero (no de su ruta ni de su fecha)."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extractor_id():
+    """Versión del extractor: la nuestra + la de pypdf (otra versión de pypdf puede dar otro texto)."""
+    import pypdf
+    return f"v{EXTRACTOR_VERSION}-pypdf{pypdf.__version__}"
+
+
+def cache_path(file_path, cache_dir=PAGE_CACHE_DIR):
+    return os.path.join(cache_dir, f"{file_hash(file_path)[:32]}-{extractor_id()}.parquet")
+
+
+def _extract_text(page):
+    # Igual que PyPDFParser de langchain_community 0.2 (texto en modo "plain")
+    import pypdf
+    if pypdf.__version__.startswith("3"):
+        return page.extract_text()
+    return page.extract_text(extraction_mode="plain")
+
+
+def _extract_range(file_path, start, end):
+    """Texto de las páginas [start, end) (cada proceso abre su propio lector)."""
+    import pypdf
+    reader = pypdf.PdfReader(file_path)
+    return [_extract_text(reader.pages[i]) for i in range(start, end)]
+
+
+def extract_pages(file_path, workers=EXTRACT_WORKERS):
+    """
+    Extrae el texto de todas las páginas, repartiendo rangos de páginas entre procesos.
+
+    Returns:
+        list[str]: Texto de cada página, en orden
+    """
+    import pypdf
+    n_pages = len(pypdf.PdfReader(file_path).pages)
+    workers = min(workers, n_pages // (PARALLEL_MIN_PAGES // 2) or 1)
+    if workers <= 1 or n_pages < PARALLEL_MIN_PAGES:
+        return _extract_range(file_path, 0, n_pages)
+
+    bounds = [n_pages * i // workers for i in range(workers + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(_extract_range, [file_path] * workers, bounds[:-1], bounds[1:])
+        return [text for part in parts for text in part]
+
+
+def load_pages(file_path, cache_dir=PAGE_CACHE_DIR, workers=EXTRACT_WORKERS):
+    """
+    Páginas del PDF como Documents (mismo texto y metadatos que PyPDFLoader), desde la caché
+    si el contenido del fichero y la versión del extractor coinciden; si no, se extraen y se guardan.
+
+    Returns:
+        tuple: (list[Document], bool acierto de caché)
+    """
+    path = cache_path(file_path, cache_dir) if cache_dir else None
+    if path and os.path.exists(path):
+        try:
+            table = pd.read_parquet(path)
+            pages = [Document(page_content=text, metadata=json.loads(metadata))
+                     for text, metadata in zip(table["text"], table["metadata"])]
+            return pages, True
+        except Exception as e:
+            print(f"⚠️ Caché de páginas ilegible ({e}). Se vuelve a extraer el PDF.")
+
+    texts = extract_pages(file_path, workers)
+    pages = [Document(page_content=text, metadata={"source": file_path, "page": page})
+             for page, text in enumerate(texts)]
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        table = pd.DataFrame({"page": pd.Series(range(len(pages)), dtype="int32"),
+                              "text": texts,
+                              "metadata": [json.dumps(p.metadata, ensure_ascii=False) for p in pages]})
+        # Escritura atómica: otro proceso (workers del sweep) puede estar leyendo la caché
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        table.to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, path)
+    return pages, False
+
+
+if __name__ == "__main__":
+    # python -m src.page_cache ruta.pdf -> tiempos de extracción en frío y desde la caché
+    import sys
+    pdf = sys.argv[1] if len(sys.argv) > 1 else "./data/paper_refrag.pdf"
+    for label, kwargs in [("sin caché", {"cache_dir": None}), ("primera vez", {}), ("desde caché", {})]:
+        start_ts = time.perf_counter()
+        pages, hit = load_pages(pdf, **kwargs)
+        print(f"   {label:<12} {len(pages)} páginas en {(time.perf_counter() - start_ts)*1000:8.1f} ms (acierto: {hit})")
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from src.rag_pipeline import set_rate_limiter
+from src.results_store import ResultLog
+
+
+# --- CONFIGURACIÓN ---
+# Límite global de llamadas al LLM entre TODOS los procesos (ajustar a la cuota de la API)
+MAX_REQUESTS_PER_MINUTE = 240
+QUESTIONS_PATH = "./data/questions.json"
+DEFAULT_METHODS = ["baseline", "bm25", "dense", "hybrid", "cross_encoder"]
+
+
+class RateLimiter:
+    """
+    Espaciado mínimo entre llamadas al LLM compartido entre procesos.
+    Cada llamada reserva el siguiente hueco libre (memoria compartida) y espera hasta él.
+    """
+
+    def __init__(self, requests_per_minute=MAX_REQUESTS_PER_MINUTE, next_slot=None):
+        self.min_interval = 60.0 / requests_per_minute
+        self.next_slot = next_slot if next_slot is not None else mp.Value("d", 0.0)
+
+    def wait(self):
+        with self.next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self.next_slot.value)
+            self.next_slot.value = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Log de resultados del proceso worker (uno por proceso, abierto en _init_worker)
+_worker_log = None
+
+
+def _init_worker(next_slot, requests_per_minute, methods, torch_threads, partial_file):
+    """
+    Inicializa cada proceso: limitador compartido, log de resultados y motor de búsqueda caliente
+    (Chroma, BM25 y Cross-Encoder se cargan una vez por proceso, no por tarea).
+    """
+    global _worker_log
+    # Import perezoso: el proceso padre no necesita cargar los modelos
+    import torch
+    from src.retrieval import RetrievalEngine
+    # Repartimos los núcleos entre procesos para que torch no sobresuscriba la CPU
+    torch.set_num_threads(torch_threads)
+    set_rate_limiter(RateLimiter(requests_per_minute, next_slot))
+
+    # Sin reparar: una línea sin terminar puede ser la escritura en curso de otro worker
+    _worker_log = ResultLog(partial_file, repair=False)
+
+    engine = RetrievalEngine.get_instance()
+    engine.warm_up(methods)
+
+
+def _run_task(questions_slice, methods, api_key, partial_file, run_id, repetition, skip=None):
+    """Una tarea = una repetición (o un trozo de preguntas de una repetición)."""
+    from src.queries import run_questions
+
+    # El limitador global sustituye a la pausa fija entre consultas
+    df = run_questions(questions_slice, methods, api_key, partial_file, sleep_time=0,
+                       run_id=run_id, repetition=repetition, result_log=_worker_log, skip=skip)
+    return repetition, len(df)
+
+
+def _shards(n_questions, n_shards):
+    """Divide los índices de preguntas en n_shards trozos contiguos."""
+    size = -(-n_questions // n_shards)
+    return [list(range(start, min(start + size, n_questions))) for start in range(0, n_questions, size)]
+
+
+class ParallelRunner:
+    """
+    Pool de procesos y limitador global que se mantienen vivos entre rondas
+    (p. ej. las del modo adaptativo): los motores se calientan una sola vez por proceso.
+
+        with ParallelRunner(api_key, partial_file, run_id, workers=4) as runner:
+            df = runner.run([0, 1])
+            df = runner.run([2], skip={(3, "bm25")})
+    """
+
+    def __init__(self, api_key, partial_file, run_id, methods=None, workers=None, shards=1,
+                 requests_per_minute=MAX_REQUESTS_PER_MINUTE):
+        self.api_key = api_key
+        self.partial_file = partial_file
+        self.run_id = run_id
+        self.methods = methods or DEFAULT_METHODS
+        self.workers = workers or os.cpu_count() or 1
+        self.shards = shards
+        self.requests_per_minute = requests_per_minute
+        with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+            self.n_questions = len(json.load(f))
+
+        # Una línea cortada por una ejecución anterior se repara aquí, una vez, antes de que escriban los workers
+        ResultLog(partial_file).close()
+
+        torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # spawn y no fork: el padre ya abrió el motor en db_setup y un hijo con fork heredaría su cliente
+        # de Chroma (y su conexión SQLite, que no se puede usar entre procesos). Cada worker abre el suyo.
+        context = mp.get_context("spawn")
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context, initializer=_init_worker,
+            initargs=(context.Value("d", 0.0), requests_per_minute, self.methods, torch_threads, partial_file))
+
+    def run(self, repetitions, skip=None):
+        """Ejecuta las repeticiones dadas en el pool y devuelve sus filas del log compartido."""
+        tasks = [(shard, rep) for rep in repetitions for shard in _shards(self.n_questions, self.shards)]
+        print(f"\n🧵 Ejecución paralela: {len(tasks)} tareas en {self.workers} procesos "
+              f"(límite global {self.requests_per_minute} llamadas/min)")
+        start_ts = time.time()
+
+        futures = [
+            self.pool.submit(_run_task, shard, self.methods, self.api_key, self.partial_file, self.run_id, rep, skip)
+            for shard, rep in tasks
+        ]
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                repetition, n_rows = future.result()
+                print(f"   ✅ Tarea {done}/{len(tasks)} (repetición {repetition}): {n_rows} filas")
+            except Exception as e:
+                print(f"   ❌ Tarea {done}/{len(tasks)} fallida: {e} (se retomará al relanzar)")
+
+        print(f"⏱️  Tiempo total: {time.time() - start_ts:.1f}s")
+
+        # Todas las filas están en el log compartido
+        with ResultLog(self.partial_file) as result_log:
+            rows = [row for row in result_log.rows(self.run_id)
+                    if row["repetition"] in repetitions and row["method"] in self.methods]
+        return pd.DataFrame(rows)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_parallel_repetitions(n, api_key, partial_file, run_id, methods=None, workers=None,
+                             shards=1, requests_per_minute=MAX_REQUESTS_PER_MINUTE, repetitions=None, skip=None):
+    """
+    Ejecuta n repeticiones de la evaluación repartidas en un pool de procesos.
+
+    Cada proceso calienta su RetrievalEngine una sola vez, todas las filas van al
+    mismo log de resultados (retomable) y un limitador compartido respeta la cuota
+    de la API entre todos los procesos.
+
+    Args:
+        n (int): Número de repeticiones.
+        api_key (str): API Key para el LLM.
+        partial_file (str): Log de resultados compartido.
+        run_id (str): Nombre de la ejecución.
+        methods (list): Métodos a evaluar.
+        workers (int): Procesos del pool (por defecto, núcleos disponibles).
+        shards (int): Trozos de preguntas por repetición (más tareas que procesos = mejor reparto).
+        requests_per_minute (int): Límite global de llamadas al LLM.
+        repetitions (list[int]): Repeticiones a ejecutar (por defecto, 0..n-1).
+        skip (set): Pares (question_id, método) que no se ejecutan (ver early_stopping).
+
+    Returns:
+        pd.DataFrame: Resultados de todas las repeticiones.
+    """
+    if repetitions is None:
+        repetitions = range(n)
+    with ParallelRunner(api_key, partial_file, run_id, methods=methods, workers=workers, shards=shards,
+                        requests_per_minute=requests_per_minute) as runner:
+        return runner.run(repetitions, skip=skip)
@@ -0,0 +1,215 @@
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+# --- CONFIGURACIÓN ---
+PROFILE_DIR = "profile"          # subcarpeta de la carpeta de resultados
+PROFILE_TOP_N = 25               # funciones por etapa en el resumen
+SAMPLE_INTERVAL_MS = 5.0         # periodo del muestreo de pila
+PROFILE_MODES = ("sample", "cprofile")
+
+# Etapas instrumentadas: warm_up, retrieval, rerank, context, rate_limit, llm, judge, result_write, dashboard
+_active = None
+
+
+def get_profiler():
+    """Perfilador activo del proceso (None si no se está perfilando)."""
+    return _active
+
+
+@contextmanager
+def profile_stage(name):
+    """Marca un bloque como etapa del perfil. Sin perfilador activo no hace nada."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StageProfiler:
+    """
+    Perfil por etapas del hilo que lo arranca:
+    - "sample": muestreo de la pila cada SAMPLE_INTERVAL_MS (tiempo de reloj, incluye esperas de red).
+      Escribe <etapa>.folded (formato de flamegraph.pl / speedscope).
+    - "cprofile": perfil determinista (cProfile) por etapa. Escribe <etapa>.pstats (snakeviz, flameprof).
+    En ambos modos se mide el tiempo de reloj de cada etapa (total y propio, sin subetapas)
+    y se escribe summary.txt con las funciones más costosas de cada una.
+    """
+
+    def __init__(self, output_dir, mode="sample", interval_ms=SAMPLE_INTERVAL_MS, top_n=PROFILE_TOP_N):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Modo de perfil desconocido: {mode} (usa {', '.join(PROFILE_MODES)})")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self.top_n = top_n
+        self.thread_id = None
+        # Pila de etapas abiertas: [nombre, inicio, tiempo de subetapas]
+        self.stack = []
+        self.wall = defaultdict(float)
+        self.self_wall = defaultdict(float)
+        self.calls = Counter()
+        self.profiles = {}
+        self.folded = defaultdict(Counter)
+        self.samples = 0
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+
+    def start(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("Ya hay un perfilador activo en este proceso")
+        self.thread_id = threading.get_ident()
+        self._started = time.perf_counter()
+        _active = self
+        if self.mode == "sample":
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+        print(f"🔬 Perfilando ({self.mode}) -> {self.output_dir}")
+        return self
+
+    def stop(self):
+        """Para el perfil y escribe los ficheros. Devuelve el resumen por etapa."""
+        global _active
+        if _active is self:
+            _active = None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        return self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name):
+        # Solo se perfila el hilo que arrancó el perfilador
+        if threading.get_ident() != self.thread_id:
+            yield
+            return
+
+        parent = self.stack[-1][0] if self.stack else None
+        if self.mode == "cprofile":
+            # cProfile admite un solo perfil activo: se pausa el de la etapa padre
+            if parent is not None:
+                self.profiles[parent].disable()
+            self.profiles.setdefault(name, cProfile.Profile()).enable()
+
+        entry = [name, time.perf_counter(), 0.0]
+        self.stack.append(entry)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - entry[1]
+            self.stack.pop()
+            if self.mode == "cprofile":
+                self.profiles[name].disable()
+                if parent is not None:
+                    self.profiles[parent].enable()
+            self.wall[name] += elapsed
+            self.self_wall[name] += elapsed - entry[2]
+            self.calls[name] += 1
+            if self.stack:
+                self.stack[-1][2] += elapsed
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            try:
+                stage = self.stack[-1][0]
+            except IndexError:
+                continue
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.folded[stage][";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    # --- SALIDA ---
+    def _sample_top(self, stage):
+        """Funciones con más muestras de la etapa: propias (en la cima de la pila) e inclusivas."""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.folded[stage].items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        ms = self.interval * 1000
+        lines = [f"   {'propio ms':>10} {'total ms':>10}  función"]
+        for frame, count in own.most_common(self.top_n):
+            lines.append(f"   {count * ms:10.0f} {inclusive[frame] * ms:10.0f}  {frame}")
+        return lines
+
+    def _cprofile_top(self, stage):
+        stream = io.StringIO()
+        try:
+            pstats.Stats(self.profiles[stage], stream=stream).sort_stats("cumulative").print_stats(self.top_n)
+        except TypeError:
+            # Etapa sin ninguna llamada registrada
+            return []
+        # Sin la cabecera de pstats (ruta y número de llamadas totales)
+        text = stream.getvalue()
+        return ["   " + line for line in text[text.find("ncalls"):].rstrip().splitlines()]
+
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        total = time.perf_counter() - self._started if self._started else 0.0
+        summary = {stage: {"calls": self.calls[stage], "total_s": round(self.wall[stage], 3),
+                           "self_s": round(self.self_wall[stage], 3),
+                           "mean_ms": round(1000 * self.wall[stage] / self.calls[stage], 2)}
+                   for stage in sorted(self.wall, key=self.self_wall.get, reverse=True)}
+
+        if self.mode == "sample":
+            with open(os.path.join(self.output_dir, "all.folded"), "w", encoding="utf-8") as all_file:
+                for stage, stacks in self.folded.items():
+                    with open(os.path.join(self.output_dir, f"{stage}.folded"), "w", encoding="utf-8") as f:
+                        for stack, count in stacks.items():
+                            f.write(f"{stack} {count}\n")
+                            all_file.write(f"{stage};{stack} {count}\n")
+        else:
+            for stage, profile in self.profiles.items():
+                profile.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+
+        lines = [f"Perfil ({self.mode}) de {total:.1f}s de ejecución",
+                 "", f"{'etapa':<14} {'llamadas':>9} {'total s':>9} {'propio s':>9} {'media ms':>10} {'% propio':>9}"]
+        for stage, s in summary.items():
+            share = 100 * s["self_s"] / total if total else 0.0
+            lines.append(f"{stage:<14} {s['calls']:>9} {s['total_s']:>9.2f} {s['self_s']:>9.2f} "
+                         f"{s['mean_ms']:>10.1f} {share:>8.1f}%")
+        for stage in summary:
+            lines += ["", f"--- {stage} ---"]
+            lines += self._sample_top(stage) if self.mode == "sample" else self._cprofile_top(stage)
+
+        with open(os.path.join(self.output_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        with open(os.path.join(self.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"mode": self.mode, "total_s": round(total, 3), "samples": self.samples, "stages": summary}, f, indent=2)
+
+        print(f"\n🔬 Perfil por etapa ({self.mode}):")
+        for line in lines[2:3 + len(summary)]:
+            print("   " + line)
+        print(f"   -> Resumen y ficheros en {self.output_dir}")
+        return summary
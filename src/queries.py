@@ -1,25 +1,76 @@
 import os
 import json
 import time
+import numpy as np
 import pandas as pd
 import re
-from src.rag_pipeline import query_rag, verify_ground_truth_v1, verify_ground_truth_v3
-from src.retrieval import RetrievalEngine
+from src.rag_pipeline import query_rag, verify_ground_truth_v1, verify_ground_truth_v3_batch, adaptive_rerank, JUDGE_BATCH_SIZE, RERANK_CANDIDATES
+from src.retrieval import RetrievalEngine, get_chunk_id
+from src.context import COMPRESSION_RATIO
+from src.evidence_index import load_evidence_index, verify_ground_truth_index, build_evidence_index_from_db, supporting_chunks, is_index_current
+from src.evaluation import compute_retrieval_metrics, plot_retrieval_metrics, cascade_report
+from src.results_store import ResultLog
+from src.profiling import StageProfiler, profile_stage, get_profiler, PROFILE_DIR
 
 
     # --- CONFIGURACIÓN DE TIEMPOS (CONSTANTES) ---
 SLEEP_TIME = 0.2  # Segundos de espera entre consultas para evitar 429
 
-def run_questions(questions_slice=None, methods=None, api_key=None, partial_file="./results/resultados_parciales.csv", sleep_time=SLEEP_TIME):
+# Juez de evidencia: "v1" (texto), "v3" (texto + LLM) o "index" (ids de chunks precalculados en la ingesta)
+# Con "index", las preguntas que no estén indexadas se evalúan con v1. Ojo: "index" mide la cobertura
+# chunk a chunk y v1 sobre todo el contexto, así que sus resultados no son comparables entre sí
+# (el juez usado queda en config.json).
+EVIDENCE_JUDGE = "v1"
+
+def classify_result(is_correct, found_evidence):
+    """Etiqueta de diagnóstico a partir del acierto y de la evidencia."""
+    if is_correct and found_evidence:
+        return "✅ ACIERTO PERFECTO (RAG)"
+    elif is_correct and not found_evidence:
+        return "⚠️ ACIERTO SUERTE (Sin Evidencia)"
+    elif not is_correct and found_evidence:
+        return "📉 FALLO RAZONAMIENTO (Contexto OK)"
+    return "❌ FALLO TOTAL"
+
+def resolve_pending_judgements(pending, api_key, result_log):
+    """
+    Resuelve con el juez v3 (por lotes y con caché) las filas que esperaban veredicto.
+    """
+    if not pending:
+        return
+    with profile_stage("judge"):
+        verdicts = verify_ground_truth_v3_batch([(docs, ref) for _, docs, ref in pending], api_key)
+    for (row, _, _), (found_evidence, evidence_score) in zip(pending, verdicts):
+        row["found_evidence"] = found_evidence
+        row["retrieval_score"] = evidence_score
+        row["status"] = classify_result(row["correct"], found_evidence)
+        print(f"   [Juez] Q{row['question_id']} {row['method'].upper()}: {row['status']}")
+        with profile_stage("result_write"):
+            result_log.append(row)
+    pending.clear()
+
+def run_questions(questions_slice=None, methods=None, api_key=None, partial_file="./results/resultados_parciales.jsonl", sleep_time=SLEEP_TIME,
+                  compression_ratio=COMPRESSION_RATIO, run_id=None, repetition=0, result_log=None, profile=None,
+                  skip=None, evidence_judge=None):
     """
     Ejecuta preguntas del dataset y devuelve resultados.
+    Las filas ya registradas en el log para (run_id, repetition) no se vuelven a ejecutar.
 
     Args:
         questions_slice (list[int]): Lista de preguntas a evaluar. Si None, se carga todo el dataset.
         methods (list): Lista de métodos a usar. Default ["baseline", "bm25", "dense", "hybrid", "cross_encoder"]
         api_key (str): API Key para el LLM
-        partial_file (str): Ruta donde guardar resultados parciales
+        partial_file (str): Ruta del log de resultados parciales (si no se pasa result_log)
         sleep_time (int): Segundos de pausa entre consultas
+        compression_ratio (float): Fracción del contexto que se conserva tras la compresión (None = sin compresión)
+        run_id (str): Nombre de la ejecución (carpeta de resultados). Si None, uno nuevo con la fecha y hora:
+            una llamada suelta no retoma (ni devuelve) filas de otra anterior en el mismo log.
+        repetition (int): Número de repetición dentro de la ejecución
+        result_log (ResultLog): Log compartido entre repeticiones. Si None, se abre uno en partial_file.
+        profile (str): "sample" o "cprofile" para perfilar por etapas (profile/ junto al log de resultados).
+            Si ya hay un perfilador activo (main.py --profile), las etapas se suman a ese.
+        skip (set): Pares (question_id, método) que no se ejecutan en esta repetición (ya convergidos).
+        evidence_judge (str): "index", "v1" o "v3". Si None, EVIDENCE_JUDGE.
 
     Returns:
         pd.DataFrame: DataFrame con resultados de todas las preguntas y métodos
@@ -39,61 +90,98 @@ def run_questions(questions_slice=None, methods=None, api_key=None, partial_file
     
     if questions_slice is None:
         # Por defecto, solo un subconjunto para pruebas
-        questions_to_run = questions
+        questions_to_run = list(enumerate(questions))
     else:
         for idx in questions_slice:
             # Protección: Verificamos que el índice existe
             if 0 <= idx < len(questions):
-                questions_to_run.append(questions[idx])
+                questions_to_run.append((idx, questions[idx]))
             else:
                 print(f"⚠️ AVISO: El índice {idx} no existe (Dataset tiene {len(questions)} preguntas). Se omite.")
 
-    results = []
-
-    print("\n⚙️  Inicializando y calentando motores...")
-    try:
-        engine = RetrievalEngine.get_instance()
-        
-        # 1. Inicializando de BUSCADORES (Dense, BM25, Hybrid)
-        # El Cross-Encoder también usa Hybrid por debajo, así que necesita esto también.
-        needs_bm25 = any(m in methods for m in ["bm25", "hybrid", "cross_encoder"])
-        needs_dense = "dense" in methods
-        
-        if needs_bm25:
-            print("   -> Construyendo índices Híbridos (BM25 + Vectores)...")
-            # Al pedir 'hybrid', forzamos la carga de Chroma Y la construcción del índice BM25
-            engine.get_retriever("hybrid", k=1)
-            
-        elif needs_dense:
-            print("   -> Conectando a Base de Datos Vectorial...")
-            # Si solo usamos dense, no perdemos tiempo construyendo BM25
-            engine.get_retriever("dense", k=1)
-
-        # 2. Calentamiento de MODELO DE IA (Cross-Encoder)
-        if "cross_encoder" in methods:
-            print("   -> Cargando modelo Cross-Encoder en RAM...")
-            # Accedemos a la propiedad para disparar la carga
-            _ = engine.reranker 
-            
-        print("\n✅ Todo listo")
-
-    except Exception as e:
-        print(f"⚠️ Error no crítico en calentamiento: {e}")
-        print("   (El programa continuará, pero la primera pregunta podría ir lenta)")
+    pending_judgements = []
+
+    # Log de resultados: permite retomar una ejecución cortada
+    if run_id is None:
+        run_id = time.strftime("local-%Y%m%d-%H%M%S")
+    own_log = result_log is None
+    if own_log:
+        result_log = ResultLog(partial_file)
+
+    # Perfil por etapas (warm-up, recuperación, reranking, LLM, juez, escritura)
+    profiler = None
+    if profile and get_profiler() is None:
+        profiler = StageProfiler(os.path.join(os.path.dirname(result_log.path) or ".", PROFILE_DIR), profile).start()
+
+    question_ids = {q_idx + 1 for q_idx, _ in questions_to_run}
+    skip = skip or set()
+    pairs = [(q_id, method) for q_id in question_ids for method in methods if (q_id, method) not in skip]
+    total_queries = len(pairs)
+    already_done = sum(result_log.is_done(run_id, repetition, q_id, method) for q_id, method in pairs)
+    if skip:
+        print(f"\n⏭️  {len(question_ids) * len(methods) - total_queries} pares pregunta-método ya convergidos no se repiten.")
+    if already_done:
+        print(f"\n⏩ Retomando: {already_done} de {total_queries} consultas ya estaban en el log.")
+
+    # Índice pregunta -> chunks de soporte generado en la ingesta
+    evidence_judge = evidence_judge or EVIDENCE_JUDGE
+    evidence_index = load_evidence_index() if evidence_judge == "index" else None
+
+    # Si todo estaba hecho no hace falta cargar modelos
+    if already_done < total_queries:
+        print("\n⚙️  Inicializando y calentando motores...")
+        try:
+            with profile_stage("warm_up"):
+                engine = RetrievalEngine.get_instance()
+
+                # 1. Inicializando de BUSCADORES (Dense, BM25, Hybrid)
+                # El Cross-Encoder también usa Hybrid por debajo, así que necesita esto también.
+                needs_bm25 = any(m in methods for m in ["bm25", "hybrid", "cross_encoder"])
+                needs_dense = "dense" in methods
+
+                if needs_bm25:
+                    print("   -> Construyendo índices Híbridos (BM25 + Vectores)...")
+                    # Al pedir 'hybrid', forzamos la carga de Chroma Y la construcción del índice BM25
+                    engine.warm_up(["hybrid"])
+
+                elif needs_dense:
+                    print("   -> Conectando a Base de Datos Vectorial...")
+                    # Si solo usamos dense, no perdemos tiempo construyendo BM25
+                    engine.warm_up(["dense"])
+
+                # 2. Calentamiento de MODELO DE IA (Cross-Encoder)
+                if "cross_encoder" in methods:
+                    print("   -> Cargando modelo Cross-Encoder en RAM...")
+                    # Accedemos a la propiedad para disparar la carga
+                    _ = engine.reranker 
+
+                # El índice de evidencias debe ser del chunking actual (si no, los ids no coinciden)
+                if evidence_index is not None and not is_index_current(evidence_index, engine.get_all_chunks()):
+                    print("   ⚠️ Índice de evidencias de otro chunking: regenerándolo desde la BD...")
+                    evidence_index = build_evidence_index_from_db(engine)
+
+                print("\n✅ Todo listo")
+
+        except Exception as e:
+            print(f"⚠️ Error no crítico en calentamiento: {e}")
+            print("   (El programa continuará, pero la primera pregunta podría ir lenta)")
 
     # Bucle principal
     print(f"\n🚀 Evaluando {len(questions_to_run)} preguntas con modelos: {methods}")
 
-    for i, q in enumerate(questions_to_run):
-        print(f"\n--- Q{i+1}: {q['question'][:50]}... ---")
+    for q_idx, q in questions_to_run:
+        print(f"\n--- Q{q_idx+1}: {q['question'][:50]}... ---")
         for method in methods:
+            if (q_idx + 1, method) in skip or result_log.is_done(run_id, repetition, q_idx + 1, method):
+                continue
             try:
                 print(f"   [{method.upper()}] Procesando...", end=" ")
 
                 start_ts = time.time()
 
                 # LLAMADA RESPUESTA
-                raw_answer, retrieved_docs = query_rag(q['question'], q['answers'], method, api_key)
+                raw_answer, retrieved_docs, context_stats = query_rag(q['question'], q['answers'], method, api_key,
+                                                                      compression_ratio=compression_ratio)
 
                 # Latencia de usuario y pausa anit-429 para Gemma/Gemini Free
                 latency = time.time() - start_ts
@@ -109,29 +197,29 @@ def run_questions(questions_slice=None, methods=None, api_key=None, partial_file
 
                 # 3. --- NUEVO: JUEZ DE GROUND TRUTH + LLM Judge ---
                 paper_ref = q.get('paper_reference', "")
-                found_evidence, evidence_score = False, 0.0
+                found_evidence, evidence_score, evidence_recall = False, 0.0, None
+                needs_judge = False
 
-                if paper_ref:
-                    found_evidence, evidence_score = verify_ground_truth_v1(retrieved_docs, paper_ref)
-                #if paper_ref:
-                    #found_evidence, evidence_score = verify_ground_truth_v3(retrieved_docs, paper_ref, api_key)
+                with profile_stage("judge"):
+                    # El índice va por chunk id y no sabe qué frases quitó la compresión: esos chunks se juzgan por texto
+                    compressed = any(doc.metadata.get("compressed") for doc in retrieved_docs)
+                    indexed = None if compressed else verify_ground_truth_index(evidence_index, q_idx, retrieved_docs)
+                    if indexed is not None:
+                        found_evidence, evidence_score, evidence_recall = indexed
+                    elif paper_ref and evidence_judge == "v3":
+                        # Se resuelve más tarde junto a otras filas (una llamada al juez por lote)
+                        needs_judge = True
+                    elif paper_ref:
+                        found_evidence, evidence_score = verify_ground_truth_v1(retrieved_docs, paper_ref)
 
                 # 4. Clasificación del Resultado
-                status_tag = ""
-                if is_correct and found_evidence:
-                    status_tag = "✅ ACIERTO PERFECTO (RAG)"
-                elif is_correct and not found_evidence:
-                    status_tag = "⚠️ ACIERTO SUERTE (Sin Evidencia)"
-                elif not is_correct and found_evidence:
-                    status_tag = "📉 FALLO RAZONAMIENTO (Contexto OK)"
-                else:
-                    status_tag = "❌ FALLO TOTAL"
-
-                print(f"{status_tag} (Pred: {predicted_letter} | T: {latency:.2f}s)")
+                status_tag = classify_result(is_correct, found_evidence)
 
                 # Guardar resultado
                 row = {
-                    "question_id": i+1,
+                    "run_id": run_id,
+                    "repetition": repetition,
+                    "question_id": q_idx+1,
                     "method": method,
                     "correct": is_correct,
                     "predicted": predicted_letter,
@@ -140,23 +228,208 @@ def run_questions(questions_slice=None, methods=None, api_key=None, partial_file
                     "raw_output": raw_answer,
                     "status": status_tag,
                     "retrieval_score": evidence_score,
-                    "retrieved_docs": retrieved_docs
+                    "found_evidence": found_evidence,
+                    "evidence_recall": evidence_recall,
+                    "compression_ratio": context_stats["compression_ratio"],
+                    "n_chunks": context_stats["n_chunks"],
+                    "context_tokens": context_stats["context_tokens"],
+                    "prompt_tokens": context_stats["prompt_tokens"],
+                    # Tiempo del LLM y hasta su primer token (solo en modo de respuesta "stream")
+                    "llm_time": context_stats.get("llm_time"),
+                    "first_token_time": context_stats.get("first_token_time"),
+                    # Solo ids y scores: el texto de los chunks se guarda una vez en chunks.parquet
+                    "chunk_ids": [get_chunk_id(doc) for doc in retrieved_docs],
+                    "chunk_scores": context_stats["chunk_scores"],
+                    # Cascada del Cross-Encoder: decisión, pares puntuados y origen de chunk_scores
+                    "cascade": context_stats["cascade"],
+                    "rerank_pairs": context_stats["rerank_pairs"],
+                    "chunk_scorer": context_stats.get("chunk_scorer")
                 }
-                results.append(row)
 
-                # Guardado parcial
-                df_temp = pd.DataFrame([row])
-                os.makedirs(os.path.dirname(partial_file), exist_ok=True)
-                file_exists = os.path.isfile(partial_file)
-                df_temp.to_csv(partial_file, mode='a', header=not file_exists, index=False)
+                if needs_judge:
+                    print(f"⏳ Juez pendiente (Pred: {predicted_letter} | T: {latency:.2f}s)")
+                    pending_judgements.append((row, retrieved_docs, paper_ref))
+                    if len(pending_judgements) >= JUDGE_BATCH_SIZE:
+                        resolve_pending_judgements(pending_judgements, api_key, result_log)
+                else:
+                    print(f"{status_tag} (Pred: {predicted_letter} | T: {latency:.2f}s)")
+                    with profile_stage("result_write"):
+                        result_log.append(row)
 
             except Exception as e:
                 print(f"❌ Error crítico en {method}: {e}")
 
+    # Veredictos que quedaron sin completar lote
+    resolve_pending_judgements(pending_judgements, api_key, result_log)
+    with profile_stage("result_write"):
+        result_log.flush(fsync=True)
+
+    # Resultados de esta repetición: los nuevos y los recuperados del log
+    results = [
+        row for row in result_log.rows(run_id, repetition)
+        if row["question_id"] in question_ids and row["method"] in methods
+    ]
+    if own_log:
+        result_log.close()
+    if profiler is not None:
+        profiler.stop()
+
     return pd.DataFrame(results)
 
 
+def run_compression_sweep(ratios=(1.0, 0.75, 0.5, 0.25), questions_slice=None, methods=None, api_key=None,
+                          partial_file="./results/resultados_parciales.jsonl", run_id=None):
+    """
+    Repite la evaluación para cada ratio de compresión del contexto.
+    El baseline no tiene contexto, así que no se incluye por defecto.
+    La evidencia se juzga siempre sobre el texto enviado (v1, o v3 si es el juez configurado):
+    el índice por chunk id daría lo mismo en todos los ratios.
+
+    Returns:
+        pd.DataFrame: Resultados de todos los ratios (columna 'compression_ratio')
+    """
+    if methods is None:
+        methods = ["bm25", "dense", "hybrid", "cross_encoder"]
+
+    judge = "v3" if EVIDENCE_JUDGE == "v3" else "v1"
+    # Sin run_id, un barrido nuevo (con uno explícito se retoma el barrido cortado)
+    run_id = run_id or time.strftime("compression-%Y%m%d-%H%M%S")
+    all_results = []
+    for ratio in ratios:
+        print(f"\n🗜️  Ratio de compresión: {ratio}")
+        # Cada ratio es una ejecución distinta en el log (si no, se saltaría como ya hecha)
+        df = run_questions(questions_slice, methods, api_key, partial_file, compression_ratio=ratio,
+                           run_id=f"{run_id}-{ratio}", evidence_judge=judge)
+        all_results.append(df)
+
+    return pd.concat(all_results, ignore_index=True)
+
+
+def retrieve_all(questions, method, k, engine=None):
+    """
+    Recuperación en lote de todas las preguntas, sin LLM.
+    Para el Cross-Encoder: candidatos híbridos y un único predict con todos los pares.
+    "cross_encoder_adaptive" aplica la cascada adaptativa pregunta a pregunta.
+
+    Returns:
+        tuple: (list[tuple]: (posiciones en engine.chunk_store, scores) por pregunta, top-k,
+                list[dict]: decisión de la cascada y pares del Cross-Encoder por pregunta)
+    """
+    engine = engine or RetrievalEngine.get_instance()
+    texts = [q["question"] for q in questions]
+
+    if method == "cross_encoder_adaptive":
+        embeddings = engine.embeddings.embed_documents(texts)
+        outputs = [adaptive_rerank(engine, text, k, emb) for text, emb in zip(texts, embeddings)]
+        return [scored for scored, _ in outputs], [cascade for _, cascade in outputs]
+
+    if method == "cross_encoder":
+        candidates = [positions for positions, _ in engine.search_batch(texts, "hybrid", k=max(RERANK_CANDIDATES, k))]
+        cascade = [{"cascade": "full", "rerank_pairs": len(c)} for c in candidates]
+        return engine.rerank_positions_batch(texts, candidates, top_k=k), cascade
+
+    return engine.search_batch(texts, method, k=k), [{"cascade": None, "rerank_pairs": 0} for _ in texts]
+
+
+def run_retrieval_eval(methods=None, ks=(1, 3, 5, 10, 20), output_dir="./results/retrieval_eval", engine=None,
+                       evidence_index=None):
+    """
+    Modo solo-recuperación: evalúa los retrievers contra la evidencia de 'paper_reference'
+    (índice de evidencias de la ingesta) sin llamar al LLM.
+    Calcula recall@k, hit@k, MRR@k y nDCG@k para todos los k a la vez (el híbrido, una recuperación por k).
+    "seconds" es el tiempo de recuperar todas las preguntas con k = max(ks).
+
+    Args:
+        methods (list): Retrievers a comparar. Default ["bm25", "dense", "hybrid", "cross_encoder", "cross_encoder_adaptive"]
+        ks (tuple[int]): Cortes de k a evaluar.
+        output_dir (str): Carpeta donde guardar la tabla y el gráfico.
+        engine (RetrievalEngine): Motor a usar (por defecto, el singleton).
+        evidence_index (dict): Índice de evidencias (por defecto, el de la ingesta).
+
+    Returns:
+        pd.DataFrame: Métricas por método y k (también en retrieval_metrics.csv)
+    """
+    if methods is None:
+        methods = ["bm25", "dense", "hybrid", "cross_encoder", "cross_encoder_adaptive"]
+    ks = sorted(ks)
+    max_k = ks[-1]
+    engine = engine or RetrievalEngine.get_instance()
+
+    with open("./data/questions.json", "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    index = evidence_index or load_evidence_index()
+    if evidence_index is None and not is_index_current(index, engine.get_all_chunks()):
+        # Índice ausente o de otro chunking: lo rehacemos sobre la BD actual
+        index = build_evidence_index_from_db(engine)
+
+    # Solo cuentan las preguntas con algún chunk de soporte
+    evaluable = [(idx, q) for idx, q in enumerate(questions) if supporting_chunks(index, idx)]
+    supports = [supporting_chunks(index, idx) for idx, _ in evaluable]
+    print(f"\n🔬 Evaluación solo-recuperación: {len(evaluable)} preguntas con evidencia, métodos {methods}, k={ks}")
+
+    # Ganancia ideal: coberturas de los chunks de soporte, de mayor a menor
+    ideal_gains = np.zeros((len(evaluable), max_k))
+    for row, support in enumerate(supports):
+        best = sorted(support.values(), reverse=True)[:max_k]
+        ideal_gains[row, :len(best)] = best
+    n_relevant = np.array([len(support) for support in supports], dtype=float)
+
+    def gains_at(retrieved, k):
+        gains = np.zeros((len(evaluable), max_k))
+        for row, ((positions, _), support) in enumerate(zip(retrieved, supports)):
+            # El híbrido puede devolver hasta 2k chunks fusionados: solo cuentan los k primeros
+            for rank, chunk_id in enumerate(engine.chunk_store.chunk_ids[positions[:k]]):
+                gains[row, rank] = support.get(chunk_id, 0.0)
+        return gains
+
+    all_metrics = []
+    for method in methods:
+        questions_only = [q for _, q in evaluable]
+        if method == "hybrid":
+            # La fusión depende de k (se fusionan los top-k de cada rama): hybrid@k se recupera con k,
+            # como en el pipeline, y no como prefijo de la fusión a max_k
+            per_k = []
+            for k in ks:
+                start_ts = time.time()
+                retrieved, cascade = retrieve_all(questions_only, method, k, engine)
+                elapsed = time.time() - start_ts
+                per_k.append(compute_retrieval_metrics(gains_at(retrieved, k), ideal_gains, n_relevant, [k]))
+            metrics = pd.concat(per_k, ignore_index=True)
+        else:
+            # Denso, BM25 y Cross-Encoder: el top-k es prefijo del top-max_k
+            start_ts = time.time()
+            retrieved, cascade = retrieve_all(questions_only, method, max_k, engine)
+            elapsed = time.time() - start_ts
+            metrics = compute_retrieval_metrics(gains_at(retrieved, max_k), ideal_gains, n_relevant, ks)
+
+        metrics.insert(0, "method", method)
+        metrics["seconds"] = round(elapsed, 3)
+        metrics["rerank_pairs"] = np.mean([c["rerank_pairs"] for c in cascade])
+        all_metrics.append(metrics)
+        print(f"   [{method.upper()}] {elapsed:.2f}s | recall@{max_k}={metrics['recall'].iloc[-1]:.3f}")
+        if method == "cross_encoder_adaptive":
+            decisions = pd.Series([c["cascade"] for c in cascade]).value_counts()
+            print("      Cascada: " + ", ".join(f"{name}={count}" for name, count in decisions.items()))
+
+    df_metrics = pd.concat(all_metrics, ignore_index=True)
+    if {"cross_encoder", "cross_encoder_adaptive"} <= set(methods):
+        cascade_report(df_metrics)
+
+    os.makedirs(output_dir, exist_ok=True)
+    df_metrics.to_csv(os.path.join(output_dir, "retrieval_metrics.csv"), index=False)
+    plot_retrieval_metrics(df_metrics, output_dir)
+    print(df_metrics.round(3).to_string(index=False))
+    return df_metrics
+
+
 if __name__ == "__main__":
+    import sys
+    # Solo recuperación (sin LLM ni red): python -m src.queries --retrieval-only
+    if "--retrieval-only" in sys.argv:
+        run_retrieval_eval()
+        sys.exit(0)
+
     # Ejemplo de uso directo
     from dotenv import load_dotenv
     load_dotenv()
@@ -1,22 +1,196 @@
 from langchain_core.prompts import PromptTemplate
+from langchain_core.messages import AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
-from src.retrieval import RetrievalEngine 
-from difflib import SequenceMatcher
+from src.retrieval import RetrievalEngine, get_chunk_id, HYBRID_WEIGHTS, RRF_C
+from src.matching import super_clean, clean_docs, longest_match
+from src.judge_cache import get_judge_cache, judge_key
+from src.context import build_context, compress_documents, count_tokens, context_token_budget, COMPRESSION_RATIO, COMPRESSION_SCORER
+from src.profiling import profile_stage
+import os
 import time
+import re
+import numpy as np
 
 # Modelo usado
 MODEL_NAME = "models/gemini-2.5-flash-lite"
 
+# Recuperación: chunks que llegan al LLM y candidatos que ve el Cross-Encoder
+TOP_K = 5
+RERANK_CANDIDATES = 20
+
+# Cascada del Cross-Encoder: "full" (siempre RERANK_CANDIDATES) o "adaptive" (según el acuerdo entre BM25 y denso)
+CASCADE_MODE = "full"
+# Acuerdo = fracción del top-TOP_K de BM25 que también está en el top-TOP_K denso
+CASCADE_SKIP_AGREEMENT = 0.8    # >= : sin reranking (si además el primer chunk es claro)
+CASCADE_SKIP_TOP_SCORE = 0.9    # score RRF del primero, normalizado (1 = primero en ambas ramas)
+CASCADE_PARTIAL_AGREEMENT = 0.4 # >= : solo se reordenan los CASCADE_TOP_N primeros fusionados
+CASCADE_TOP_N = 10
+CASCADE_WIDE_CANDIDATES = 40    # por debajo: las ramas discrepan y se amplía la bolsa de candidatos
+
+# Backend del LLM: "gemini" (API de Google) o "local" (sustituto determinista sin red, ver local_llm.py)
+LLM_BACKEND_ENV = "RAG_LLM_BACKEND"
+
+# Modo de respuesta (RAG_ANSWER_MODE) para la letra A-D y el YES/NO del juez:
+# - "full": se espera la respuesta completa y se busca la letra con una regex.
+# - "stream": streaming con salida limitada a ANSWER_MAX_OUTPUT_TOKENS; se deja de leer
+#   en cuanto llega una respuesta válida y se mide el tiempo hasta el primer token.
+ANSWER_MODE_ENV = "RAG_ANSWER_MODE"
+ANSWER_MODES = ("full", "stream")
+ANSWER_MAX_OUTPUT_TOKENS = 8
+# Una respuesta es válida cuando ya llegó el carácter que la cierra (evita cortar "A" de "Answer")
+ANSWER_STOP = re.compile(r"(?i)\b([A-D])\b(?=\W)")
+VERDICT_STOP = re.compile(r"(?i)\b(YES|NO)\b(?=\W)")
+
+def get_llm(api_key=None, temperature=0, max_output_tokens=None):
+    """Fábrica del LLM según RAG_LLM_BACKEND (se lee en cada llamada)."""
+    if os.getenv(LLM_BACKEND_ENV, "gemini") == "local":
+        from src.local_llm import LocalLLM
+        return LocalLLM(max_output_tokens=max_output_tokens)
+    return ChatGoogleGenerativeAI(
+        model=MODEL_NAME,
+        google_api_key=api_key,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens
+    )
+
+def llm_id():
+    """Backend y modelo activos: forman parte de la clave de las cachés de respuestas y veredictos."""
+    backend = os.getenv(LLM_BACKEND_ENV, "gemini")
+    return backend if backend == "local" else f"{backend}:{MODEL_NAME}"
+
+def answer_mode():
+    """Modo de respuesta activo ("full" o "stream"), leído de RAG_ANSWER_MODE en cada llamada."""
+    mode = os.getenv(ANSWER_MODE_ENV, "full")
+    if mode not in ANSWER_MODES:
+        raise ValueError(f"Modo de respuesta desconocido: {mode} (usa {', '.join(ANSWER_MODES)})")
+    return mode
+
+def get_answer_llm(api_key=None, temperature=0, mode=None):
+    """LLM para respuestas de una palabra (letra o YES/NO): en modo "stream", con la salida limitada."""
+    mode = mode or answer_mode()
+    return get_llm(api_key, temperature, ANSWER_MAX_OUTPUT_TOKENS if mode == "stream" else None)
+
+def generate(llm, text, stop=None, mode=None):
+    """
+    Llamada al LLM según el modo de respuesta.
+    En modo "stream" se lee la respuesta por trozos y se corta en cuanto el texto recibido
+    contiene 'stop' (el resto de la generación se descarta).
 
-    # --- LIMPIADOR ---
-def super_clean(text):
-    # 1. Pasar a minúsculas
-    text = text.lower()
-    # 2. Eliminar saltos de línea y tabulaciones explícitamente
-    text = text.replace("\n", "").replace("\r", "").replace("\t", "")
-    # 3. Eliminar CUALQUIER carácter que no sea letra o número
-    return "".join([c for c in text if c.isalnum()])
+    Returns:
+        tuple: (mensaje con .content y .usage_metadata, dict: llm_time y first_token_time en segundos)
+    """
+    mode = mode or answer_mode()
+    start_ts = time.perf_counter()
+    if mode == "full" or stop is None:
+        response = llm.invoke(text)
+        return response, {"llm_time": time.perf_counter() - start_ts, "first_token_time": None}
+
+    response, first_token = None, None
+    chunks = llm.stream(text)
+    try:
+        for chunk in chunks:
+            if first_token is None and chunk.content:
+                first_token = time.perf_counter() - start_ts
+            response = chunk if response is None else response + chunk
+            if stop.search(response.content):
+                break
+    finally:
+        # Cerrar el generador corta la lectura del stream del proveedor
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    if response is None:
+        response = AIMessage(content="")
+    return response, {"llm_time": time.perf_counter() - start_ts, "first_token_time": first_token}
+
+# Limitador de llamadas al LLM (compartido entre procesos en ejecuciones paralelas)
+_rate_limiter = None
+
+def set_rate_limiter(limiter):
+    """Registra el limitador que deben respetar todas las llamadas al LLM de este proceso."""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+def wait_for_llm_slot():
+    """Espera al siguiente hueco libre del limitador (si hay uno configurado)."""
+    if _rate_limiter is not None:
+        _rate_limiter.wait()
+
+
+
+def plan_cascade(bm25_results, dense_results, fused_results, agreement_k=TOP_K,
+                 skip_agreement=CASCADE_SKIP_AGREEMENT, skip_top_score=CASCADE_SKIP_TOP_SCORE,
+                 partial_agreement=CASCADE_PARTIAL_AGREEMENT):
+    """
+    Decide el reranking a partir de la primera etapa híbrida.
+    Cada resultado es (posiciones en el ChunkStore, puntuaciones), como los de engine.search_hybrid_legs.
 
+    Returns:
+        tuple: (str: "skip", "top_n" o "widen", float: acuerdo entre ramas, float: score del primero normalizado)
+    """
+    bm25_top = set(bm25_results[0][:agreement_k].tolist())
+    dense_top = set(dense_results[0][:agreement_k].tolist())
+    agreement = len(bm25_top & dense_top) / agreement_k if agreement_k else 0.0
+
+    # Máximo RRF posible: el chunk es el primero en las dos ramas
+    fused_scores = fused_results[1]
+    top_score = float(fused_scores[0]) / (sum(HYBRID_WEIGHTS) / (1 + RRF_C)) if len(fused_scores) else 0.0
+
+    if agreement >= skip_agreement and top_score >= skip_top_score:
+        return "skip", agreement, top_score
+    if agreement >= partial_agreement:
+        return "top_n", agreement, top_score
+    return "widen", agreement, top_score
+
+def _clean_lookup():
+    """Texto limpio cacheado en el ChunkStore del motor (si ya está cargado) para los jueces de texto."""
+    store = RetrievalEngine.get_instance()._chunk_store
+    return None if store is None else store.clean_text_by_id
+
+
+def adaptive_rerank(engine, question, top_k=TOP_K, query_embedding=None, top_n=CASCADE_TOP_N,
+                    wide_candidates=CASCADE_WIDE_CANDIDATES, **thresholds):
+    """
+    Cascada adaptativa del Cross-Encoder:
+    - "skip": BM25 y denso coinciden y el primero es claro -> orden híbrido, sin reranking.
+    - "top_n": acuerdo parcial -> se reordenan solo los top_n fusionados (el resto conserva su orden).
+    - "widen": las ramas discrepan -> se amplía la bolsa de candidatos y se reordena entera.
+
+    En "top_n" los logits del Cross-Encoder y los scores RRF no son comparables: la cola recibe
+    scores que conservan su orden por debajo del peor de la cabeza (fit_to_budget ordena por score).
+    chunk_scorer indica qué produjo los scores: "hybrid" (RRF), "cross_encoder" o
+    "cross_encoder+rank" (cabeza con logits, cola con scores de rango).
+
+    Returns:
+        tuple: ((posiciones, scores) top_k, dict: decisión, acuerdo, pares evaluados y origen de los scores)
+    """
+    bm25_results, dense_results, fused = engine.search_hybrid_legs(question, RERANK_CANDIDATES, query_embedding)
+    # El acuerdo se mide siempre sobre los TOP_K que llegan al LLM, aunque se pidan más chunks
+    decision, agreement, top_score = plan_cascade(bm25_results, dense_results, fused, **thresholds)
+
+    positions, scores = fused
+    if decision == "skip":
+        scored = (positions[:top_k], scores[:top_k])
+        n_pairs, scorer = 0, "hybrid"
+    elif decision == "top_n":
+        head = positions[:top_n]
+        with profile_stage("rerank"):
+            head_positions, head_scores = engine.rerank_positions(question, head, top_k=len(head))
+        tail = positions[top_n:]
+        floor = float(np.min(head_scores)) if len(head_scores) else 0.0
+        tail_scores = floor - 1.0 - np.arange(len(tail), dtype=np.float32)
+        scored = (np.concatenate([head_positions, tail])[:top_k],
+                  np.concatenate([head_scores, tail_scores])[:top_k])
+        n_pairs = len(head)
+        scorer = "cross_encoder+rank" if len(tail) and len(head) < top_k else "cross_encoder"
+    else:
+        candidates = engine.search(question, "hybrid", wide_candidates, query_embedding)[0]
+        with profile_stage("rerank"):
+            scored = engine.rerank_positions(question, candidates, top_k=top_k)
+        n_pairs, scorer = len(candidates), "cross_encoder"
+
+    return scored, {"cascade": decision, "leg_agreement": round(agreement, 3),
+                    "top_fused_score": round(top_score, 3), "rerank_pairs": n_pairs, "chunk_scorer": scorer}
 
 
 # PLANTILLA DEL PROMPT
@@ -53,12 +227,81 @@ prompt = PromptTemplate(
     input_variables=["context", "question", "option_a", "option_b", "option_c", "option_d"]
 )
 
-def query_rag(question, options, method, api_key):
+def retrieve_for_method(engine, question, method, query_embedding=None):
+    """
+    Paso de recuperación de query_rag (sin LLM). No crea Documents: devuelve posiciones del ChunkStore.
+
+    Returns:
+        tuple: ((np.ndarray posiciones, np.ndarray scores): chunks para el contexto, dict: estadísticas de la cascada)
+    """
+    cascade_stats = {"cascade": None, "leg_agreement": None, "rerank_pairs": 0, "chunk_scorer": method}
+
+    if method == "cross_encoder" and CASCADE_MODE == "adaptive":
+        # Cascada adaptativa: el reranking depende del acuerdo entre BM25 y denso
+        scored, adaptive_stats = adaptive_rerank(engine, question, TOP_K, query_embedding)
+        cascade_stats.update(adaptive_stats)
+
+    elif method == "cross_encoder":
+        # PASO 1: Broad Retrieval (Traemos MUCHOS candidatos)
+        # Pedimos k=20 para asegurar que la respuesta esté ahí dentro
+        candidates, _ = engine.search(question, method="hybrid", k=RERANK_CANDIDATES,
+                                      query_embedding=query_embedding)
+
+        # PASO 2: Fine-Grained Reranking (Filtramos a los mejores)
+        # Nos quedamos con los 5 mejores para Gemini
+        with profile_stage("rerank"):
+            scored = engine.rerank_positions(question, candidates, top_k=TOP_K)
+        cascade_stats.update({"cascade": "full", "rerank_pairs": len(candidates)})
+
+    else:
+        # Buscamos los 5 fragmentos más relevantes usando el método elegido
+        scored = engine.search(question, method=method, k=TOP_K, query_embedding=query_embedding)
+
+    return scored, cascade_stats
+
+def retrieve_batch_for_method(engine, questions, method):
+    """
+    retrieve_for_method para varias preguntas a la vez (embeddings, BM25 y Cross-Encoder por lotes).
+
+    Returns:
+        list[tuple]: ((posiciones, scores), cascade_stats) por pregunta
+    """
+    if method == "cross_encoder" and CASCADE_MODE == "adaptive":
+        # La cascada decide pregunta a pregunta; solo se comparte el lote de embeddings
+        embeddings = engine.embeddings.embed_documents(list(questions))
+        return [retrieve_for_method(engine, q, method, emb) for q, emb in zip(questions, embeddings)]
+
+    if method == "cross_encoder":
+        candidates = [positions for positions, _ in engine.search_batch(questions, "hybrid", k=RERANK_CANDIDATES)]
+        reranked = engine.rerank_positions_batch(questions, candidates, top_k=TOP_K)
+        return [(scored, {"cascade": "full", "leg_agreement": None, "rerank_pairs": len(c),
+                          "chunk_scorer": method})
+                for scored, c in zip(reranked, candidates)]
+
+    return [(scored, {"cascade": None, "leg_agreement": None, "rerank_pairs": 0, "chunk_scorer": method})
+            for scored in engine.search_batch(questions, method, k=TOP_K)]
+
+def query_rag(question, options, method, api_key, token_budget=None,
+              compression_ratio=COMPRESSION_RATIO, compression_scorer=COMPRESSION_SCORER, retrieved=None):
     """
     Ejecuta el ciclo RAG completo para una pregunta.
+    token_budget=None usa el presupuesto activo (context_token_budget(), sin límite por defecto).
+    Si compression_ratio < 1, las frases del contexto se filtran por relevancia antes del prompt.
+    Con retrieved=((posiciones, scores), cascade_stats) (p.ej. de la caché semántica) se omite la recuperación.
+    Los Documents de los chunks se crean aquí, al montar el prompt, desde el ChunkStore del motor.
+
+    Returns:
+        tuple: (str: respuesta cruda, list[Document]: chunks enviados al LLM, dict: estadísticas de contexto)
     """
     engine = RetrievalEngine.get_instance()
+    if token_budget is None:
+        token_budget = context_token_budget()
     relevant_docs = []
+    stats = {"n_chunks": 0, "n_blocks": 0, "context_tokens": 0, "raw_context_tokens": 0, "dedup_chars": 0,
+             "compression_ratio": 1.0 if compression_ratio is None else compression_ratio,
+             "tokens_before_compression": 0, "tokens_after_compression": 0, "chunk_scores": [],
+             "cascade": None, "leg_agreement": None, "rerank_pairs": 0, "chunk_scorer": None,
+             "llm_time": None, "first_token_time": None}
     
     # 1. Obtener Contexto (Si no es Baseline)
     if method == "baseline":
@@ -66,31 +309,35 @@ def query_rag(question, options, method, api_key):
         context_text = "NO CONTEXT AVAILABLE. Use your internal knowledge."
 
     else:
-        if method == "cross_encoder":
-            # PASO 1: Broad Retrieval (Traemos MUCHOS candidatos)
-            # Pedimos k=20 para asegurar que la respuesta esté ahí dentro
-            initial_retriever = engine.get_retriever(method="hybrid", k=20)
-            candidate_docs = initial_retriever.invoke(question)
-        
-            # PASO 2: Fine-Grained Reranking (Filtramos a los mejores)
-            # Nos quedamos con los 5 mejores para Gemini
-            relevant_docs = engine.rerank_documents(question, candidate_docs, top_k=5)
-        
-        else:
-            # Buscamos los 8 fragmentos más relevantes usando el método elegido
-            retriever = engine.get_retriever(method=method, k=5)
-            relevant_docs = retriever.invoke(question)
-
-        # Unimos el texto de los chunks recuperados
-        context_text = "\n\n".join([doc.page_content for doc in relevant_docs])
+        if retrieved is None:
+            with profile_stage("retrieval"):
+                retrieved = retrieve_for_method(engine, question, method)
+        (positions, chunk_scores), cascade_stats = retrieved
+        stats.update(cascade_stats)
+
+        store = engine.chunk_store
+        docs = store.documents(positions)
+        scores = [float(score) for score in chunk_scores]
+
+        with profile_stage("context"):
+            # (Opcional) Compresión extractiva: solo las frases más cercanas a la pregunta
+            docs, compression_stats = compress_documents(question, docs, engine, compression_ratio, compression_scorer)
+            if compression_stats["tokens_after_compression"] < compression_stats["tokens_before_compression"]:
+                # Algunos chunks pueden desaparecer; su orden ya refleja el score
+                scores = None
+
+            # Unimos los chunks recuperados: se fusionan solapes y se respeta el presupuesto de tokens
+            context_text, relevant_docs, context_stats = build_context(docs, scores, token_budget)
+        stats.update(context_stats)
+        stats.update(compression_stats)
+
+        # Score de recuperación de cada chunk enviado (para guardarlo junto a su id)
+        score_by_id = dict(zip(store.chunk_ids[positions], scores))
+        stats["chunk_scores"] = [score_by_id.get(get_chunk_id(doc)) for doc in relevant_docs]
             
     # 2. Configurar el LLM (Gemini)
-    # Usamos temperature=0 para resultados reproducibles
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL_NAME, 
-        google_api_key=api_key,
-        temperature=0
-    )
+    # Usamos temperature=0 para resultados reproducibles (en modo "stream", con la salida limitada)
+    llm = get_answer_llm(api_key)
 
     # 3. Rellenar la plantilla con los datos reales
     formatted_prompt = prompt.format(
@@ -103,9 +350,17 @@ def query_rag(question, options, method, api_key):
     )
 
     # 4. Enviar a Google y obtener respuesta
-    response = llm.invoke(formatted_prompt)
+    with profile_stage("rate_limit"):
+        wait_for_llm_slot()
+    with profile_stage("llm"):
+        response, llm_stats = generate(llm, formatted_prompt, stop=ANSWER_STOP)
+    stats.update(llm_stats)
+
+    # Tokens de entrada reales si la API los devuelve; si no, estimación local
+    usage = getattr(response, "usage_metadata", None) or {}
+    stats["prompt_tokens"] = usage.get("input_tokens") or count_tokens(formatted_prompt)
     
-    return response.content.strip(), relevant_docs
+    return response.content.strip(), relevant_docs, stats
 
 # JUEZ V1: COINCIDENCIA DE TEXTO SIMPLE
 def verify_ground_truth_v1(retrieved_docs, ground_truth_ref, threshold=0.5):
@@ -127,20 +382,19 @@ def verify_ground_truth_v1(retrieved_docs, ground_truth_ref, threshold=0.5):
     # Limpiamos la referencia
     ref_clean = super_clean(ground_truth_ref)
     
-    # Unimos todo el contexto recuperado y lo limpiamos igual
-    full_context = "".join([doc.page_content for doc in retrieved_docs])
-    context_clean = super_clean(full_context)
+    # Unimos todo el contexto recuperado y lo limpiamos igual (caché por chunk)
+    context_clean = clean_docs(retrieved_docs, get_chunk_id, _clean_lookup())
 
     # 1. Búsqueda Exacta en la sopa de letras
     if ref_clean in context_clean:
         return True, 1.0
         
     # 2. Fuzzy Match (Por si faltan letras o hay errores de OCR)
-    matcher = SequenceMatcher(None, ref_clean, context_clean)
-    match = matcher.find_longest_match(0, len(ref_clean), 0, len(context_clean))
+    # Bloque común más largo en tiempo lineal (mismo resultado que SequenceMatcher)
+    _, _, match_size = longest_match(ref_clean, context_clean)
     
     # Calculamos porcentaje
-    similarity = match.size / len(ref_clean)
+    similarity = match_size / len(ref_clean)
     
     return similarity >= threshold, similarity
 
@@ -188,6 +442,34 @@ INSTRUCTIONS:
 ANSWER (YES/NO):
 """
 
+# Juez por lotes: varias parejas en una sola llamada
+JUDGE_BATCH_SIZE = 8
+
+JUDGE_ITEM = """
+### ITEM {number}
+GROUND TRUTH:
+{reference}
+
+RETRIEVED CONTEXT:
+{context}
+"""
+
+JUDGE_PROMPT_BATCH = """
+You are an objective evaluator text comparator.
+For EACH item below, check if the RETRIEVED CONTEXT contains the semantic information present in the GROUND TRUTH.
+{items}
+INSTRUCTIONS:
+1. Ignore OCR errors, line breaks, or minor spelling mistakes.
+2. Ignore extra information in the context.
+3. If the core fact of the Ground Truth is present in the Context, answer YES.
+4. Otherwise, answer NO.
+5. Judge every item independently. Output exactly {n_items} lines with the format "<item number>: YES" or "<item number>: NO".
+
+EXAMPLE OUTPUT:
+1: YES
+2: NO
+"""
+
 # JUEZ 
 def verify_ground_truth_v2(paper_ref, retrieved_docs, api_key=None):
     """
@@ -202,15 +484,10 @@ def verify_ground_truth_v2(paper_ref, retrieved_docs, api_key=None):
     ref_clean = super_clean(paper_ref)
     
     # Unimos todo el contexto recuperado y lo limpiamos igual
-    full_context = "".join([doc.page_content for doc in retrieved_docs])
-    context_clean = super_clean(full_context)
+    context_clean = clean_docs(retrieved_docs, get_chunk_id, _clean_lookup())
 
     # Configuramos un modelo 'Flash' barato para juzgar rápido
-    llm_judge = ChatGoogleGenerativeAI(
-        model=MODEL_NAME, # Usa el mismo modelo que tengas disponible
-        google_api_key=api_key,
-        temperature=0.0
-    )
+    llm_judge = get_answer_llm(api_key, temperature=0.0)
     
     formatted_prompt = JUDGE_PROMPT2.format(
         reference=ref_clean,
@@ -218,7 +495,8 @@ def verify_ground_truth_v2(paper_ref, retrieved_docs, api_key=None):
     )
     
     try:
-        verdict = llm_judge.invoke(formatted_prompt).content.strip().upper()
+        wait_for_llm_slot()
+        verdict = generate(llm_judge, formatted_prompt, stop=VERDICT_STOP)[0].content.strip().upper()
         # Limpiamos por si responde si en varias formas
         return "YES" in verdict.upper()
     except Exception as e:
@@ -226,55 +504,135 @@ def verify_ground_truth_v2(paper_ref, retrieved_docs, api_key=None):
         return False
     
 
-def verify_ground_truth_v3(retrieved_docs, ground_truth_ref, api_key=None, threshold=0.5):
+def _judge_prompt_batch(items):
+    """Prompt de juez con varias parejas (referencia, contexto) numeradas."""
+    blocks = [
+        JUDGE_ITEM.format(number=n, reference=reference, context=context)
+        for n, (reference, context) in enumerate(items, start=1)
+    ]
+    return JUDGE_PROMPT_BATCH.format(items="\n".join(blocks), n_items=len(items))
+
+
+def _parse_batch_verdicts(text, n_items):
+    """Lee líneas '3: YES'. Los ítems sin respuesta legible quedan en None."""
+    verdicts = [None] * n_items
+    for number, answer in re.findall(r"(?im)^\W*(\d+)\W+(YES|NO)\b", text):
+        pos = int(number) - 1
+        if 0 <= pos < n_items:
+            verdicts[pos] = answer.upper() == "YES"
+    return verdicts
+
+
+def judge_contexts(items, api_key=None, batch_size=JUDGE_BATCH_SIZE):
     """
-    Verifica si la referencia está en los docs usando:
-    1. Búsqueda exacta
-    2. Fuzzy matching
-    3. Juez LLM (solo si las anteriores fallan)
+    Juez LLM con caché y por lotes.
 
-    Se llama al LLM Judge solo si la respuesta es correcta pero se acierta por suerte
+    Args:
+        items (list[tuple]): (clave de caché, referencia limpia, contexto limpio)
+        batch_size (int): Ítems por llamada al LLM.
+
+    Returns:
+        list[bool]: Veredicto de cada ítem (False si el LLM falla).
     """
-    if not ground_truth_ref:
-        return False, 0.0  # Nada que comparar
+    cache = get_judge_cache()
+    verdicts = [cache.get(key) for key, _, _ in items]
+
+    # Claves pendientes sin repetir (la misma pareja puede aparecer varias veces en el lote)
+    pending = {}
+    for (key, reference, context), verdict in zip(items, verdicts):
+        if verdict is None and key not in pending:
+            pending[key] = (reference, context)
+
+    if pending:
+        llm_judge = get_llm(api_key)
+        keys = list(pending)
+        single_judge = None
+        for start in range(0, len(keys), batch_size):
+            batch_keys = keys[start:start + batch_size]
+            wait_for_llm_slot()
+            try:
+                if len(batch_keys) == 1:
+                    reference, context = pending[batch_keys[0]]
+                    # Un solo ítem: YES/NO, en streaming si el modo de respuesta lo pide
+                    single_judge = single_judge or get_answer_llm(api_key)
+                    answer, _ = generate(single_judge, JUDGE_PROMPT.format(reference=reference, context=context),
+                                         stop=VERDICT_STOP)
+                    batch_verdicts = ["YES" in answer.content.strip().upper()]
+                else:
+                    answer = llm_judge.invoke(_judge_prompt_batch([pending[k] for k in batch_keys]))
+                    batch_verdicts = _parse_batch_verdicts(answer.content, len(batch_keys))
+            except Exception as e:
+                print(f"[Juez] Error LLM: {e}")
+                continue
+
+            # Solo se cachean las respuestas legibles; el resto se reintentará otro día
+            for key, verdict in zip(batch_keys, batch_verdicts):
+                if verdict is not None:
+                    cache.put(key, verdict)
+        cache.save()
+
+    return [bool(cache.verdicts.get(key, False)) for key, _, _ in items]
+
+
+def verify_ground_truth_v3_batch(items, api_key=None, threshold=0.5):
+    """
+    Versión por lotes de verify_ground_truth_v3.
+    Primero se resuelven todas las filas por texto y las que no llegan al umbral
+    se envían juntas al juez LLM (con caché por referencia + chunks recuperados).
 
-    # PREPARACIÓN DE TEXTOS
-    ref_clean = super_clean(ground_truth_ref)
-    full_context = "".join([doc.page_content for doc in retrieved_docs])
-    context_clean = super_clean(full_context)
+    Args:
+        items (list[tuple]): (retrieved_docs, ground_truth_ref)
 
-    # 1. MATCH EXACTO
-    if ref_clean in context_clean:
-        return True, 1.0  # match perfecto
+    Returns:
+        list[tuple]: (bool: evidencia encontrada, float: similitud) por ítem
+    """
+    results = [None] * len(items)
+    to_judge = []
 
-    # 2. FUZZY MATCH 
-    matcher = SequenceMatcher(None, ref_clean, context_clean)
-    match = matcher.find_longest_match(0, len(ref_clean), 0, len(context_clean))
-    similarity = match.size / len(ref_clean)
+    for pos, (retrieved_docs, ground_truth_ref) in enumerate(items):
+        if not ground_truth_ref:
+            results[pos] = (False, 0.0)  # Nada que comparar
+            continue
+        if not retrieved_docs:
+            results[pos] = (False, 0.0)  # Sin contexto (Baseline) no hay nada que juzgar
+            continue
 
-    if similarity >= threshold:
-        return True, similarity  # match aproximado aceptable
+        # PREPARACIÓN DE TEXTOS
+        ref_clean = super_clean(ground_truth_ref)
+        context_clean = clean_docs(retrieved_docs, get_chunk_id, _clean_lookup())
 
-    # 3. LLM JUDGE
-    llm_judge = ChatGoogleGenerativeAI(
-        model=MODEL_NAME,
-        google_api_key=api_key,
-        temperature=0
-    )
+        # 1. MATCH EXACTO
+        if ref_clean in context_clean:
+            results[pos] = (True, 1.0)  # match perfecto
+            continue
 
-    formatted_prompt = JUDGE_PROMPT.format(
-        reference=ref_clean,
-        context=context_clean
-    )
+        # 2. FUZZY MATCH 
+        _, _, match_size = longest_match(ref_clean, context_clean)
+        similarity = match_size / len(ref_clean)
 
-    try:
-        verdict = llm_judge.invoke(formatted_prompt).content.strip().upper()
-        llm_result = "YES" in verdict
-        if llm_result: similarity = 0.95 # Si el LLM dice que sí, asumimos match perfecto
+        if similarity >= threshold:
+            results[pos] = (True, similarity)  # match aproximado aceptable
+            continue
 
-        # devolvemos el veredicto del LLM y la similitud del fuzzy
-        return llm_result, similarity
+        to_judge.append((pos, similarity, (judge_key(ground_truth_ref, retrieved_docs, llm_id()), ref_clean, context_clean)))
 
-    except Exception as e:
-        print(f"[Juez] Error LLM: {e}")
-        return False, similarity
\ No newline at end of file
+    # 3. LLM JUDGE (una llamada por lote, y ninguna si ya estaba en caché)
+    if to_judge:
+        verdicts = judge_contexts([item for _, _, item in to_judge], api_key)
+        for (pos, similarity, _), llm_result in zip(to_judge, verdicts):
+            # Si el LLM dice que sí, asumimos match casi perfecto; si no, la similitud del fuzzy
+            results[pos] = (llm_result, 0.95 if llm_result else similarity)
+
+    return results
+
+
+def verify_ground_truth_v3(retrieved_docs, ground_truth_ref, api_key=None, threshold=0.5):
+    """
+    Verifica si la referencia está en los docs usando:
+    1. Búsqueda exacta
+    2. Fuzzy matching
+    3. Juez LLM (solo si las anteriores fallan, con caché de veredictos)
+
+    Se llama al LLM Judge solo si la respuesta es correcta pero se acierta por suerte
+    """
+    return verify_ground_truth_v3_batch([(retrieved_docs, ground_truth_ref)], api_key, threshold)[0]
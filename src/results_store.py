@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import pandas as pd
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+from src.retrieval import RetrievalEngine, get_chunk_id
+
+
+# --- CONFIGURACIÓN ---
+RESULTS_FILE = "resultados_finales.parquet"
+CHUNKS_FILE = "chunks.parquet"
+PARTIAL_FILE = "resultados_parciales.jsonl"
+
+# Log de resultados parciales: filas en memoria antes de escribir y segundos entre fsync
+LOG_FLUSH_ROWS = 20
+LOG_FSYNC_SECONDS = 10.0
+
+# Tipos de las columnas de resultados (las que no estén se dejan como vengan)
+RESULT_DTYPES = {
+    "question_id": "int32",
+    "method": "category",
+    "correct": "bool",
+    "predicted": "category",
+    "ground_truth": "category",
+    "response_time": "float32",
+    "status": "category",
+    "retrieval_score": "float32",
+    "found_evidence": "bool",
+    "evidence_recall": "float32",
+    "compression_ratio": "float32",
+    "n_chunks": "int16",
+    "context_tokens": "int32",
+    "prompt_tokens": "int32",
+    "llm_time": "float32",
+    "first_token_time": "float32",
+    "chunk_scorer": "category",
+}
+
+
+def build_paths(base_dir):
+    """Rutas de la tabla de resultados y de la tabla de chunks de una carpeta de resultados."""
+    return os.path.join(base_dir, RESULTS_FILE), os.path.join(base_dir, CHUNKS_FILE)
+
+
+def _json_default(value):
+    # Tipos de NumPy (float32 del Cross-Encoder, bool_...) a tipos nativos
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Tipo no serializable: {type(value)}")
+
+
+class ResultLog:
+    """
+    Log append-only de resultados parciales (JSON Lines) con buffer y fsync periódico.
+    Cada fila se identifica por (run_id, repetition, question_id, method), así que
+    una ejecución que se corta puede retomarse sin repetir las llamadas ya hechas.
+    on_append(row) se llama con cada fila (también con las ya escritas al abrir el log),
+    p. ej. para los agregados del dashboard en vivo.
+    Con repair=False no se toca una última línea sin terminar: en un log compartido puede ser
+    la escritura en curso de otro proceso (los workers usan repair=False; el padre repara antes).
+    """
+
+    def __init__(self, path, flush_rows=LOG_FLUSH_ROWS, fsync_seconds=LOG_FSYNC_SECONDS, on_append=None,
+                 repair=True):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.fsync_seconds = fsync_seconds
+        self.on_append = on_append
+        self.done = {}
+        self._buffer = []
+        self._last_fsync = time.time()
+
+        truncated = self._load()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # O_APPEND + una sola escritura por flush: varios procesos pueden compartir el log
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if truncated and repair:
+            # Cerramos la línea cortada para no pegarle la siguiente fila
+            os.write(self._fd, b"\n")
+        if on_append is not None:
+            for row in self.done.values():
+                on_append(row)
+
+    @staticmethod
+    def key(run_id, repetition, question_id, method):
+        return (str(run_id), int(repetition), int(question_id), str(method))
+
+    def _row_key(self, row):
+        return self.key(row["run_id"], row["repetition"], row["question_id"], row["method"])
+
+    def _load(self):
+        """
+        Lee las filas ya escritas. Una última línea a medias (corte brusco) se ignora.
+        Devuelve True si el fichero no termina en salto de línea.
+        """
+        if not os.path.exists(self.path):
+            return False
+        line = "\n"
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.done[self._row_key(row)] = row
+        return not line.endswith("\n")
+
+    def is_done(self, run_id, repetition, question_id, method):
+        return self.key(run_id, repetition, question_id, method) in self.done
+
+    def rows(self, run_id=None, repetition=None):
+        """Filas registradas, opcionalmente filtradas por ejecución y repetición."""
+        return [
+            row for (r_id, rep, _, _), row in self.done.items()
+            if (run_id is None or r_id == str(run_id)) and (repetition is None or rep == repetition)
+        ]
+
+    def append(self, row):
+        self.done[self._row_key(row)] = row
+        self._buffer.append(json.dumps(row, ensure_ascii=False, default=_json_default))
+        if len(self._buffer) >= self.flush_rows:
+            self.flush()
+        if self.on_append is not None:
+            self.on_append(row)
+
+    def flush(self, fsync=False):
+        """Escribe el buffer; hace fsync si se pide o si ha pasado el intervalo."""
+        if self._buffer:
+            os.write(self._fd, ("\n".join(self._buffer) + "\n").encode("utf-8"))
+            self._buffer.clear()
+        if fsync or time.time() - self._last_fsync >= self.fsync_seconds:
+            os.fsync(self._fd)
+            self._last_fsync = time.time()
+
+    def close(self):
+        if self._fd is not None:
+            self.flush(fsync=True)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def to_columnar(df):
+    """
+    Prepara los resultados para Parquet: ids de chunks en lugar de objetos Document
+    y columnas con tipo.
+    """
+    df = df.copy()
+    if "retrieved_docs" in df.columns:
+        # Resultados antiguos: convertimos los Document en ids
+        if "chunk_ids" not in df.columns:
+            df["chunk_ids"] = df["retrieved_docs"].apply(lambda docs: [get_chunk_id(d) for d in docs])
+        df = df.drop(columns=["retrieved_docs"])
+
+    dtypes = {col: dtype for col, dtype in RESULT_DTYPES.items() if col in df.columns}
+    return df.astype(dtypes)
+
+
+def build_chunk_table(chunks, chunk_ids=None):
+    """
+    Tabla deduplicada de chunks (id, fuente, página, texto).
+    Si se pasa chunk_ids, solo se guardan los chunks referenciados en los resultados.
+    """
+    wanted = None if chunk_ids is None else set(chunk_ids)
+    rows = {}
+    for chunk in chunks:
+        chunk_id = get_chunk_id(chunk)
+        if chunk_id in rows or (wanted is not None and chunk_id not in wanted):
+            continue
+        rows[chunk_id] = {
+            "chunk_id": chunk_id,
+            "source": chunk.metadata.get("source"),
+            "page": chunk.metadata.get("page"),
+            "text": chunk.page_content,
+        }
+    return pd.DataFrame(list(rows.values()), columns=["chunk_id", "source", "page", "text"])
+
+
+def save_results(df, results_dir, chunks=None):
+    """
+    Guarda los resultados en Parquet junto a la tabla de chunks que referencian.
+
+    Args:
+        df (pd.DataFrame): Resultados de run_questions.
+        results_dir (str): Carpeta de resultados.
+        chunks (list[Document]): Chunks de la BD. Si None, se leen del motor de búsqueda.
+
+    Returns:
+        str: Ruta del fichero de resultados.
+    """
+    results_file, chunks_file = build_paths(results_dir)
+    os.makedirs(results_dir, exist_ok=True)
+
+    table = to_columnar(df)
+    table.to_parquet(results_file, index=False)
+
+    if "chunk_ids" in table.columns:
+        referenced = {chunk_id for ids in table["chunk_ids"] for chunk_id in ids}
+        if chunks is None:
+            chunks = RetrievalEngine.get_instance().get_all_chunks()
+        build_chunk_table(chunks, referenced).to_parquet(chunks_file, index=False)
+
+    print(f"💾 Resultados guardados en {results_file}")
+    return results_file
+
+
+def read_results(path, columns=None):
+    """
+    Lee resultados (Parquet o CSV antiguo) cargando solo las columnas pedidas que existan.
+    """
+    if path.endswith(".parquet"):
+        if columns is not None:
+            available = set(pq.read_schema(path).names)
+            columns = [col for col in columns if col in available]
+        return pd.read_parquet(path, columns=columns)
+
+    usecols = None if columns is None else (lambda col: col in columns)
+    return pd.read_csv(path, usecols=usecols)
+
+
+def load_chunk_table(results_dir):
+    """Tabla de chunks de una carpeta de resultados, indexada por chunk_id."""
+    _, chunks_file = build_paths(results_dir)
+    return pd.read_parquet(chunks_file).set_index("chunk_id")
+
+
+def materialize_docs(chunk_ids, chunk_table):
+    """Reconstruye los Document de una fila a partir de sus ids."""
+    docs = []
+    for chunk_id in chunk_ids:
+        if chunk_id in chunk_table.index:
+            chunk = chunk_table.loc[chunk_id]
+            docs.append(Document(
+                page_content=chunk["text"],
+                metadata={"chunk_id": chunk_id, "source": chunk["source"], "page": chunk["page"]},
+            ))
+    return docs
@@ -1,12 +1,24 @@
 import gc
+import os
+import time
+import hashlib
 import warnings
+import threading
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
 
 from langchain_community.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.retrievers import BM25Retriever
+from langchain_community.retrievers.bm25 import default_preprocessing_func
 from langchain.retrievers import EnsembleRetriever
 from langchain_core.documents import Document
 from sentence_transformers import CrossEncoder
+from rank_bm25 import BM25Okapi
+
+from src.matching import super_clean
 
 
 # --- CONFIGURACIÓN ---
@@ -14,6 +26,263 @@ CHROMA_PATH = "./data/chroma_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
+# Fusión híbrida: mismos parámetros que el EnsembleRetriever de LangChain (RRF con c=60)
+HYBRID_WEIGHTS = [0.5, 0.5]
+RRF_C = 60
+
+# Perfil de poca memoria (RAG_LOW_MEMORY=1): MiniLM en media precisión
+# y Cross-Encoder (en fp32) liberado tras un rato sin uso
+LOW_MEMORY = os.getenv("RAG_LOW_MEMORY", "0") == "1"
+LOW_MEMORY_DTYPE = "bfloat16"   # media precisión con kernels en CPU (float16 apenas los tiene)
+RERANKER_IDLE_SECONDS = float(os.getenv("RAG_RERANKER_IDLE_SECONDS", "300"))
+
+# tracemalloc durante la carga de cada componente (pico de memoria Python; ralentiza la carga)
+TRACE_MEMORY = os.getenv("RAG_TRACE_MEMORY", "0") == "1"
+
+def get_chunk_id(doc):
+    """
+    Id estable de un chunk: el guardado en la ingesta o, en bases antiguas,
+    un hash de su contenido (igual para BM25 y para Chroma).
+    """
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id is None:
+        chunk_id = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:16]
+    return chunk_id
+
+def bm25_with_scores(bm25_retriever, query, k):
+    """Top-k de un BM25Retriever con su puntuación (mismo orden que el retriever)."""
+    scores = bm25_retriever.vectorizer.get_scores(bm25_retriever.preprocess_func(query))
+    top_n = np.argsort(scores)[::-1][:k]
+    return [(bm25_retriever.docs[i], float(scores[i])) for i in top_n]
+
+def process_memory():
+    """RSS actual y pico (VmHWM) del proceso en MB. None si el sistema no lo expone."""
+    memory = {"rss_mb": None, "peak_rss_mb": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_mb"] = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_mb"] = int(line.split()[1]) / 1024
+    except OSError:
+        # Sin /proc (macOS, Windows): solo el pico, si está disponible
+        try:
+            import resource
+            import sys
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            memory["peak_rss_mb"] = peak / 2**20 if sys.platform == "darwin" else peak / 1024
+        except ImportError:
+            pass
+    return memory
+
+def _model_dtype_kwargs():
+    """torch_dtype de media precisión para los modelos en el perfil de poca memoria."""
+    import torch
+    return {"torch_dtype": getattr(torch, LOW_MEMORY_DTYPE)}
+
+def _param_mb(model):
+    """Tamaño de los parámetros de un modelo de torch en MB."""
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+    except AttributeError:
+        return None
+
+class ChunkStore:
+    """
+    Todos los chunks de la BD en memoria compacta, compartidos por todos los retrievers:
+    - texto: un único buffer UTF-8 con offsets (sin un str ni un Document por chunk),
+    - metadatos en columnas (source, page, start_index) y el id estable de cada chunk,
+    - texto normalizado (super_clean) calculado la primera vez que se pide.
+    Las búsquedas trabajan con posiciones de este almacén; los Documents solo se crean
+    al montar el prompt (documents, scored_documents).
+    """
+
+    # Metadatos guardados en columnas; cualquier otro se guarda aparte por chunk
+    COLUMNS = ("source", "page", "start_index", "chunk_id")
+
+    def __init__(self, ids, texts, metadatas):
+        encoded = [text.encode("utf-8") for text in texts]
+        self.buffer = b"".join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=self.offsets[1:])
+
+        metadatas = [m or {} for m in metadatas]
+        self.sources = sorted({m["source"] for m in metadatas if m.get("source") is not None})
+        source_code = {source: code for code, source in enumerate(self.sources)}
+        self.source = np.array([source_code.get(m.get("source"), -1) for m in metadatas], dtype=np.int16)
+        self.page = np.array([-1 if m.get("page") is None else m["page"] for m in metadatas], dtype=np.int32)
+        self.start_index = np.array([-1 if m.get("start_index") is None else m["start_index"] for m in metadatas],
+                                    dtype=np.int64)
+        self.extra = {i: {key: value for key, value in m.items() if key not in self.COLUMNS}
+                      for i, m in enumerate(metadatas) if m.keys() - set(self.COLUMNS)}
+        self.chunk_ids = np.array([get_chunk_id(Document(page_content=text, metadata=m))
+                                   for text, m in zip(texts, metadatas)], dtype=object)
+
+        # Ids de Chroma (para traducir sus resultados) y de chunk -> posición
+        self.db_ids = list(ids)
+        self._by_db_id = {db_id: i for i, db_id in enumerate(self.db_ids)}
+        self._by_chunk_id = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+
+        # Chunks de texto idéntico comparten clave (la fusión híbrida deduplica por contenido)
+        first = {}
+        self.content_key = np.array([first.setdefault(text, i) for i, text in enumerate(encoded)], dtype=np.int32)
+        self._clean = [None] * len(encoded)
+
+    @classmethod
+    def from_db(cls, db):
+        raw_data = db.get(include=["documents", "metadatas"])
+        return cls(raw_data["ids"], raw_data["documents"], raw_data["metadatas"])
+
+    def __len__(self):
+        return len(self.db_ids)
+
+    def text(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def texts(self, positions):
+        return [self.text(i) for i in positions]
+
+    def metadata(self, i):
+        metadata = dict(self.extra.get(i, ()))
+        if self.source[i] >= 0:
+            metadata["source"] = self.sources[self.source[i]]
+        if self.page[i] >= 0:
+            metadata["page"] = int(self.page[i])
+        if self.start_index[i] >= 0:
+            metadata["start_index"] = int(self.start_index[i])
+        metadata["chunk_id"] = self.chunk_ids[i]
+        return metadata
+
+    def document(self, i):
+        return Document(page_content=self.text(i), metadata=self.metadata(i))
+
+    def documents(self, positions=None):
+        """Documents de las posiciones indicadas (por defecto, todos los chunks)."""
+        if positions is None:
+            positions = range(len(self))
+        return [self.document(i) for i in positions]
+
+    def scored_documents(self, positions, scores):
+        """Lista de (Document, score) de un resultado (posiciones, puntuaciones)."""
+        return [(self.document(i), float(score)) for i, score in zip(positions, scores)]
+
+    def positions_of(self, db_ids):
+        """Posiciones de una lista de ids de Chroma."""
+        return np.array([self._by_db_id[db_id] for db_id in db_ids], dtype=np.int32)
+
+    def position_of_chunk(self, chunk_id):
+        """Posición del chunk con ese id estable (None si no está en la BD)."""
+        return self._by_chunk_id.get(chunk_id)
+
+    def clean_text(self, i):
+        """Texto normalizado del chunk (super_clean), calculado una sola vez."""
+        cleaned = self._clean[i]
+        if cleaned is None:
+            cleaned = self._clean[i] = super_clean(self.text(i))
+        return cleaned
+
+    def clean_text_by_id(self, chunk_id):
+        i = self._by_chunk_id.get(chunk_id)
+        return None if i is None else self.clean_text(i)
+
+    def clear_clean_cache(self):
+        self._clean = [None] * len(self)
+
+    def nbytes(self):
+        """Memoria aproximada: buffer, offsets, columnas y textos normalizados ya calculados."""
+        size = len(self.buffer) + self.offsets.nbytes + self.source.nbytes + self.page.nbytes
+        size += self.start_index.nbytes + self.content_key.nbytes
+        size += sum(len(chunk_id) for chunk_id in self.chunk_ids)
+        size += sum(len(cleaned) for cleaned in self._clean if cleaned is not None)
+        return size
+
+class BM25Index:
+    """
+    Índice BM25 con listas de postings: por término, los chunks que lo contienen y su peso.
+    Puntúa igual que BM25Okapi de rank_bm25 (el de BM25Retriever), pero no guarda las
+    frecuencias de cada documento ni el texto: devuelve posiciones del ChunkStore.
+    """
+
+    def __init__(self, texts, preprocess_func=default_preprocessing_func):
+        vectorizer = BM25Okapi([preprocess_func(text) for text in texts])
+        k1 = vectorizer.k1
+        norm = k1 * (1 - vectorizer.b + vectorizer.b * np.asarray(vectorizer.doc_len) / vectorizer.avgdl)
+
+        postings = defaultdict(lambda: ([], []))
+        for d, freqs in enumerate(vectorizer.doc_freqs):
+            for term, tf in freqs.items():
+                doc_idx, weights = postings[term]
+                doc_idx.append(d)
+                # Mismo orden de operaciones que BM25Okapi.get_scores
+                weights.append(vectorizer.idf[term] * (tf * (k1 + 1) / (tf + norm[d])))
+
+        self.postings = {term: (np.array(doc_idx, dtype=np.int32), np.array(weights))
+                         for term, (doc_idx, weights) in postings.items()}
+        self.n_docs = len(vectorizer.doc_len)
+        self.preprocess_func = preprocess_func
+
+    def scores(self, query):
+        """Puntuación BM25 de la consulta para cada chunk (array de n_docs)."""
+        scores = np.zeros(self.n_docs)
+        for term in self.preprocess_func(query):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def top_k(self, query, k):
+        """(posiciones, puntuaciones) de los k mejores chunks, en el mismo orden que BM25Retriever."""
+        scores = self.scores(query)
+        top_n = np.argsort(scores)[::-1][:k]
+        return top_n, scores[top_n]
+
+    def nbytes(self):
+        """Memoria aproximada de los postings."""
+        return sum(idx.nbytes + weights.nbytes for idx, weights in self.postings.values())
+
+def rrf_fuse(result_lists, weights):
+    """
+    Reciprocal Rank Fusion ponderado, replicando EnsembleRetriever:
+    se deduplica por contenido y se conserva el orden de aparición en empates.
+    """
+    rrf_score = defaultdict(float)
+    for results, weight in zip(result_lists, weights):
+        for rank, (doc, _) in enumerate(results, start=1):
+            rrf_score[doc.page_content] += weight / (rank + RRF_C)
+
+    seen = set()
+    unique_docs = []
+    for results in result_lists:
+        for doc, _ in results:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                unique_docs.append(doc)
+
+    ranked = sorted(unique_docs, key=lambda d: rrf_score[d.page_content], reverse=True)
+    return [(doc, rrf_score[doc.page_content]) for doc in ranked]
+
+def rrf_fuse_positions(result_lists, weights, content_key):
+    """
+    rrf_fuse sobre resultados (posiciones, puntuaciones) del ChunkStore.
+    content_key[i] identifica el texto del chunk i (chunks idénticos se deduplican igual que en rrf_fuse).
+
+    Returns:
+        tuple: (np.ndarray posiciones, np.ndarray puntuaciones RRF), de mayor a menor
+    """
+    rrf_score = defaultdict(float)
+    first = {}
+    for positions, weight in zip(result_lists, weights):
+        for rank, i in enumerate(positions, start=1):
+            key = content_key[i]
+            rrf_score[key] += weight / (rank + RRF_C)
+            first.setdefault(key, i)
+
+    # Los dict conservan el orden de aparición: sorted es estable en los empates
+    ranked = sorted(first, key=rrf_score.__getitem__, reverse=True)
+    return (np.array([first[key] for key in ranked], dtype=np.int32),
+            np.array([rrf_score[key] for key in ranked]))
+
 class RetrievalEngine:
     _instance = None
 
@@ -28,7 +297,15 @@ class RetrievalEngine:
         self._db = None
         self._embeddings = None
         self._bm25_retriever = None
+        self._chunk_store = None
+        self._bm25_index = None
         self._reranker = None
+        self._reranker_last_used = 0.0
+        self._idle_watch = None
+        # Memoria medida al cargar cada componente (ver memory_report)
+        self._memory = {}
+        # Se incrementa cada vez que se desconecta la BD (p.ej. antes de reconstruirla)
+        self._generation = 0
 
     @classmethod
     def get_instance(cls):
@@ -49,17 +326,133 @@ class RetrievalEngine:
         Se conecta solo cuando le pides la DB.
         """
         if self._db is None:
-            self._embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+            # En poca memoria, SentenceTransformer carga los pesos en media precisión.
+            # Ojo: la BD se indexó con embeddings fp32, así que los scores densos se desplazan un poco
+            # (las consultas en bf16 no dan exactamente los mismos vecinos que en fp32)
+            model_kwargs = {"model_kwargs": _model_dtype_kwargs()} if LOW_MEMORY else {}
+            self._embeddings = self._measure("embeddings", lambda: HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL, model_kwargs=model_kwargs))
             warnings.filterwarnings("ignore", category=DeprecationWarning)
-            self._db = Chroma(persist_directory=CHROMA_PATH, embedding_function=self._embeddings)
+            self._db = self._measure("chroma", lambda: Chroma(persist_directory=CHROMA_PATH,
+                                                             embedding_function=self._embeddings))
         return self._db
 
+    @property
+    def embeddings(self):
+        """Modelo MiniLM ya cargado junto a la base de datos."""
+        if self._embeddings is None:
+            _ = self.db
+        return self._embeddings
+
     def unload_db(self):
-        """Método para desconectar manualmente"""
+        """Método para desconectar manualmente (también libera el almacén de chunks y los índices BM25, que salen de la BD)"""
         if self._db is not None:
             self._db = None
             self._embeddings = None
+            self._bm25_retriever = None
+            self._chunk_store = None
+            self._bm25_index = None
             gc.collect()
+        self._generation += 1
+
+    def unload_reranker(self):
+        """Libera el Cross-Encoder (se vuelve a cargar en el siguiente uso)."""
+        if self._reranker is not None:
+            self._reranker = None
+            gc.collect()
+
+    # MEMORIA
+    def _measure(self, name, loader):
+        """Carga un componente anotando el RSS que añade y, con TRACE_MEMORY, el pico de tracemalloc."""
+        tracing = TRACE_MEMORY and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        rss_before = process_memory()["rss_mb"]
+        start_ts = time.perf_counter()
+        try:
+            component = loader()
+        finally:
+            entry = {"load_seconds": round(time.perf_counter() - start_ts, 3)}
+            rss_after = process_memory()["rss_mb"]
+            if rss_before is not None and rss_after is not None:
+                entry["rss_delta_mb"] = round(rss_after - rss_before, 1)
+            if tracing:
+                entry["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                tracemalloc.stop()
+            self._memory[name] = entry
+        return component
+
+    def memory_report(self):
+        """
+        Memoria del motor en este momento: RSS del proceso y, por componente,
+        si está cargado, lo que añadió al cargarse y su tamaño propio (parámetros, postings).
+
+        Returns:
+            dict: {"process": {...}, "low_memory": bool, "components": {nombre: {...}}}
+        """
+        loaded = {
+            "embeddings": self._embeddings is not None,
+            "chroma": self._db is not None,
+            "chunk_store": self._chunk_store is not None,
+            "bm25": self._bm25_index is not None,
+            "bm25_retriever": self._bm25_retriever is not None,
+            "reranker": self._reranker is not None,
+        }
+        components = {name: dict(self._memory.get(name, {}), loaded=is_loaded) for name, is_loaded in loaded.items()}
+
+        if self._embeddings is not None:
+            components["embeddings"]["param_mb"] = _param_mb(getattr(self._embeddings, "client", None))
+        if self._chunk_store is not None:
+            components["chunk_store"]["chunks"] = len(self._chunk_store)
+            components["chunk_store"]["store_mb"] = round(self._chunk_store.nbytes() / 2**20, 2)
+        if self._bm25_index is not None:
+            components["bm25"]["index_mb"] = round(self._bm25_index.nbytes() / 2**20, 2)
+        if self._reranker is not None:
+            components["reranker"]["param_mb"] = _param_mb(self._reranker.model)
+            components["reranker"]["idle_seconds"] = round(time.monotonic() - self._reranker_last_used, 1)
+        for entry in components.values():
+            if entry.get("param_mb") is not None:
+                entry["param_mb"] = round(entry["param_mb"], 1)
+
+        return {"process": process_memory(), "low_memory": LOW_MEMORY, "components": components}
+
+    def print_memory_report(self):
+        """Resumen de memoria por consola."""
+        report = self.memory_report()
+        process = report["process"]
+        rss = f"{process['rss_mb']:.0f} MB" if process["rss_mb"] is not None else "?"
+        peak = f"{process['peak_rss_mb']:.0f} MB" if process["peak_rss_mb"] is not None else "?"
+        print(f"\n🧮 Memoria del motor{' (perfil de poca memoria)' if report['low_memory'] else ''}: "
+              f"RSS {rss} | pico {peak}")
+        for name, entry in report["components"].items():
+            if not entry["loaded"] and name not in self._memory:
+                continue
+            details = [f"{key}={value}" for key, value in entry.items() if key != "loaded"]
+            print(f"   {'🟢' if entry['loaded'] else '⚪'} {name:<15} {', '.join(details)}")
+        return report
+
+    def warm_up(self, methods):
+        """Carga lo que necesitan los métodos indicados (Chroma, almacén de chunks, índice BM25, Cross-Encoder)."""
+        _ = self.chunk_store
+        if any(method in ("bm25", "hybrid", "cross_encoder", "cross_encoder_adaptive") for method in methods):
+            self._get_bm25_index()
+        if any(method.startswith("cross_encoder") for method in methods):
+            _ = self.reranker
+
+    def collection_version(self):
+        """Versión de la colección: cambia si se reconstruye la BD o cambia su número de chunks."""
+        return self._generation, self.db._collection.count()
+
+    @property
+    def chunk_store(self):
+        """Almacén compacto de todos los chunks de la BD (se lee de Chroma una sola vez)."""
+        if self._chunk_store is None:
+            self._chunk_store = self._measure("chunk_store", lambda: ChunkStore.from_db(self.db))
+        return self._chunk_store
+
+    def get_all_chunks(self):
+        """Todos los chunks guardados en Chroma como Documents."""
+        return self.chunk_store.documents()
 
     def _get_bm25_retriever(self):
         """Construye o devuelve el índice BM25 cacheado."""
@@ -68,15 +461,11 @@ class RetrievalEngine:
         
         try:
             # Sacamos todos los documentos de Chroma para crear el índice inverso
-            raw_data = self.db.get()
-            texts = raw_data['documents']
-            metadatas = raw_data['metadatas']
+            docs_obj = self.get_all_chunks()
             
-            if not texts:
+            if not docs_obj:
                 print("⚠️  ADVERTENCIA: La base de datos está vacía.")
                 return None
-                
-            docs_obj = [Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas)]
             
             self._bm25_retriever = BM25Retriever.from_documents(docs_obj)
             return self._bm25_retriever
@@ -114,21 +503,152 @@ class RetrievalEngine:
             # 50% de peso a cada uno
             return EnsembleRetriever(
                 retrievers=[bm25_retriever, dense_retriever],
-                weights=[0.5, 0.5]
+                weights=HYBRID_WEIGHTS
             )
             
         # Default fallback
         return dense_retriever
-    
+
+    # BÚSQUEDA CON PUNTUACIONES
+    # Los métodos search_* devuelven (posiciones del ChunkStore, puntuaciones), de mayor a menor;
+    # retrieve_with_scores devuelve el mismo resultado como lista de (Document, score).
+    def _get_bm25_index(self):
+        """Construye o devuelve el índice de postings BM25 (sobre el texto del almacén de chunks)."""
+        if self._bm25_index is not None:
+            return self._bm25_index
+        try:
+            store = self.chunk_store
+            self._bm25_index = self._measure("bm25", lambda: BM25Index(store.texts(range(len(store)))) if len(store) else None)
+            if self._bm25_index is None:
+                print("⚠️  ADVERTENCIA: La base de datos está vacía.")
+            return self._bm25_index
+
+        except Exception as e:
+            print(f"❌ Error construyendo BM25: {e}")
+            return None
+
+    def _bm25_search(self, query, k):
+        """Top-k de BM25 con su puntuación (mismo orden que BM25Retriever)."""
+        index = self._get_bm25_index()
+        if index is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        return index.top_k(query, k)
+
+    def _dense_batch_search(self, query_embeddings, k):
+        """Top-k vectorial de varias consultas en una sola llamada a Chroma (solo ids y distancias)."""
+        store = self.chunk_store
+        # Chroma solo acepta listas de Python (rechaza los arrays de NumPy, p.ej. los de la caché semántica)
+        query_embeddings = [np.asarray(embedding, dtype=float).tolist() for embedding in query_embeddings]
+        result = self.db._collection.query(query_embeddings=query_embeddings, n_results=k, include=["distances"])
+        # Chroma devuelve distancia L2 al cuadrado; con embeddings normalizados
+        # (MiniLM lo está) equivale a 2 - 2*coseno
+        return [(store.positions_of(ids), 1.0 - np.asarray(distances, dtype=float) / 2.0)
+                for ids, distances in zip(result["ids"], result["distances"])]
+
+    def _dense_search(self, query, k, query_embedding=None):
+        """Top-k vectorial con similitud coseno (mismo orden que el retriever denso)."""
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+        return self._dense_batch_search([query_embedding], k)[0]
+
+    def _fuse(self, result_lists, weights):
+        """Fusión híbrida (RRF ponderado, ver rrf_fuse)."""
+        return rrf_fuse_positions([positions for positions, _ in result_lists], weights, self.chunk_store.content_key)
+
+    def search(self, query, method, k=4, query_embedding=None):
+        """
+        Igual que get_retriever(method, k).invoke(query), pero sin crear Documents.
+
+        Args:
+            query (str): Pregunta del usuario
+            method (str): "dense", "bm25", o "hybrid"
+            k (int): Número de documentos a recuperar
+            query_embedding (list[float]): Embedding de la pregunta si ya se calculó
+
+        Returns:
+            tuple: (np.ndarray posiciones en chunk_store, np.ndarray puntuaciones), de mayor a menor
+        """
+        if method == "bm25":
+            return self._bm25_search(query, k)
+
+        if method == "hybrid":
+            return self.search_hybrid_legs(query, k, query_embedding)[2]
+
+        return self._dense_search(query, k, query_embedding)
+
+    def search_hybrid_legs(self, query, k=4, query_embedding=None):
+        """
+        Búsqueda híbrida devolviendo también cada rama por separado.
+
+        Returns:
+            tuple: (resultados BM25, resultados densos, resultados fusionados), cada uno (posiciones, puntuaciones)
+        """
+        bm25_results = self._bm25_search(query, k)
+        dense_results = self._dense_search(query, k, query_embedding)
+        return bm25_results, dense_results, self._fuse([bm25_results, dense_results], HYBRID_WEIGHTS)
+
+    def search_batch(self, queries, method, k=4):
+        """
+        search para muchas preguntas: un único lote de embeddings,
+        una única consulta a Chroma y las puntuaciones BM25 de todas a la vez.
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+
+        if method in ("bm25", "hybrid"):
+            bm25_results = [self._bm25_search(query, k) for query in queries]
+            if method == "bm25":
+                return bm25_results
+
+        dense_results = self._dense_batch_search(self.embeddings.embed_documents(queries), k)
+        if method == "hybrid":
+            return [self._fuse([bm25, dense], HYBRID_WEIGHTS) for bm25, dense in zip(bm25_results, dense_results)]
+        return dense_results
+
+    def retrieve_with_scores(self, query, method, k=4, query_embedding=None):
+        """
+        Igual que get_retriever(method, k).invoke(query), pero devuelve
+        una lista de tuplas (Document, score) ordenada de mayor a menor score.
+
+        Args:
+            query (str): Pregunta del usuario
+            method (str): "dense", "bm25", o "hybrid"
+            k (int): Número de documentos a recuperar
+            query_embedding (list[float]): Embedding de la pregunta si ya se calculó
+        """
+        return self.chunk_store.scored_documents(*self.search(query, method, k, query_embedding))
+
     @property
     def reranker(self):
         """Carga el modelo Cross-Encoder solo si se necesita."""
         if self._reranker is None:
-            self._reranker = CrossEncoder(RERANKER_MODEL)
+            # Siempre en fp32: CrossEncoder.predict llama a .numpy() sobre los logits y falla con bf16
+            # (sentence-transformers 3.0); en poca memoria el ahorro viene de liberarlo sin uso
+            self._reranker = self._measure("reranker", lambda: CrossEncoder(RERANKER_MODEL))
+            if LOW_MEMORY:
+                self._start_idle_watch()
+        self._reranker_last_used = time.monotonic()
         return self._reranker
 
+    def _start_idle_watch(self):
+        """Hilo que libera el Cross-Encoder tras RERANKER_IDLE_SECONDS sin uso (perfil de poca memoria)."""
+        if self._idle_watch is not None and self._idle_watch.is_alive():
+            return
+
+        def watch():
+            while self._reranker is not None:
+                time.sleep(min(RERANKER_IDLE_SECONDS / 4, 30))
+                if self._reranker is not None and time.monotonic() - self._reranker_last_used > RERANKER_IDLE_SECONDS:
+                    # Un predict en curso conserva su referencia al modelo hasta terminar
+                    print(f"💤 Cross-Encoder sin uso durante {RERANKER_IDLE_SECONDS:.0f}s: liberando memoria")
+                    self.unload_reranker()
+
+        self._idle_watch = threading.Thread(target=watch, daemon=True)
+        self._idle_watch.start()
+
     # RE-RANKING
-    def rerank_documents(self, query, docs, top_k=5):   
+    def rerank_documents(self, query, docs, top_k=5):
         """
         Recibe una lista de documentos candidatos, los puntúa contra la query
         y devuelve los top_k mejores.
@@ -146,4 +666,31 @@ class RetrievalEngine:
         
         # 4. Devolvemos solo los objetos Document del top_k
         final_docs = [doc for doc, score in docs_with_scores[:top_k]]
-        return final_docs
\ No newline at end of file
+        return final_docs
+
+    def rerank_positions(self, query, positions, top_k=5):
+        """
+        rerank_documents sobre posiciones del ChunkStore.
+
+        Returns:
+            tuple: (np.ndarray posiciones, np.ndarray scores del Cross-Encoder) del top_k
+        """
+        return self.rerank_positions_batch([query], [positions], top_k)[0]
+
+    def rerank_positions_batch(self, queries, positions_lists, top_k=5):
+        """Reranking por posiciones de varias preguntas con una sola llamada al Cross-Encoder."""
+        store = self.chunk_store
+        pairs = [[query, store.text(i)] for query, positions in zip(queries, positions_lists) for i in positions]
+        if not pairs:
+            return [(np.zeros(0, dtype=np.int32), np.zeros(0)) for _ in queries]
+        scores = np.asarray(self.reranker.predict(pairs), dtype=float)
+
+        results, start = [], 0
+        for positions in positions_lists:
+            positions = np.asarray(positions, dtype=np.int32)
+            chunk_scores = scores[start:start + len(positions)]
+            start += len(positions)
+            # Estable: en empates se conserva el orden de los candidatos (como sorted)
+            order = np.argsort(-chunk_scores, kind="stable")[:top_k]
+            results.append((positions[order], chunk_scores[order]))
+        return results
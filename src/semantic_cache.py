@@ -0,0 +1,177 @@
+import time
+import json
+import threading
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from src.retrieval import RetrievalEngine
+from src.rag_pipeline import query_rag, retrieve_for_method, MODEL_NAME
+from src.context import context_token_budget, COMPRESSION_RATIO, COMPRESSION_SCORER
+
+
+# --- CONFIGURACIÓN ---
+# Similitud coseno mínima (MiniLM) para reutilizar una consulta anterior
+ANSWER_THRESHOLD = 0.95     # respuesta completa: misma pregunta con otras palabras y mismas opciones
+RETRIEVAL_THRESHOLD = 0.90  # solo los chunks recuperados: el LLM se llama igualmente
+CACHE_MAX_ENTRIES = 1000    # por nivel (LRU)
+CACHE_TTL_SECONDS = 3600.0
+
+
+class SemanticCache:
+    """
+    Caché semántica delante de query_rag, en dos niveles:
+    - "answer": (respuesta, chunks, estadísticas), particionada por método + opciones + ajustes.
+    - "retrieval": chunks puntuados, particionada por método (no depende de las opciones).
+
+    Busca la consulta anterior más parecida (coseno sobre el embedding de la pregunta)
+    dentro de la partición. Expulsión LRU + TTL y vaciado si cambia la colección de Chroma.
+    """
+
+    def __init__(self, engine=None, answer_threshold=ANSWER_THRESHOLD, retrieval_threshold=RETRIEVAL_THRESHOLD,
+                 max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.engine = engine or RetrievalEngine.get_instance()
+        self.thresholds = {"answer": answer_threshold, "retrieval": retrieval_threshold}
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # nivel -> OrderedDict[(partición, pregunta)] -> entrada (orden = uso reciente)
+        self.entries = {"answer": OrderedDict(), "retrieval": OrderedDict()}
+        self.version = None
+        # El servidor atiende peticiones en varios hilos
+        self._lock = threading.RLock()
+        self.stats = {"lookups": 0, "answer_hits": 0, "retrieval_hits": 0, "misses": 0,
+                      "evictions": 0, "invalidations": 0, "saved_seconds": 0.0}
+
+    def embed(self, question):
+        """Embedding normalizado de la pregunta con el MiniLM ya cargado por el motor."""
+        return np.asarray(self.engine.embeddings.embed_query(question), dtype=np.float32)
+
+    @staticmethod
+    def answer_partition(method, options, **settings):
+        """Las opciones y los ajustes forman parte de la clave: misma pregunta con otras opciones = otra respuesta."""
+        payload = json.dumps({"method": method, "options": options, "model": MODEL_NAME, **settings},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _check_version(self):
+        version = self.engine.collection_version()
+        with self._lock:
+            if self.version is not None and version != self.version:
+                # Otra BD: los chunks guardados ya no existen
+                self.clear()
+                self.stats["invalidations"] += 1
+            self.version = version
+
+    def clear(self):
+        with self._lock:
+            for entries in self.entries.values():
+                entries.clear()
+
+    def _expire(self, level):
+        entries = self.entries[level]
+        now = time.time()
+        # El más antiguo en uso va primero, pero el TTL cuenta desde la creación
+        for key in [key for key, entry in entries.items() if now - entry["created"] > self.ttl_seconds]:
+            del entries[key]
+            self.stats["evictions"] += 1
+
+    def lookup(self, level, partition, embedding):
+        """Valor de la entrada más parecida (coseno >= umbral) de la partición, o None."""
+        with self._lock:
+            self._expire(level)
+            entries = self.entries[level]
+            candidates = [key for key in entries if key[0] == partition]
+            if not candidates:
+                return None
+
+            similarities = np.stack([entries[key]["embedding"] for key in candidates]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.thresholds[level]:
+                return None
+
+            key = candidates[best]
+            entries.move_to_end(key)
+            entry = entries[key]
+            self.stats["saved_seconds"] += entry["cost"]
+            return entry["value"]
+
+    def store(self, level, partition, question, embedding, value, cost):
+        """Guarda un valor con el tiempo que costó calcularlo (latencia ahorrada en cada acierto)."""
+        with self._lock:
+            entries = self.entries[level]
+            entries[(partition, question)] = {"embedding": embedding, "value": value, "cost": cost,
+                                              "created": time.time()}
+            entries.move_to_end((partition, question))
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def report(self):
+        """Tasa de aciertos y latencia ahorrada."""
+        lookups = self.stats["lookups"]
+        hits = self.stats["answer_hits"] + self.stats["retrieval_hits"]
+        return dict(self.stats, hit_rate=hits / lookups if lookups else 0.0,
+                    answer_entries=len(self.entries["answer"]), retrieval_entries=len(self.entries["retrieval"]))
+
+
+def cached_query_rag(cache, question, options, method, api_key, token_budget=None,
+                     compression_ratio=COMPRESSION_RATIO, compression_scorer=COMPRESSION_SCORER, retrieve=None):
+    """
+    query_rag con caché semántica: primero respuesta completa, después solo recuperación.
+    retrieve(question, method) sustituye a retrieve_for_method en los fallos (p.ej. el micro-batcher del servidor).
+
+    Returns:
+        tuple: igual que query_rag; las estadísticas incluyen "semantic_cache" ("answer", "retrieval" o None)
+    """
+    cache._check_version()
+    if token_budget is None:
+        token_budget = context_token_budget()
+    cache.count("lookups")
+    embedding = cache.embed(question)
+
+    # 1. Respuesta completa de una pregunta equivalente con las mismas opciones
+    partition = cache.answer_partition(method, options, token_budget=token_budget,
+                                       compression_ratio=compression_ratio, compression_scorer=compression_scorer)
+    hit = cache.lookup("answer", partition, embedding)
+    if hit is not None:
+        cache.count("answer_hits")
+        answer, relevant_docs, stats = hit
+        return answer, relevant_docs, dict(stats, semantic_cache="answer")
+
+    start_ts = time.time()
+    retrieved, level = None, None
+
+    # 2. Chunks de una pregunta parecida (el LLM responde igualmente con las opciones nuevas)
+    if method != "baseline":
+        retrieved = cache.lookup("retrieval", method, embedding)
+        if retrieved is not None:
+            cache.count("retrieval_hits")
+            level = "retrieval"
+        else:
+            cache.count("misses")
+            retrieval_ts = time.time()
+            if retrieve is not None:
+                retrieved = retrieve(question, method)
+            else:
+                retrieved = retrieve_for_method(cache.engine, question, method, embedding)
+            cache.store("retrieval", method, question, embedding, retrieved, time.time() - retrieval_ts)
+    else:
+        cache.count("misses")
+
+    answer, relevant_docs, stats = query_rag(question, options, method, api_key, token_budget,
+                                             compression_ratio, compression_scorer, retrieved=retrieved)
+    cache.store("answer", partition, question, embedding, (answer, relevant_docs, stats), time.time() - start_ts)
+    return answer, relevant_docs, dict(stats, semantic_cache=level)
+
+
+def print_cache_report(cache):
+    """Resumen de la caché semántica por consola."""
+    report = cache.report()
+    print(f"\n🧠 Caché semántica: {report['lookups']} consultas | acierto {report['hit_rate']*100:.1f}% "
+          f"(respuesta {report['answer_hits']}, recuperación {report['retrieval_hits']}) | "
+          f"{report['saved_seconds']:.1f}s ahorrados | {report['evictions']} expulsiones, "
+          f"{report['invalidations']} invalidaciones")
+    return report
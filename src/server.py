@@ -0,0 +1,318 @@
+import os
+import re
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque, Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from src.retrieval import RetrievalEngine, get_chunk_id
+from src.rag_pipeline import query_rag, retrieve_batch_for_method
+from src.semantic_cache import SemanticCache, cached_query_rag
+
+
+# --- CONFIGURACIÓN ---
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+
+# Micro-batching: se espera como mucho BATCH_MAX_WAIT_MS desde la primera petición del lote
+BATCH_MAX_SIZE = 16
+BATCH_MAX_WAIT_MS = 10
+
+# Latencias guardadas para los percentiles de /metrics
+METRICS_WINDOW = 5000
+
+METHODS = ["baseline", "bm25", "dense", "hybrid", "cross_encoder"]
+
+
+class MicroBatcher:
+    """
+    Agrupa las peticiones concurrentes en lotes cortos para la recuperación:
+    un lote de embeddings, una consulta a Chroma, el índice BM25 y un predict del Cross-Encoder.
+    Cada petición recibe un Future con su ((posiciones, scores), cascade_stats).
+    """
+
+    def __init__(self, engine, max_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.engine = engine
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batch_sizes = Counter()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, question, method):
+        future = Future()
+        self.queue.put((question, method, future))
+        return future
+
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _loop(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            stop = False
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        self.batch_sizes[len(batch)] += 1
+        by_method = {}
+        for question, method, future in batch:
+            by_method.setdefault(method, []).append((question, future))
+
+        for method, items in by_method.items():
+            try:
+                results = retrieve_batch_for_method(self.engine, [q for q, _ in items], method)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(items, results):
+                future.set_result(result)
+
+
+class QueryService:
+    """Motor caliente + micro-batcher + métricas del servidor (y, opcionalmente, caché semántica)."""
+
+    def __init__(self, api_key=None, max_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, semantic_cache=False):
+        self.api_key = api_key
+        self.engine = RetrievalEngine.get_instance()
+        self.started = time.time()
+        self.warm = False
+        self.warm_error = None
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.latencies = {"total": deque(maxlen=METRICS_WINDOW), "retrieval": deque(maxlen=METRICS_WINDOW)}
+        self.batcher = MicroBatcher(self.engine, max_size, max_wait_ms)
+        # Caché semántica delante de query_rag; sus fallos de recuperación también van por el micro-batcher
+        self.cache = SemanticCache(self.engine) if semantic_cache else None
+
+    def warm_up(self):
+        """
+        Carga Chroma, el índice BM25 y el Cross-Encoder. serve() lo lanza en un hilo con el puerto ya
+        abierto: hasta que termina, /health responde 503 "warming" y /query 503.
+        """
+        print("\n⚙️  Calentando motores...")
+        try:
+            self.engine.warm_up(METHODS)
+            self.engine.search_batch(["warm up"], "hybrid", k=1)
+        except Exception as e:
+            self.warm_error = str(e)
+            print(f"❌ Error calentando el motor: {e}")
+            return
+        self.warm = True
+        print("✅ Motor listo")
+
+    def health(self):
+        """(código HTTP, cuerpo) de /health: 200 con el motor listo, 503 mientras calienta o si falló."""
+        if self.warm:
+            status = "ok"
+        elif self.warm_error is not None:
+            status = "error"
+        else:
+            status = "warming"
+        body = {"status": status, "queue_size": self.batcher.queue.qsize()}
+        if self.warm_error is not None:
+            body["error"] = self.warm_error
+        return (200 if self.warm else 503), body
+
+    def _record(self, name, seconds):
+        with self.lock:
+            self.latencies[name].append(seconds)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def query(self, payload):
+        """
+        Responde una pregunta. Campos: question, options (A-D), method, retrieval_only.
+
+        Returns:
+            dict: respuesta (si se llama al LLM), chunks con score y estadísticas
+        """
+        start_ts = time.perf_counter()
+        question = payload["question"]
+        method = payload.get("method", "cross_encoder")
+        if method not in METHODS:
+            raise ValueError(f"Método desconocido: {method}")
+        retrieval_only = payload.get("retrieval_only", False)
+
+        retrieved = None
+        if method != "baseline" and (retrieval_only or self.cache is None):
+            retrieved = self.batcher.submit(question, method).result()
+            self._record("retrieval", time.perf_counter() - start_ts)
+
+        response = {"method": method}
+        if retrieval_only:
+            scored_docs = self.engine.chunk_store.scored_documents(*retrieved[0]) if retrieved else []
+            response["chunks"] = [_chunk_info(doc, score) for doc, score in scored_docs]
+            response["stats"] = retrieved[1] if retrieved else {}
+        else:
+            if "options" not in payload:
+                raise ValueError("Faltan las opciones (A-D) de la pregunta")
+            if self.cache is not None:
+                answer, relevant_docs, stats = cached_query_rag(
+                    self.cache, question, payload["options"], method, self.api_key,
+                    retrieve=lambda q, m: self.batcher.submit(q, m).result())
+            else:
+                answer, relevant_docs, stats = query_rag(question, payload["options"], method, self.api_key,
+                                                         retrieved=retrieved)
+            match = re.search(r'(?i)\b([A-D])\b', answer)
+            response.update({
+                "answer": answer,
+                "letter": match.group(1).upper() if match else "X",
+                "chunks": [_chunk_info(doc, score) for doc, score in zip(relevant_docs, stats["chunk_scores"])],
+                "stats": {key: value for key, value in stats.items() if key != "chunk_scores"},
+            })
+
+        latency = time.perf_counter() - start_ts
+        self._record("total", latency)
+        self.count("requests")
+        self.count(f"requests_{method}")
+        response["latency_ms"] = round(latency * 1000, 2)
+        return response
+
+    def metrics(self):
+        with self.lock:
+            counters = dict(self.counters)
+            latencies = {name: np.array(values) * 1000 for name, values in self.latencies.items()}
+        batches = sum(self.batcher.batch_sizes.values())
+        batched = sum(size * count for size, count in self.batcher.batch_sizes.items())
+
+        metrics = {
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": counters,
+            "batches": batches,
+            "mean_batch_size": round(batched / batches, 2) if batches else 0.0,
+            "queue_size": self.batcher.queue.qsize(),
+        }
+        for name, values in latencies.items():
+            if len(values):
+                metrics[f"{name}_latency_ms"] = {f"p{q}": round(float(np.percentile(values, q)), 2) for q in (50, 95, 99)}
+        if self.cache is not None:
+            metrics["semantic_cache"] = self.cache.report()
+        return metrics
+
+
+def _chunk_info(doc, score):
+    return {"chunk_id": get_chunk_id(doc), "score": score,
+            "source": doc.metadata.get("source"), "page": doc.metadata.get("page")}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """POST /query, GET /health, GET /metrics, GET /memory (JSON)."""
+
+    service = None
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(*self.service.health())
+        elif self.path == "/metrics":
+            self._send(200, self.service.metrics())
+        elif self.path == "/memory":
+            self._send(200, self.service.engine.memory_report())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self._send(404, {"error": "not found"})
+            return
+        if not self.service.warm:
+            # Sin esperar al hilo de calentamiento: el cliente reintenta cuando /health da 200
+            self.service.count("rejected_warming")
+            self._send(503, self.service.health()[1])
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            self._send(200, self.service.query(payload))
+        except (KeyError, ValueError) as e:
+            self.service.count("bad_requests")
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self.service.count("errors")
+            self._send(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        # Sin una línea por petición: las métricas van a /metrics
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    # Cola de conexiones pendientes amplia: el generador de carga abre muchas a la vez
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, api_key=None, max_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+          semantic_cache=False):
+    """
+    Arranca el servidor (bloquea hasta Ctrl+C). El puerto se abre antes de calentar el motor,
+    que se carga en un hilo: /health da 503 "warming" hasta que está listo.
+    """
+    service = QueryService(api_key, max_size, max_wait_ms, semantic_cache)
+
+    QueryHandler.service = service
+    httpd = QueryServer((host, port), QueryHandler)
+    threading.Thread(target=service.warm_up, daemon=True).start()
+    print(f"🌐 Servidor en http://{host}:{port} (POST /query, GET /health, GET /metrics, GET /memory)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Parando servidor...")
+    finally:
+        httpd.server_close()
+        service.batcher.stop()
+
+
+if __name__ == "__main__":
+    # python -m src.server --port 8000
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Servidor local de consultas RAG")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--batch-size", type=int, default=BATCH_MAX_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_MAX_WAIT_MS)
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Caché semántica delante de query_rag (respuestas y recuperación de preguntas parecidas)")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, os.getenv("GOOGLE_API_KEY"), args.batch_size, args.batch_wait_ms,
+          args.semantic_cache)
@@ -0,0 +1,447 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from langchain_community.retrievers import BM25Retriever
+from src import ingestion, retrieval, rag_pipeline, context, queries
+from src.retrieval import get_chunk_id, bm25_with_scores, rrf_fuse
+from src.context import build_context
+from src.evidence_index import build_evidence_index, supporting_chunks, verify_ground_truth_index
+from src.evaluation import compute_retrieval_metrics
+from src.judge_cache import JudgeCache
+
+
+# --- CONFIGURACIÓN ---
+SWEEP_DIR = "./results/sweeps"
+CONFIG_FILE = "config.json"
+QUESTIONS_PATH = "./data/questions.json"
+ANSWER_CACHE_PATH = "./data/sweep_answer_cache.json"
+
+# Cortes de las métricas de recuperación guardadas por configuración
+SWEEP_KS = (1, 3, 5, 10)
+
+# Métrica por la que se ordena el leaderboard (columna del leaderboard)
+LEADERBOARD_METRIC = "ndcg"
+
+# Espacio de búsqueda por defecto: cada clave es una lista de valores a probar
+DEFAULT_SPACE = {
+    "chunking_method": ["recursive", "semantic"],
+    "chunk_size": [800, 1200],
+    "chunk_overlap": [200, 350],
+    "method": ["bm25", "dense", "hybrid", "cross_encoder"],
+    "hybrid_weights": [[0.5, 0.5], [0.3, 0.7]],
+    "top_k": [5, 8],
+    "rerank_candidates": [10, 20],
+}
+
+# Claves que definen el troceado: las configuraciones que las comparten usan el mismo índice
+CHUNKING_KEYS = ("chunking_method", "chunk_size", "chunk_overlap")
+
+
+def current_config():
+    """Configuración activa del pipeline (constantes de ingesta, recuperación y contexto)."""
+    return {
+        "chunking_method": ingestion.CHUNKING_METHOD,
+        "chunk_size": ingestion.CHUNK_SIZE,
+        "chunk_overlap": ingestion.CHUNK_OVERLAP,
+        "embedding_model": retrieval.EMBEDDING_MODEL,
+        "reranker_model": retrieval.RERANKER_MODEL,
+        "hybrid_weights": retrieval.HYBRID_WEIGHTS,
+        "rrf_c": retrieval.RRF_C,
+        "top_k": rag_pipeline.TOP_K,
+        "rerank_candidates": rag_pipeline.RERANK_CANDIDATES,
+        "llm_model": rag_pipeline.MODEL_NAME,
+        "answer_mode": rag_pipeline.answer_mode(),
+        "context_token_budget": context.context_token_budget(),
+        "compression_ratio": context.COMPRESSION_RATIO,
+        "evidence_judge": queries.EVIDENCE_JUDGE,
+    }
+
+
+def save_run_config(run_dir, config):
+    """Guarda la configuración de una ejecución en run_dir/config.json (sustituye a las notas a mano)."""
+    os.makedirs(run_dir, exist_ok=True)
+    record = dict(config, recorded_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    path = os.path.join(run_dir, CONFIG_FILE)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+    return path
+
+
+def load_space(path):
+    """Espacio de búsqueda declarado en un JSON ({parámetro: [valores]}); lo que falte se toma de DEFAULT_SPACE."""
+    with open(path, "r", encoding="utf-8") as f:
+        return {**DEFAULT_SPACE, **json.load(f)}
+
+
+# CONFIGURACIONES
+def normalize_config(config):
+    """
+    Anula los parámetros que no afectan a la configuración (p.ej. los pesos híbridos en BM25)
+    para que configuraciones equivalentes se evalúen una sola vez.
+    Devuelve None si la combinación no es válida.
+    """
+    config = dict(config)
+    if config["chunking_method"] == "semantic":
+        config["chunk_size"] = None
+        config["chunk_overlap"] = None
+    elif config["chunk_overlap"] >= config["chunk_size"]:
+        return None
+
+    if config["method"] not in ("hybrid", "cross_encoder"):
+        config["hybrid_weights"] = None
+    if config["method"] != "cross_encoder":
+        config["rerank_candidates"] = None
+    elif config["rerank_candidates"] < config["top_k"]:
+        return None
+    return config
+
+
+def _config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def grid_configs(space=None):
+    """Todas las combinaciones del espacio (sin duplicados equivalentes)."""
+    space = space or DEFAULT_SPACE
+    keys = list(space)
+    configs = {}
+    for values in itertools.product(*(space[k] for k in keys)):
+        config = normalize_config(dict(zip(keys, values)))
+        if config is not None:
+            configs.setdefault(_config_key(config), config)
+    return list(configs.values())
+
+
+def random_configs(n, space=None, seed=0):
+    """n combinaciones aleatorias distintas del espacio."""
+    space = space or DEFAULT_SPACE
+    rng = random.Random(seed)
+    configs = {}
+    for _ in range(n * 50):
+        if len(configs) >= n:
+            break
+        config = normalize_config({k: rng.choice(values) for k, values in space.items()})
+        if config is not None:
+            configs.setdefault(_config_key(config), config)
+    return list(configs.values())
+
+
+def chunking_key(config):
+    return tuple(config[k] for k in CHUNKING_KEYS)
+
+
+def run_name(config):
+    """Nombre corto y estable de una configuración."""
+    digest = hashlib.sha1(_config_key(config).encode("utf-8")).hexdigest()[:8]
+    return f"{config['method']}-{digest}"
+
+
+# ÍNDICE EN MEMORIA (uno por troceado, compartido por todas sus configuraciones)
+class SweepIndex:
+    """
+    BM25 + matriz de embeddings de un troceado, en memoria.
+    Replica el orden de RetrievalEngine (búsqueda densa exacta en lugar del HNSW de Chroma).
+    """
+
+    def __init__(self, chunks, embeddings, evidence_index):
+        self.chunks = chunks
+        self.matrix = np.asarray(embeddings, dtype=np.float32)
+        self.evidence_index = evidence_index
+        self.bm25 = BM25Retriever.from_documents(chunks)
+
+    def dense(self, query_embedding, k):
+        # MiniLM devuelve vectores normalizados: producto escalar = coseno
+        scores = self.matrix @ query_embedding
+        top_n = np.argsort(-scores, kind="stable")[:k]
+        return [(self.chunks[i], float(scores[i])) for i in top_n]
+
+    def retrieve(self, query, query_embedding, method, k, weights=None):
+        if method == "bm25":
+            return bm25_with_scores(self.bm25, query, k)
+        if method == "dense":
+            return self.dense(query_embedding, k)
+        return rrf_fuse([bm25_with_scores(self.bm25, query, k), self.dense(query_embedding, k)], weights)
+
+
+# Estado de cada proceso: PDF, modelos e índices cargados una sola vez
+_state = {}
+
+def _init_worker(torch_threads=None):
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+
+    with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    _state["pages"] = ingestion.load_pdf()
+    _state["embeddings"] = HuggingFaceEmbeddings(model_name=ingestion.EMBEDDING_MODEL_NAME)
+    _state["questions"] = questions
+    _state["question_embeddings"] = np.asarray(
+        _state["embeddings"].embed_documents([q["question"] for q in questions]), dtype=np.float32
+    )
+    _state["indexes"] = {}
+
+
+def _reranker():
+    if "reranker" not in _state:
+        from sentence_transformers import CrossEncoder
+        _state["reranker"] = CrossEncoder(retrieval.RERANKER_MODEL)
+    return _state["reranker"]
+
+
+def _get_index(key):
+    """Trocea, embebe e indexa evidencias una vez por troceado y proceso."""
+    if key in _state["indexes"]:
+        return _state["indexes"][key], 0.0
+
+    start_ts = time.time()
+    method, size, overlap = key
+    chunks = ingestion.split_pages(_state["pages"], method, _state["embeddings"],
+                                   size or ingestion.CHUNK_SIZE, overlap or ingestion.CHUNK_OVERLAP)
+    embeddings = _state["embeddings"].embed_documents([c.page_content for c in chunks])
+    evidence_index = build_evidence_index(chunks, QUESTIONS_PATH, index_path=None)
+    index = SweepIndex(chunks, embeddings, evidence_index)
+    _state["indexes"][key] = index
+    return index, time.time() - start_ts
+
+
+def evaluate_config(config, ks=SWEEP_KS):
+    """
+    Evalúa una configuración solo con recuperación (sin LLM).
+
+    Returns:
+        dict: Métricas del leaderboard, métricas por k y contexto enviado por pregunta.
+    """
+    index, build_seconds = _get_index(chunking_key(config))
+    questions = _state["questions"]
+    evaluable = [idx for idx in range(len(questions)) if supporting_chunks(index.evidence_index, idx)]
+
+    # Solo se recuperan top_k documentos: un k mayor mediría ceros de relleno, no la configuración
+    top_k = config["top_k"]
+    ks = sorted(k for k in set(ks) | {top_k} if k <= top_k)
+    gains = np.zeros((len(evaluable), top_k))
+    ideal_gains = np.zeros_like(gains)
+    n_relevant = np.zeros(len(evaluable))
+    latencies, contexts, context_tokens, found, recalls = [], {}, [], [], []
+
+    for row, q_idx in enumerate(evaluable):
+        question = questions[q_idx]["question"]
+        start_ts = time.perf_counter()
+        if config["method"] == "cross_encoder":
+            # Misma cascada que query_rag: candidatos híbridos y reranking
+            candidates = index.retrieve(question, _state["question_embeddings"][q_idx], "hybrid",
+                                        config["rerank_candidates"], config["hybrid_weights"])
+            docs = [doc for doc, _ in candidates]
+            scores = _reranker().predict([[question, doc.page_content] for doc in docs]) if docs else []
+            scored_docs = sorted(zip(docs, map(float, scores)), key=lambda x: x[1], reverse=True)[:top_k]
+        else:
+            scored_docs = index.retrieve(question, _state["question_embeddings"][q_idx], config["method"],
+                                         top_k, config["hybrid_weights"])
+        latencies.append(time.perf_counter() - start_ts)
+
+        support = supporting_chunks(index.evidence_index, q_idx)
+        for rank, (doc, _) in enumerate(scored_docs[:gains.shape[1]]):
+            gains[row, rank] = support.get(get_chunk_id(doc), 0.0)
+        best = sorted(support.values(), reverse=True)[:gains.shape[1]]
+        ideal_gains[row, :len(best)] = best
+        n_relevant[row] = len(support)
+
+        # Lo que llegaría al LLM: contexto fusionado y recortado al presupuesto
+        context_text, used_docs, stats = build_context([d for d, _ in scored_docs], [s for _, s in scored_docs],
+                                                       context.context_token_budget())
+        evidence, _, evidence_recall = verify_ground_truth_index(index.evidence_index, q_idx, used_docs)
+        contexts[q_idx] = context_text
+        context_tokens.append(stats["context_tokens"])
+        found.append(evidence)
+        recalls.append(evidence_recall)
+
+    metrics = compute_retrieval_metrics(gains, ideal_gains, n_relevant, ks)
+    at_k = metrics.set_index("k").loc[top_k]
+    latencies_ms = np.array(latencies) * 1000
+
+    summary = dict(config)
+    summary.update({
+        "run": run_name(config),
+        "n_questions": len(evaluable),
+        "n_chunks": len(index.chunks),
+        "recall": at_k["recall"],
+        "hit_rate": at_k["hit_rate"],
+        "mrr": at_k["mrr"],
+        "ndcg": at_k["ndcg"],
+        "evidence_rate": float(np.mean(found)) if found else 0.0,
+        "evidence_recall": float(np.mean(recalls)) if recalls else 0.0,
+        "context_tokens": float(np.mean(context_tokens)) if context_tokens else 0.0,
+        "latency_ms": float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+        "latency_p95_ms": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0.0,
+        "index_seconds": round(build_seconds, 2),
+    })
+    return {"summary": summary, "metrics": metrics, "contexts": contexts}
+
+
+# PRECISIÓN CON EL LLM (OPCIONAL, CON CACHÉ)
+class AnswerCache(JudgeCache):
+    """Respuestas del LLM por hash del prompt: contextos idénticos entre configuraciones no se repiten."""
+
+    def put(self, key, answer):
+        self.verdicts[key] = answer
+
+
+def llm_accuracy(contexts, api_key, cache=None):
+    """Precisión del LLM sobre los contextos de una configuración ({q_idx: contexto})."""
+    cache = cache or AnswerCache(ANSWER_CACHE_PATH)
+    with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    llm = None
+    correct = 0
+    for q_idx, context_text in contexts.items():
+        q = questions[q_idx]
+        formatted_prompt = rag_pipeline.prompt.format(
+            context=context_text, question=q["question"],
+            option_a=q["answers"]["A"], option_b=q["answers"]["B"],
+            option_c=q["answers"]["C"], option_d=q["answers"]["D"],
+        )
+        # El backend y el modelo forman parte de la clave: el sustituto local no contamina las respuestas reales
+        key = hashlib.sha1((rag_pipeline.llm_id() + "\n" + formatted_prompt).encode("utf-8")).hexdigest()
+        answer = cache.get(key)
+        if answer is None:
+            if llm is None:
+                llm = rag_pipeline.get_answer_llm(api_key)
+            rag_pipeline.wait_for_llm_slot()
+            answer = rag_pipeline.generate(llm, formatted_prompt, stop=rag_pipeline.ANSWER_STOP)[0].content.strip()
+            cache.put(key, answer)
+
+        match = re.search(r'(?i)\b([A-D])\b', answer)
+        correct += (match.group(1).upper() if match else "X") == q["correct_answer"]
+
+    cache.save()
+    return correct / len(contexts) if contexts else 0.0
+
+
+# MOTOR DEL BARRIDO
+def _evaluate_group(configs, ks):
+    """Todas las configuraciones de un troceado en el mismo proceso."""
+    return [(config, evaluate_config(config, ks)) for config in configs]
+
+
+def run_sweep(configs, name=None, workers=1, ks=SWEEP_KS, api_key=None, output_dir=SWEEP_DIR):
+    """
+    Evalúa una lista de configuraciones y genera el leaderboard.
+
+    Las configuraciones se agrupan por troceado: cada troceado es una tarea del pool,
+    que trocea, embebe e indexa las evidencias una sola vez y reutiliza ese índice
+    (y los embeddings de las preguntas) en todas las configuraciones de recuperación del grupo.
+
+    Args:
+        configs (list[dict]): Configuraciones (grid_configs / random_configs).
+        name (str): Nombre del barrido (carpeta en output_dir). Por defecto, la fecha.
+        workers (int): Procesos del pool (1 = en este proceso).
+        ks (tuple[int]): Cortes de las métricas por k.
+        api_key (str): Si se pasa, añade la precisión del LLM (respuestas cacheadas por prompt).
+        output_dir (str): Carpeta base de los barridos.
+
+    Returns:
+        pd.DataFrame: Leaderboard ordenado por LEADERBOARD_METRIC.
+    """
+    name = name or time.strftime("%Y%m%d-%H%M%S")
+    sweep_dir = os.path.join(output_dir, name)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    # Grupos por troceado: todas las configuraciones de un grupo, seguidas, al mismo proceso si es posible
+    configs = sorted(configs, key=lambda c: _config_key({k: c[k] for k in CHUNKING_KEYS}))
+    n_groups = len({chunking_key(c) for c in configs})
+    print(f"\n🧭 Barrido '{name}': {len(configs)} configuraciones, {n_groups} troceados, {workers} procesos")
+
+    if api_key:
+        from src.parallel import RateLimiter
+        rag_pipeline.set_rate_limiter(RateLimiter())
+    answer_cache = AnswerCache(ANSWER_CACHE_PATH) if api_key else None
+
+    start_ts = time.time()
+    rows = []
+
+    def record(config, result):
+        summary = result["summary"]
+        run_dir = os.path.join(sweep_dir, "runs", summary["run"])
+        save_run_config(run_dir, config)
+        result["metrics"].to_csv(os.path.join(run_dir, "metrics.csv"), index=False)
+        if answer_cache is not None:
+            summary["accuracy"] = llm_accuracy(result["contexts"], api_key, answer_cache)
+        rows.append(summary)
+        print(f"   ✅ {summary['run']}: {LEADERBOARD_METRIC}={summary[LEADERBOARD_METRIC]:.3f} "
+              f"| {summary['latency_ms']:.1f} ms | {len(rows)}/{len(configs)}")
+
+    if workers > 1:
+        # Texto de las páginas en la caché antes de arrancar: los workers no parsean el PDF
+        ingestion.load_pdf()
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(torch_threads,)) as pool:
+            # Un troceado por tarea: el índice se construye una vez y sirve a todo el grupo
+            groups = itertools.groupby(configs, key=chunking_key)
+            futures = [pool.submit(_evaluate_group, list(group), ks) for _, group in groups]
+            for future in as_completed(futures):
+                try:
+                    for config, result in future.result():
+                        record(config, result)
+                except Exception as e:
+                    print(f"   ❌ Troceado fallido: {e}")
+    else:
+        _init_worker()
+        for config in configs:
+            record(config, evaluate_config(config, ks))
+
+    if not rows:
+        print("❌ Ninguna configuración se pudo evaluar.")
+        return pd.DataFrame()
+
+    leaderboard = pd.DataFrame(rows)
+    sort_by = [LEADERBOARD_METRIC, "latency_ms"]
+    leaderboard = leaderboard.sort_values(sort_by, ascending=[False, True], ignore_index=True)
+    leaderboard.to_csv(os.path.join(sweep_dir, "leaderboard.csv"), index=False)
+
+    print(f"⏱️  Tiempo total: {time.time() - start_ts:.1f}s")
+    print(f"💾 Leaderboard guardado en {os.path.join(sweep_dir, 'leaderboard.csv')}")
+    columns = ["run", "chunking_method", "chunk_size", "chunk_overlap", "method", "top_k",
+               "recall", "mrr", "ndcg", "evidence_rate", "context_tokens", "latency_ms"]
+    if "accuracy" in leaderboard.columns:
+        columns.append("accuracy")
+    print(leaderboard[columns].head(10).round(3).to_string(index=False))
+    return leaderboard
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Barrido de hiperparámetros de troceado y recuperación")
+    parser.add_argument("--name", default=None, help="Carpeta del barrido en results/sweeps")
+    parser.add_argument("--space", default=None, help="JSON con el espacio de búsqueda ({parámetro: [valores]})")
+    parser.add_argument("--random", type=int, default=0, help="Nº de configuraciones aleatorias (0 = grid completo)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--llm", action="store_true", help="Añade la precisión del LLM (usa GOOGLE_API_KEY)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # python -m src.sweep --random 20 --workers 4
+    args = parse_args()
+    space = load_space(args.space) if args.space else DEFAULT_SPACE
+    configs = random_configs(args.random, space, args.seed) if args.random else grid_configs(space)
+
+    api_key = None
+    if args.llm:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+
+    run_sweep(configs, args.name, args.workers, api_key=api_key)
@@ -0,0 +1,65 @@
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.context import build_context, compress_documents, merge_chunks, split_sentences
+
+
+def _vector(text):
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    return rng.normal(size=8).tolist()
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return _vector(text)
+
+    def embed_documents(self, texts):
+        return [_vector(text) for text in texts]
+
+
+class FakeEngine:
+    embeddings = FakeEmbeddings()
+
+
+def _page_text(n_sentences=40):
+    return " ".join(f"Sentence number {i} describes the retrieval result of experiment {i * 7}." for i in range(n_sentences))
+
+
+def _overlapping_chunks(size=1200, overlap=350):
+    text = _page_text()
+    second_start = size - overlap
+    return [
+        Document(page_content=text[:size], metadata={"source": "paper.pdf", "page": 0, "start_index": 0}),
+        Document(page_content=text[second_start:second_start + size],
+                 metadata={"source": "paper.pdf", "page": 0, "start_index": second_start}),
+    ]
+
+
+def test_merge_by_offsets_rebuilds_page_text():
+    docs = _overlapping_chunks()
+    blocks = merge_chunks(docs)
+    assert len(blocks) == 1
+    assert blocks[0]["text"] == _page_text()[:1200 + 850]
+
+
+def test_compressed_docs_drop_offsets():
+    compressed, _ = compress_documents("retrieval result", _overlapping_chunks(), FakeEngine(), ratio=0.75)
+    assert compressed
+    for doc in compressed:
+        assert doc.metadata["compressed"]
+        assert "start_index" not in doc.metadata
+        assert doc.metadata["chunk_id"]
+
+
+def test_build_context_keeps_every_compressed_sentence():
+    compressed, stats = compress_documents("retrieval result", _overlapping_chunks(), FakeEngine(), ratio=0.75)
+    assert stats["tokens_after_compression"] < stats["tokens_before_compression"]
+
+    context_text, used_docs, _ = build_context(compressed, token_budget=None)
+    kept = [sentence for doc in compressed for sentence in split_sentences(doc.page_content)]
+    assert kept
+    for sentence in kept:
+        assert sentence in context_text
+    assert len(used_docs) == len(compressed)
@@ -0,0 +1,48 @@
+from src.early_stopping import RepetitionScheduler
+
+
+def _rows(repetition, answers):
+    """answers: {(question_id, método): (letra, acierto)}"""
+    return [{"question_id": q, "method": m, "repetition": repetition, "predicted": letter, "correct": correct}
+            for (q, m), (letter, correct) in answers.items()]
+
+
+def test_stable_pairs_are_skipped_after_min_repetitions():
+    scheduler = RepetitionScheduler(["bm25"], [1, 2], min_repetitions=3, max_repetitions=10, stable_runs=3)
+    for repetition in range(3):
+        # La pregunta 1 siempre responde A; la 2 alterna
+        scheduler.record(_rows(repetition, {(1, "bm25"): ("A", True),
+                                            (2, "bm25"): ("B" if repetition % 2 else "C", repetition % 2 == 1)}))
+        scheduler.update(repetition)
+        # Antes de MIN_REPETITIONS se repite todo
+        assert scheduler.skip_set(repetition) == set()
+
+    assert scheduler.converged((1, "bm25"))
+    assert not scheduler.converged((2, "bm25"))
+    assert scheduler.skip_set(3) == {(1, "bm25")}
+    assert not scheduler.done(3)
+
+
+def test_method_stops_when_interval_is_narrow_and_run_ends():
+    questions = list(range(1, 21))
+    scheduler = RepetitionScheduler(["dense"], questions, min_repetitions=3, max_repetitions=10,
+                                    target_ci_width=0.05)
+    for repetition in range(3):
+        scheduler.record(_rows(repetition, {(q, "dense"): ("A", q % 4 != 0) for q in questions}))
+        scheduler.update(repetition)
+
+    accuracy, half_width, n_converged = scheduler.method_estimate("dense")
+    assert accuracy == 0.75
+    assert half_width == 0.0 and n_converged == len(questions)
+    assert scheduler.finished_methods == {"dense": 3}
+    assert scheduler.done(3)
+
+    report = scheduler.report()
+    assert report["calls"] == 3 * len(questions)
+    assert report["saved_calls"] == 7 * len(questions)
+
+
+def test_max_repetitions_ends_the_run():
+    scheduler = RepetitionScheduler(["hybrid"], [1], min_repetitions=1, max_repetitions=2)
+    assert not scheduler.done(1)
+    assert scheduler.done(2)
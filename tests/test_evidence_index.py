@@ -0,0 +1,20 @@
+import json
+
+from langchain_core.documents import Document
+
+from src.evidence_index import build_evidence_index, is_index_current
+
+
+def test_index_stays_current_with_duplicate_chunks(tmp_path):
+    questions_path = tmp_path / "questions.json"
+    questions_path.write_text(json.dumps([{"paper_reference": "REFRAG compresses retrieved chunks."}]),
+                              encoding="utf-8")
+    # Dos chunks con el mismo texto (p.ej. una cabecera repetida) comparten id
+    chunks = [Document(page_content=text) for text in
+              ["REFRAG compresses retrieved chunks.", "Repeated header", "Repeated header", "Other text"]]
+
+    index = build_evidence_index(chunks, questions_path=str(questions_path), index_path=None)
+
+    assert is_index_current(index, chunks)
+    assert not is_index_current(index, chunks[:2])
+    assert index["questions"]["0"]["chunks"]
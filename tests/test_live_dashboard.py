@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from src.evaluation import method_accuracy, question_mean
+from src.live_dashboard import LiveStats, QuantileSketch
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(mean=0.5, sigma=1.0, size=20000)
+    sketch = QuantileSketch(0.01)
+    for value in values:
+        sketch.add(value)
+
+    for q in (0.5, 0.9, 0.95, 0.99):
+        expected = np.quantile(values, q, method="lower")
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+
+
+def test_merge_and_serialization_keep_quantiles():
+    rng = random.Random(1)
+    values = [rng.expovariate(1.0) for _ in range(5000)] + [0.0] * 50
+    full, first, second = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    for k, value in enumerate(values):
+        full.add(value)
+        (first if k % 2 else second).add(value)
+    first.merge(second)
+    restored = QuantileSketch.from_dict(first.to_dict())
+
+    for q in (0.0, 0.25, 0.5, 0.95, 1.0):
+        assert restored.quantile(q) == full.quantile(q)
+    assert restored.count == len(values)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_live_stats_weigh_each_question_like_the_offline_report():
+    # Repeticiones adaptativas: la pregunta 1 se repite 4 veces, la 2 solo una
+    rows = [{"run_id": "r", "method": "hybrid", "question_id": 1, "correct": k == 0, "found_evidence": True,
+             "status": "✅ ACIERTO" if k == 0 else "❌ FALLO TOTAL", "prompt_tokens": 100, "response_time": 1.0}
+            for k in range(4)]
+    rows.append({"run_id": "r", "method": "hybrid", "question_id": 2, "correct": True, "found_evidence": False,
+                 "status": "✅ ACIERTO", "prompt_tokens": 300, "response_time": 2.0})
+    stats = LiveStats("r")
+    for row in rows:
+        stats.update(row)
+    restored = LiveStats.from_dict(stats.to_dict())
+    df = pd.DataFrame(rows)
+
+    summary = restored.summary()["hybrid"]
+    assert summary["n"] == 5
+    assert summary["accuracy"] == method_accuracy(df)["hybrid"] == 0.625
+    assert summary["evidence"] == question_mean(df, "found_evidence")["hybrid"] == 0.5
+    assert summary["prompt_tokens"] == 200
+    assert restored.snapshot()["hybrid"]["status"]["FALLO TOTAL"] == 0.375
@@ -0,0 +1,48 @@
+import random
+from difflib import SequenceMatcher
+
+from src.matching import longest_match, super_clean
+
+
+def _brute_force_longest(a, b):
+    best = 0
+    for i in range(len(a)):
+        for j in range(len(b)):
+            size = 0
+            while i + size < len(a) and j + size < len(b) and a[i + size] == b[j + size]:
+                size += 1
+            best = max(best, size)
+    return best
+
+
+def _random_text(rng, n, alphabet):
+    return "".join(rng.choice(alphabet) for _ in range(n))
+
+
+def test_longest_match_equals_difflib():
+    rng = random.Random(0)
+    # Textos cortos y largos (>= 200 caracteres activan el autojunk de difflib)
+    for n_a, n_b, alphabet in [(20, 30, "ab"), (50, 120, "abc"), (80, 400, "abcdefgh"), (120, 900, "abcdefghijklmnop")]:
+        for _ in range(30):
+            a = _random_text(rng, n_a, alphabet)
+            b = _random_text(rng, n_b, alphabet)
+            expected = SequenceMatcher(None, a, b).find_longest_match(0, len(a), 0, len(b))
+            assert longest_match(a, b) == tuple(expected)
+
+
+def test_longest_match_without_autojunk_is_true_longest_substring():
+    rng = random.Random(1)
+    for _ in range(50):
+        a = _random_text(rng, 30, "abc")
+        b = _random_text(rng, 250, "abc")
+        i, j, size = longest_match(a, b, autojunk=False)
+        assert a[i:i + size] == b[j:j + size]
+        assert size == _brute_force_longest(a, b)
+
+
+def test_reference_found_in_cleaned_context():
+    reference = super_clean("Retrieval-augmented decoding (REFRAG) compresses chunks.")
+    context = super_clean("Intro text. " + "Retrieval augmented decoding, REFRAG, compresses chunks!" + " Tail.")
+    _, _, size = longest_match(reference, context)
+    assert size == len(reference)
+    assert longest_match("", context) == (0, 0, 0)
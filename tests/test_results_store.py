@@ -0,0 +1,38 @@
+import json
+
+from src.results_store import ResultLog
+
+
+def _row(question_id):
+    return {"run_id": "r", "repetition": 0, "question_id": question_id, "method": "bm25"}
+
+
+def _write_truncated(path):
+    # Una fila completa y otra a medias (corte brusco o escritura en curso de otro proceso)
+    path.write_text(json.dumps(_row(1)) + "\n" + json.dumps(_row(2))[:20], encoding="utf-8")
+
+
+def test_worker_log_leaves_unfinished_line_alone(tmp_path):
+    path = tmp_path / "log.jsonl"
+    _write_truncated(path)
+    before = path.read_bytes()
+
+    log = ResultLog(str(path), repair=False)
+    log.close()
+
+    assert path.read_bytes() == before
+    assert log.is_done("r", 0, 1, "bm25")
+    assert not log.is_done("r", 0, 2, "bm25")
+
+
+def test_repair_closes_cut_line_before_appending(tmp_path):
+    path = tmp_path / "log.jsonl"
+    _write_truncated(path)
+
+    with ResultLog(str(path)) as log:
+        log.append(_row(3))
+
+    reopened = ResultLog(str(path))
+    reopened.close()
+    assert reopened.is_done("r", 0, 1, "bm25")
+    assert reopened.is_done("r", 0, 3, "bm25")
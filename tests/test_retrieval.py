@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+from src.retrieval import BM25Index, ChunkStore, rrf_fuse, rrf_fuse_positions
+
+
+WORDS = ["retrieval", "context", "token", "chunk", "decoder", "encoder", "latency", "memory",
+         "attention", "compression", "policy", "reward", "paper", "model", "cache"]
+
+
+def _corpus(n_docs=60, seed=0):
+    rng = random.Random(seed)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) for _ in range(n_docs)]
+    # Textos repetidos: la fusión híbrida deduplica por contenido
+    texts[7] = texts[3]
+    texts[20] = texts[3]
+    return texts
+
+
+def _store(texts):
+    metadatas = [{"source": "paper.pdf", "page": i // 5, "start_index": 100 * (i % 5)} for i in range(len(texts))]
+    return ChunkStore([f"id-{i}" for i in range(len(texts))], texts, metadatas)
+
+
+def test_bm25_index_matches_bm25okapi():
+    texts = _corpus()
+    index = BM25Index(texts, preprocess_func=str.split)
+    reference = BM25Okapi([text.split() for text in texts])
+
+    for query in ["retrieval latency", "token compression policy", "cache cache model", "unknown words"]:
+        expected = reference.get_scores(query.split())
+        np.testing.assert_allclose(index.scores(query), expected, rtol=1e-12, atol=1e-12)
+
+        positions, scores = index.top_k(query, 5)
+        np.testing.assert_array_equal(positions, np.argsort(expected)[::-1][:5])
+        np.testing.assert_allclose(scores, expected[positions], rtol=1e-12, atol=1e-12)
+
+
+def test_rrf_fuse_positions_matches_rrf_fuse():
+    texts = _corpus()
+    store = _store(texts)
+    rng = random.Random(1)
+
+    # Un caso fijo con los tres chunks de texto idéntico en ambas ramas y casos aleatorios
+    cases = [[[3, 1, 20, 5], [7, 5, 3, 9]]]
+    cases += [[rng.sample(range(len(texts)), 15), rng.sample(range(len(texts)), 15)] for _ in range(20)]
+    for weights in ([0.5, 0.5], [0.3, 0.7]):
+        for lists in cases:
+            positions, scores = rrf_fuse_positions(lists, weights, store.content_key)
+            expected = rrf_fuse([[(store.document(i), 0.0) for i in result] for result in lists], weights)
+
+            assert [store.text(i) for i in positions] == [doc.page_content for doc, _ in expected]
+            np.testing.assert_allclose(scores, [score for _, score in expected])
+
+
+def test_chunk_store_round_trip():
+    texts = _corpus(30) + ["acentos: métrica, señal y “comillas”"]
+    metadatas = [{"source": "paper.pdf", "page": i, "start_index": 10 * i, "chunk_id": f"c{i}"}
+                 for i in range(len(texts))]
+    # Metadatos fuera de las columnas y chunks sin página ni offset
+    metadatas[4] = {"source": "other.pdf", "custom": "x", "chunk_id": "c4"}
+    store = ChunkStore([f"id-{i}" for i in range(len(texts))], texts, metadatas)
+
+    assert store.texts(range(len(texts))) == texts
+    for i, metadata in enumerate(metadatas):
+        assert store.document(i).metadata == metadata
+        assert store.position_of_chunk(metadata["chunk_id"]) == i
+    np.testing.assert_array_equal(store.positions_of(["id-3", "id-0"]), [3, 0])
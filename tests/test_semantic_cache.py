@@ -0,0 +1,90 @@
+import zlib
+
+import numpy as np
+
+from src import semantic_cache
+from src.retrieval import RetrievalEngine
+from src.semantic_cache import SemanticCache, cached_query_rag
+
+
+class FakeEmbeddings:
+    """Mismo vector para la misma pregunta; 'reworded' en la pregunta da un vector casi igual."""
+
+    def embed_query(self, text):
+        base = text.replace(" reworded", "")
+        vector = np.random.default_rng(zlib.crc32(base.encode("utf-8"))).normal(size=16)
+        if base != text:
+            vector = vector + 0.05
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEngine:
+    embeddings = FakeEmbeddings()
+
+    def collection_version(self):
+        return 0, 10
+
+
+OPTIONS = {"A": "a", "B": "b", "C": "c", "D": "d"}
+
+
+def _patch_pipeline(monkeypatch):
+    calls = {"retrieve": [], "query_rag": []}
+
+    def fake_retrieve(engine, question, method, query_embedding=None):
+        calls["retrieve"].append(query_embedding)
+        return (np.array([1, 2]), np.array([0.9, 0.8])), {"cascade": None}
+
+    def fake_query_rag(question, options, method, api_key, token_budget, compression_ratio, compression_scorer,
+                       retrieved=None):
+        calls["query_rag"].append(retrieved)
+        return "A", [], {"chunk_scores": [0.9, 0.8]}
+
+    monkeypatch.setattr(semantic_cache, "retrieve_for_method", fake_retrieve)
+    monkeypatch.setattr(semantic_cache, "query_rag", fake_query_rag)
+    return calls
+
+
+def test_miss_store_then_hit(monkeypatch):
+    calls = _patch_pipeline(monkeypatch)
+    cache = SemanticCache(FakeEngine())
+
+    # 1. Fallo: se recupera y se llama al LLM, y se guardan ambos niveles
+    _, _, stats = cached_query_rag(cache, "What does REFRAG compress?", OPTIONS, "hybrid", None)
+    assert stats["semantic_cache"] is None
+    assert len(calls["retrieve"]) == 1 and len(calls["query_rag"]) == 1
+
+    # 2. Misma pregunta y opciones: respuesta completa desde la caché
+    answer, _, stats = cached_query_rag(cache, "What does REFRAG compress?", OPTIONS, "hybrid", None)
+    assert (answer, stats["semantic_cache"]) == ("A", "answer")
+    assert len(calls["query_rag"]) == 1
+
+    # 3. Pregunta parecida con otras opciones: solo se reutilizan los chunks
+    other_options = dict(OPTIONS, A="other")
+    _, _, stats = cached_query_rag(cache, "What does REFRAG compress? reworded", other_options, "hybrid", None)
+    assert stats["semantic_cache"] == "retrieval"
+    assert len(calls["retrieve"]) == 1 and len(calls["query_rag"]) == 2
+    assert calls["query_rag"][-1] is calls["query_rag"][0]
+
+    report = cache.report()
+    assert (report["lookups"], report["answer_hits"], report["retrieval_hits"], report["misses"]) == (3, 1, 1, 1)
+
+
+def test_dense_search_sends_plain_lists_to_chroma():
+    class FakeCollection:
+        def query(self, query_embeddings, n_results, include):
+            # chromadb rechaza cualquier embedding que no sea una lista de Python
+            assert all(type(embedding) is list for embedding in query_embeddings)
+            return {"ids": [["id-1", "id-0"]], "distances": [[0.2, 0.4]]}
+
+    class FakeDB:
+        _collection = FakeCollection()
+
+        def get(self, include):
+            return {"ids": ["id-0", "id-1"], "documents": ["first chunk", "second chunk"], "metadatas": [{}, {}]}
+
+    engine = RetrievalEngine()
+    engine._db = FakeDB()
+    positions, scores = engine._dense_search("q", 2, np.ones(4, dtype=np.float32))
+    assert positions.tolist() == [1, 0]
+    np.testing.assert_allclose(scores, [0.9, 0.8])